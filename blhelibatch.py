@@ -0,0 +1,254 @@
+#!/usr/bin/python
+"""apply one settings profile to many BLHeli HEX/EEP files at once
+
+usage: python blhelibatch.py -p 'motor-timing=High, ppm-min-throttle=1140' \\
+            [-o OUTDIR] [-j PROCESSES] <file|directory|glob> ...
+
+files are spread over a process pool, each result is written atomically (see
+BLHeliHex.write) so a crash never leaves a half written image behind.  a
+file that fails to read, validate or write is reported and the rest of the
+batch carries on."""
+import argparse
+import contextlib
+import glob
+import multiprocessing
+import os
+import sys
+
+import blhelihex
+import blhelistats
+
+#file extensions we know how to edit, EEP = Atmel, HEX = SiLabs
+EXTENSIONS = ('HEX', 'EEP')
+
+def is_atmel(filename):
+    """returns True if filename looks like an Atmel EEP file"""
+    return filename.split('.')[-1].upper() == 'EEP'
+
+def parse_profile(text):
+    """parse a profile string such as 'motor-timing=High, closed-loop=4'
+    into a list of (setting, value) pairs.  values are kept as strings, they
+    are resolved against the layout when the profile is applied, see
+    resolve_value() and compile_profile()"""
+    profile = []
+    for item in text.replace('\n', ',').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if '=' not in item:
+            raise ValueError('expected setting=value, got "%s"' % item)
+        name, value = item.split('=', 1)
+        profile.append((name.strip().lower(), value.strip()))
+    return profile
+
+def resolve_value(blh, name, value):
+    """translate a profile value into what BLHeliHex.__setitem__ expects.
+    for settings with a dictionary 'fmt' the human readable value (ex: High)
+    is accepted as well as the raw BLHeli value"""
+    return _resolve(blh.schema, blh.schema.index[name], value)
+
+def _resolve(schema, i, value):
+    """resolve_value() for setting number i of schema, the Profile resolve
+    hook.  only strings are looked up, other values (ex: ints from a
+    Profile built in code) are taken as they are"""
+    if not isinstance(value, basestring):
+        return value
+    fmt = schema.fmt[i]
+    if type(fmt) is dict:
+        for k, v in fmt.iteritems():
+            if str(v).lower() == value.lower():
+                return k
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError('invalid value "%s" for "%s"' %
+                         (value, schema.names[i]))
+
+def compile_profile(profile):
+    """turn a parsed profile into a blhelihex.Profile, which validates it
+    once per layout however many images it is applied to.  a Profile is
+    returned as it is"""
+    if isinstance(profile, blhelihex.Profile):
+        return profile
+    return blhelihex.Profile(profile, _resolve)
+
+def apply_profile(blh, profile):
+    """apply a profile, parsed or compiled, to an already read BLHeliHex.
+    nothing is changed if any value is invalid"""
+    blh.apply(compile_profile(profile))
+
+def iter_paths(specs):
+    """like expand_paths() but yields the (path, relative name) pairs as
+    they're found instead of collecting them, in directory walk order and
+    without removing duplicates"""
+    for spec in specs:
+        if os.path.isdir(spec):
+            for root, dirs, files in os.walk(spec):
+                dirs.sort()
+                for f in sorted(files):
+                    if f.split('.')[-1].upper() in EXTENSIONS:
+                        path = os.path.join(root, f)
+                        yield path, os.path.relpath(path, spec)
+        else:
+            matches = glob.glob(spec) if glob.has_magic(spec) else [spec]
+            for path in matches:
+                yield path, os.path.basename(path)
+
+def expand_paths(specs):
+    """expand files, directories and glob patterns into a sorted list of
+    (path, relative name) pairs.  directories are searched recursively for
+    HEX/EEP files, the relative name is used to place the file in the
+    output directory"""
+    return sorted(dict(iter_paths(specs)).items())
+
+def error_message(e):
+    """the text reported for exception e, its class name when it has no
+    message"""
+    return str(e) or e.__class__.__name__
+
+def format_setting(blh, name, unknown=None):
+    """blh.printable(name), or unknown when the raw value isn't in the
+    setting's table"""
+    try:
+        return blh.printable(name)
+    except KeyError:
+        return unknown
+
+def chunksize(count, processes=None):
+    """the imap/map chunk size for count jobs over processes workers
+    (default: number of cores), work is handed out in chunks to keep ipc
+    overhead low on large batches"""
+    return max(1, count // ((processes or multiprocessing.cpu_count()) * 4))
+
+@contextlib.contextmanager
+def worker_pool(processes=None, initializer=None, initargs=()):
+    """a multiprocessing.Pool of processes workers (default: number of
+    cores) for the with block.  the workers finish their jobs when the block
+    completes and are killed if it raises, which includes a generator using
+    the pool being closed early"""
+    pool = multiprocessing.Pool(processes, initializer, initargs)
+    try:
+        yield pool
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def pool_imap(func, items, processes=None, ordered=False, initializer=None,
+              initargs=()):
+    """yields func(item) for every item of the list items, computed by a
+    worker_pool, in completion order or, if ordered, in the order of items"""
+    with worker_pool(processes, initializer, initargs) as pool:
+        imap = pool.imap if ordered else pool.imap_unordered
+        for result in imap(func, items, chunksize(len(items), processes)):
+            yield result
+
+#the compiled profile of a pool worker, see _init_worker()
+_profile = None
+
+def _init_worker(profile):
+    """pool initializer, every worker gets the profile once instead of with
+    each job, so it is validated once per worker and layout"""
+    global _profile
+    _profile = profile
+
+def _apply_one(job):
+    """pool worker, returns (path, error, stats) where error is None on
+    success and stats is the blhelistats phases dict for this file, or None
+    when not collecting.  must never raise, one bad file should not take
+    down the batch"""
+    path, dest, collect = job
+    profile = _profile
+    stats = blhelistats.Stats() if collect else None
+    old = blhelihex.set_stats(stats)
+    try:
+        blh = blhelihex.BLHeliHex()
+        blh.read(path, atmel=is_atmel(path))
+        apply_profile(blh, profile)
+        blh.write(dest)
+        error = None
+    except Exception as e:
+        error = error_message(e)
+    finally:
+        blhelihex.set_stats(old)
+    return (path, error, stats and stats.phases)
+
+def run_batch(paths, profile, outdir=None, processes=None, stats=None):
+    """apply profile to every (path, relative name) pair in paths using a
+    pool of processes.  yields (path, error) tuples as files complete, error
+    is None for files that were written successfully.  files that would
+    be written to the same output file (ex: ESC1.HEX in two directories
+    given with outdir) fail without being touched.  if stats (a
+    blhelistats.Stats) is given, the workers' timings are added to it"""
+    #output file => [(path, dest), ...]
+    by_dest = {}
+    for path, rel in paths:
+        dest = path if outdir is None else os.path.join(outdir, rel)
+        key = os.path.normcase(os.path.abspath(dest))
+        by_dest.setdefault(key, []).append((path, dest))
+    jobs = []
+    for key, claims in sorted(by_dest.iteritems()):
+        if len(claims) > 1:
+            for path, dest in claims:
+                yield path, '%s would also be written from %s' % (dest,
+                    ', '.join(p for p, d in claims if p != path))
+            continue
+        path, dest = claims[0]
+        if outdir is not None and not os.path.isdir(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+        jobs.append((path, dest, stats is not None))
+    if not jobs:
+        return
+
+    results = pool_imap(_apply_one, jobs, processes, False, _init_worker,
+                        (compile_profile(profile),))
+    for path, error, phases in results:
+        if phases is not None:
+            stats.merge(phases)
+        yield path, error
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='apply a settings profile to many BLHeli HEX/EEP files')
+    parser.add_argument('-p', '--profile', required=True,
+        help='settings to apply, ex: "motor-timing=High, closed-loop=Off". '
+             'prefix with @ to read the profile from a file')
+    parser.add_argument('-o', '--outdir',
+        help='write results here instead of modifying files in place')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+        help='number of worker processes (default: number of cores)')
+    parser.add_argument('--stats', action='store_true',
+        help='print time spent per phase, summed over all workers')
+    parser.add_argument('paths', nargs='+',
+        help='HEX/EEP files, directories or glob patterns')
+    args = parser.parse_args(argv)
+
+    text = args.profile
+    if text.startswith('@'):
+        with open(text[1:], 'r') as f:
+            text = f.read()
+    try:
+        profile = parse_profile(text)
+    except ValueError as e:
+        parser.error(str(e))
+
+    paths = expand_paths(args.paths)
+    stats = blhelistats.Stats() if args.stats else None
+    failed = 0
+    for path, err in run_batch(paths, profile, args.outdir, args.processes,
+                               stats):
+        if err is None:
+            print('OK   %s' % path)
+        else:
+            failed += 1
+            print('FAIL %s: %s' % (path, err))
+    print('%d files, %d ok, %d failed' %
+          (len(paths), len(paths) - failed, failed))
+    if stats is not None:
+        print(stats.summary())
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
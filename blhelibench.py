@@ -0,0 +1,278 @@
+#!/usr/bin/python
+"""benchmarks for the hot paths of BLHeliHex and the command line tools
+
+every benchmark runs against images from blhelicorpus, generated into a
+temporary directory, so runs are comparable between machines and versions.
+results are written as JSON, and a previous results file can be given to
+compare against:
+
+usage: python blhelibench.py [-o RESULTS] [-c BASELINE] [-t THRESHOLD]
+            [-k FILTER] [--large-size BYTES] [--quick]
+
+each benchmark is repeated and the best time per operation is reported, the
+mean is kept as well to show how noisy the run was.  with -c, the exit status
+is non-zero when a benchmark is slower than the baseline by more than the
+threshold factor."""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import blhelicache
+import blhelicorpus
+import blhelihex
+
+FORMAT = 1
+#the directory the tools live in, for the command line benchmarks
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+#(name, function) in the order they run, see benchmark()
+BENCHMARKS = []
+
+def benchmark(name):
+    """register a benchmark.  the decorated function takes a Fixture and
+    returns the function to time, so setup isn't measured"""
+    def register(fn):
+        BENCHMARKS.append((name, fn))
+        return fn
+    return register
+
+class Fixture(object):
+    """the images the benchmarks run on"""
+    def __init__(self, directory, large_size):
+        self.directory = directory
+        self.small = self._write('small.hex', blhelicorpus.silabs_image())
+        self.large = self._write('large.hex',
+                                 blhelicorpus.silabs_image(large_size))
+        self.eep = self._write('small.eep', blhelicorpus.atmel_image())
+        self.fleet = os.path.join(directory, 'fleet')
+        blhelicorpus.write_corpus(self.fleet, 16)
+
+    def _write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(text)
+        return path
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def read(self, path, settings_only=False):
+        blh = blhelihex.BLHeliHex()
+        blh.read(path, path.endswith('.eep'), settings_only)
+        return blh
+
+@benchmark('read/small')
+def bench_read_small(fx):
+    return lambda: fx.read(fx.small)
+
+@benchmark('read/eep')
+def bench_read_eep(fx):
+    return lambda: fx.read(fx.eep)
+
+@benchmark('read/large')
+def bench_read_large(fx):
+    return lambda: fx.read(fx.large)
+
+@benchmark('read/large-settings-only')
+def bench_read_settings_only(fx):
+    return lambda: fx.read(fx.large, settings_only=True)
+
+@benchmark('read/large-cached')
+def bench_read_cached(fx):
+    cache = blhelicache.ParseCache()
+    def run():
+        blh = blhelihex.BLHeliHex()
+        blh.read(fx.large, False, cache=cache)
+    return run
+
+@benchmark('setitem')
+def bench_setitem(fx):
+    blh = fx.read(fx.small)
+    def run():
+        blh['motor-timing'] = 1
+        blh['motor-timing'] = 5
+        blh['ppm-min-throttle'] = 1140
+        blh['closed-loop'] = 4
+    return run
+
+@benchmark('write/small')
+def bench_write_small(fx):
+    blh = fx.read(fx.small)
+    blh['motor-timing'] = 5
+    out = fx.path('out-small.hex')
+    return lambda: blh.write(out)
+
+@benchmark('write/large')
+def bench_write_large(fx):
+    blh = fx.read(fx.large)
+    blh['motor-timing'] = 5
+    out = fx.path('out-large.hex')
+    return lambda: blh.write(out)
+
+@benchmark('write/large-settings-only')
+def bench_write_settings_only(fx):
+    blh = fx.read(fx.large, settings_only=True)
+    blh['motor-timing'] = 5
+    out = fx.path('out-large.hex')
+    return lambda: blh.write(out)
+
+@benchmark('patch/large')
+def bench_patch(fx):
+    path = fx.path('patch.hex')
+    shutil.copy(fx.large, path)
+    blh = fx.read(path, settings_only=True)
+    values = [1, 5]
+    def run():
+        values.reverse()
+        blh['motor-timing'] = values[0]
+        blh.patch()
+    return run
+
+@benchmark('checksum')
+def bench_checksum(fx):
+    blh = fx.read(fx.small)
+    record = bytearray(range(16, 36))
+    return lambda: blh._checksum(record)
+
+@benchmark('printable/all')
+def bench_printable(fx):
+    blh = fx.read(fx.small)
+    keys = blh.keys()
+    def run():
+        for k in keys:
+            blh.printable(k)
+    return run
+
+@benchmark('printable/all-after-read')
+def bench_printable_cold(fx):
+    blh = fx.read(fx.small)
+    keys = blh.keys()
+    def run():
+        blh._vals = None
+        blh._printable = {}
+        for k in keys:
+            blh.printable(k)
+    return run
+
+@benchmark('cli/pyblheli-script')
+def bench_cli_script(fx):
+    script = fx._write('script.txt', 'oh %s\nes motor-timing 5\nls\n'
+                       'sh !%s\n' % (fx.small, fx.path('out-cli.hex')))
+    cmd = [sys.executable, os.path.join(HERE, 'pyblheli.py'), '-s', script]
+    return lambda: _run_quietly(cmd)
+
+@benchmark('cli/batch')
+def bench_cli_batch(fx):
+    cmd = [sys.executable, os.path.join(HERE, 'blhelibatch.py'), '-j', '1',
+           '-p', 'motor-timing=High', '-o', fx.path('out-batch'), fx.fleet]
+    return lambda: _run_quietly(cmd)
+
+def _run_quietly(cmd):
+    with open(os.devnull, 'wb') as null:
+        subprocess.check_call(cmd, stdout=null, stderr=null)
+
+def measure(fn, min_time=0.2, repeat=5):
+    """time fn, returns (best, mean, number): best and mean seconds per call
+    and the number of calls per repeat.  that number is grown until a repeat
+    takes at least min_time / repeat"""
+    timer = timeit.Timer(fn)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time / repeat or number >= 1 << 20:
+            break
+        number *= 10 if elapsed < min_time / repeat / 10 else 2
+    times = [t / number for t in timer.repeat(repeat, number)]
+    return min(times), sum(times) / len(times), number
+
+def run(names=None, large_size=1 << 20, min_time=0.2, repeat=5, log=None):
+    """run the benchmarks (all, or those whose name contains one of names)
+    and returns the results dict that gets written as JSON"""
+    directory = tempfile.mkdtemp(prefix='blhelibench')
+    results = {}
+    try:
+        fx = Fixture(directory, large_size)
+        for name, fn in BENCHMARKS:
+            if names and not any(n in name for n in names):
+                continue
+            best, mean, number = measure(fn(fx), min_time, repeat)
+            results[name] = {'best': best, 'mean': mean, 'number': number,
+                             'repeat': repeat}
+            if log is not None:
+                log('%-28s %12.3f us  (mean %.3f us, %d x %d)' %
+                    (name, best * 1e6, mean * 1e6, repeat, number))
+    finally:
+        shutil.rmtree(directory)
+    return {'format': FORMAT,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'large_size': large_size,
+            'results': results}
+
+def compare(baseline, current, threshold=1.2):
+    """returns [(name, baseline best, current best, ratio, regressed), ...]
+    for the benchmarks in both result dicts"""
+    rows = []
+    for name in sorted(current['results']):
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]['best']
+        new = current['results'][name]['best']
+        ratio = new / old if old else float('inf')
+        rows.append((name, old, new, ratio, ratio > threshold))
+    return rows
+
+def _log(text):
+    sys.stderr.write(text + '\n')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='benchmark BLHeliHex and the command line tools')
+    parser.add_argument('-o', '--output',
+        help='write the results to this JSON file (default: stdout)')
+    parser.add_argument('-c', '--compare',
+        help='compare against the results in this JSON file')
+    parser.add_argument('-t', '--threshold', type=float, default=1.2,
+        help='slowdown factor counted as a regression (default: 1.2)')
+    parser.add_argument('-k', '--filter', action='append',
+        help='only run benchmarks whose name contains this, repeatable')
+    parser.add_argument('--large-size', type=int, default=1 << 20,
+        help='bytes of code in the large image (default: %d)' % (1 << 20))
+    parser.add_argument('--quick', action='store_true',
+        help='fewer and shorter repeats, noisier numbers')
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        results = run(args.filter, args.large_size, 0.02, 3, _log)
+    else:
+        results = run(args.filter, args.large_size, log=_log)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    status = 0
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        for name, old, new, ratio, regressed in \
+                compare(baseline, results, args.threshold):
+            _log('%-28s %12.3f -> %12.3f us  x%.2f%s' %
+                 (name, old * 1e6, new * 1e6, ratio,
+                  '  REGRESSION' if regressed else ''))
+            if regressed:
+                status = 1
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
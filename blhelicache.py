@@ -0,0 +1,139 @@
+"""parse cache for BLHeliHex.read()
+
+the cache holds what read() gets out of hex parsing: the settings buffer and
+the offsets of the settings records.  opening a file that's in the cache
+skips parsing entirely.
+
+    cache = ParseCache(directory='~/.cache/pyblheli')
+    blh = blhelihex.BLHeliHex()
+    blh.read('BS12A.HEX', atmel=False, cache=cache)
+
+entries are kept in memory and, if a directory is given, on disk so they
+survive between runs.  both are bounded and evict the least recently used
+entry first."""
+import collections
+import cPickle
+import hashlib
+import mmap
+import os
+
+class ParseCache(object):
+    """LRU cache of parsed settings keyed by path, size and mtime, or by
+    the sha1 of the file contents when content_hash is True (slower, since
+    the file has to be hashed, but survives renames and copies)"""
+    def __init__(self, max_entries=4096, directory=None,
+                 max_disk_entries=None, content_hash=False):
+        self.max_entries = max_entries
+        self.content_hash = content_hash
+        self.directory = None
+        self.max_disk_entries = max_disk_entries or max_entries * 16
+        self._entries = collections.OrderedDict()
+        self._disk_count = 0
+        self.hits = 0
+        self.misses = 0
+        if directory is not None:
+            self.directory = os.path.expanduser(directory)
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            self._disk_count = len(self._disk_files())
+
+    def key(self, filename, st, f):
+        """returns the cache key for filename, st is its os.stat result and
+        f the open file"""
+        if not self.content_hash:
+            return (os.path.abspath(filename), st.st_size, st.st_mtime)
+        h = hashlib.sha1()
+        if st.st_size > 0:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                h.update(buf)
+            finally:
+                buf.close()
+        return h.hexdigest()
+
+    def get(self, key):
+        """returns the cached state for key, or None"""
+        state = self._entries.pop(key, None)
+        if state is None and self.directory is not None:
+            state = self._disk_get(key)
+        if state is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._remember(key, state)
+        return state
+
+    def put(self, key, state):
+        """cache state (a picklable tuple) under key"""
+        self._remember(key, state)
+        if self.directory is not None:
+            self._disk_put(key, state)
+
+    def clear(self):
+        """drop every entry, in memory and on disk"""
+        self._entries.clear()
+        if self.directory is not None:
+            for name in self._disk_files():
+                os.unlink(os.path.join(self.directory, name))
+            self._disk_count = 0
+
+    def _remember(self, key, state):
+        """insert key as the most recently used memory entry"""
+        self._entries.pop(key, None)
+        self._entries[key] = state
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_files(self):
+        return [n for n in os.listdir(self.directory) if n.endswith('.pcl')]
+
+    def _disk_path(self, key):
+        name = hashlib.sha1(repr(key)).hexdigest()
+        return os.path.join(self.directory, name + '.pcl')
+
+    def _disk_get(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                stored_key, state = cPickle.load(f)
+        except (IOError, EOFError, cPickle.UnpicklingError, ValueError):
+            return None
+        if stored_key != key:
+            return None
+        #mtime marks the entry as recently used for eviction
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return state
+
+    def _disk_put(self, key, state):
+        path = self._disk_path(key)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        existed = os.path.exists(path)
+        with open(tmp, 'wb') as f:
+            cPickle.dump((key, state), f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path)
+        if not existed:
+            self._disk_count += 1
+        if self._disk_count > self.max_disk_entries:
+            self._disk_evict()
+
+    def _disk_evict(self):
+        """remove the least recently used files until we're a tenth below
+        the limit, so we don't have to do this on every put"""
+        entries = []
+        for name in self._disk_files():
+            path = os.path.join(self.directory, name)
+            try:
+                entries.append((os.stat(path).st_mtime, path))
+            except OSError:
+                pass
+        entries.sort()
+        keep = self.max_disk_entries * 9 // 10
+        for mtime, path in entries[:max(0, len(entries) - keep)]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        self._disk_count = min(len(entries), keep)
@@ -0,0 +1,156 @@
+#!/usr/bin/python
+"""synthetic BLHeli HEX/EEP images for benchmarks and experiments
+
+images are valid intel HEX with a settings block holding a legal value for
+every setting of the layout, so they can be read, edited and written like
+real firmware.  SiLabs images get filler code around the settings at 0x1A00
+and can be made as large as needed (past 64K extended linear address
+records are used), Atmel EEP images hold just the eeprom.
+
+usage: python blhelicorpus.py [-n COUNT] [-s CODE_SIZE] [-r LAYOUT_REV]
+            [--atmel] [--crlf] [--seed SEED] OUTDIR"""
+import argparse
+import os
+import random
+import sys
+
+import blhelihex
+import ihex
+
+#address the filler code after the settings block starts at, leaving a gap
+#so the settings block ends where it should
+SILABS_CODE_RESUME = 0x1C00
+#bytes in the settings block of generated images
+SETTINGS_SIZE = 0x30 + 13
+#header values written into every image
+FW_REV = 14
+FW_SUBREV = 2
+LAYOUT_REV = 20
+
+def make_settings(family, layout_rev=LAYOUT_REV, size=SETTINGS_SIZE,
+                  rng=None):
+    """returns a settings buffer of size bytes for the layout registered for
+    family and layout_rev.  settings with a table get one of its values (the
+    first one, or a random one if rng is a random.Random), the rest get an
+    arbitrary byte.  the signature is always 0x55 0xAA"""
+    schema = blhelihex.schema_for(family, layout_rev)
+    if size < schema.size:
+        raise Exception('Settings block too short (%d bytes, expected %d)'
+                        % (size, schema.size))
+    buf = bytearray(size)
+    for i, name in enumerate(schema.names):
+        fmt = schema.fmt[i]
+        if type(fmt) is dict:
+            choices = sorted(fmt)
+            value = rng.choice(choices) if rng else choices[0]
+        else:
+            value = rng.randint(0, 0xFF) if rng else 0
+        buf[schema.pos[i]] = value
+    buf[0] = FW_REV
+    buf[1] = FW_SUBREV
+    buf[blhelihex.LAYOUT_REV_POS] = layout_rev
+    if 'signature-hi' in schema.index:
+        buf[schema.pos[schema.index['signature-hi']]] = 0x55
+    if 'signature-lo' in schema.index:
+        buf[schema.pos[schema.index['signature-lo']]] = 0xAA
+    return buf
+
+def _data_records(address, data, lines, base, record_size=16):
+    """append data records of record_size bytes for data at absolute
+    address to lines, adding an extended linear address record whenever the
+    upper 16 bits change.  returns the base in effect afterwards"""
+    for i in xrange(0, len(data), record_size):
+        addr = address + i
+        if addr >> 16 != base:
+            base = addr >> 16
+            lines.append(ihex.encode_record(0, ihex.EXT_LINEAR_ADDR,
+                bytearray([base >> 8, base & 0xFF])))
+        lines.append(ihex.encode_record(addr & 0xFFFF, ihex.DATA,
+                                        data[i:i+record_size]))
+    return base
+
+def _filler(size, rng):
+    """returns size bytes of pseudo random code"""
+    block = bytearray(rng.getrandbits(8) for i in xrange(4096))
+    out = block * (size // len(block) + 1)
+    del out[size:]
+    return out
+
+def silabs_image(code_size=0x1A00, layout_rev=LAYOUT_REV, eol='\n',
+                 settings=None, seed=0, record_size=16):
+    """returns the text of a SiLabs HEX image with code_size bytes of filler
+    code (at least one record before the settings), settings at 0x1A00 and
+    an end of file record, in data records of record_size bytes.  settings
+    defaults to make_settings()"""
+    rng = random.Random(seed)
+    if settings is None:
+        settings = make_settings(blhelihex.SILABS, layout_rev)
+    code = _filler(code_size, rng)
+    lines = []
+    before = min(code_size, 0x1A00)
+    base = _data_records(0, code[:before], lines, 0, record_size)
+    base = _data_records(0x1A00, settings, lines, base, record_size)
+    _data_records(SILABS_CODE_RESUME, code[before:], lines, base,
+                  record_size)
+    lines.append(ihex.encode_record(0, ihex.EOF, ''))
+    return eol.join(lines) + eol
+
+def atmel_image(layout_rev=LAYOUT_REV, eol='\n', settings=None,
+                record_size=16):
+    """returns the text of an Atmel EEP image holding just the settings"""
+    if settings is None:
+        settings = make_settings(blhelihex.ATMEL, layout_rev)
+    lines = []
+    _data_records(0, settings, lines, 0, record_size)
+    lines.append(ihex.encode_record(0, ihex.EOF, ''))
+    return eol.join(lines) + eol
+
+def write_corpus(directory, count, code_size=0x1A00, layout_rev=LAYOUT_REV,
+                 atmel=False, eol='\n', seed=0):
+    """write count images with random settings to directory, returns their
+    paths.  the same seed always gives the same files"""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    family = blhelihex.ATMEL if atmel else blhelihex.SILABS
+    rng = random.Random(seed)
+    paths = []
+    for n in xrange(count):
+        settings = make_settings(family, layout_rev, rng=rng)
+        if atmel:
+            path = os.path.join(directory, 'esc%05d.eep' % n)
+            text = atmel_image(layout_rev, eol, settings)
+        else:
+            path = os.path.join(directory, 'esc%05d.hex' % n)
+            text = silabs_image(code_size, layout_rev, eol, settings,
+                                seed + n)
+        with open(path, 'wb') as f:
+            f.write(text)
+        paths.append(path)
+    return paths
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='generate synthetic BLHeli HEX/EEP images')
+    parser.add_argument('-n', '--count', type=int, default=1,
+        help='number of images (default: 1)')
+    parser.add_argument('-s', '--code-size', type=int, default=0x1A00,
+        help='bytes of filler code in SiLabs images (default: %d)' % 0x1A00)
+    parser.add_argument('-r', '--layout-rev', type=int, default=LAYOUT_REV,
+        help='eeprom layout revision (default: %d)' % LAYOUT_REV)
+    parser.add_argument('--atmel', action='store_true',
+        help='generate Atmel EEP images instead of SiLabs HEX')
+    parser.add_argument('--crlf', action='store_true',
+        help='use \\r\\n line endings')
+    parser.add_argument('--seed', type=int, default=0,
+        help='random seed (default: 0)')
+    parser.add_argument('outdir', help='directory to write the images to')
+    args = parser.parse_args(argv)
+
+    paths = write_corpus(args.outdir, args.count, args.code_size,
+                         args.layout_rev, args.atmel,
+                         '\r\n' if args.crlf else '\n', args.seed)
+    print('%d images written to %s' % (len(paths), args.outdir))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
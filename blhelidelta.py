@@ -0,0 +1,153 @@
+#!/usr/bin/python
+"""compact settings deltas between a base image and its variants
+
+a delta records the MCU family and layout revision, the sha1 of the base
+file and the (offset, value) pairs that differ in the settings buffer.
+applying a delta to the base recreates the variant without storing it.
+
+usage: python blhelidelta.py diff BASE VARIANT DELTA
+       python blhelidelta.py apply BASE DELTA OUTPUT
+
+binary format, all integers big endian:
+    'BLHD'              magic
+    u8                  format version (1)
+    u8                  family (0 = SiLabs, 1 = Atmel)
+    u8                  eeprom layout revision
+    20 bytes            sha1 of the base file
+    u16                 number of changes
+    (u16, u8) * count   settings buffer offset, new value"""
+import argparse
+import binascii
+import collections
+import struct
+import sys
+
+import blhelibatch
+import blhelihex
+import blhelivariants
+
+MAGIC = 'BLHD'
+VERSION = 1
+_HEADER = struct.Struct('>4sBBB20sH')
+_CHANGE = struct.Struct('>HB')
+_FAMILIES = (blhelihex.SILABS, blhelihex.ATMEL)
+
+#family and layout_rev describe the base, base_sha1 is a hex digest and
+#changes a tuple of (offset, value) pairs
+Delta = collections.namedtuple('Delta',
+                               'family layout_rev base_sha1 changes')
+
+def make_delta(variant, base=None):
+    """returns the Delta turning base into variant, both read BLHeliHex
+    objects of the same layout.  without a base, the delta is between the
+    file variant was read from and its current (unsaved) settings.  the
+    delta is always against base as it is on disk, unsaved changes to base
+    are not part of it"""
+    if variant.settings_buf is None:
+        raise Exception('Must read a hex file first')
+    if base is None:
+        base = variant
+    elif (base.family, base.schema) != (variant.family, variant.schema):
+        raise Exception('base and variant use different layouts')
+    #the settings the base file hashed below holds
+    base_buf = bytearray(base.base_buf)
+    if len(base_buf) != len(variant.settings_buf):
+        raise Exception('base and variant settings differ in size')
+    changes = tuple((i, b) for i, (a, b) in
+                    enumerate(zip(base_buf, variant.settings_buf)) if a != b)
+    return Delta(base.family, base_buf[blhelihex.LAYOUT_REV_POS],
+                 base.content_hash(), changes)
+
+def dumps(delta):
+    """returns the binary form of a Delta"""
+    out = [_HEADER.pack(MAGIC, VERSION, _FAMILIES.index(delta.family),
+                        delta.layout_rev,
+                        binascii.unhexlify(delta.base_sha1),
+                        len(delta.changes))]
+    out.extend(_CHANGE.pack(pos, value) for pos, value in delta.changes)
+    return ''.join(out)
+
+def loads(data):
+    """parse the binary form of a Delta"""
+    if len(data) < _HEADER.size:
+        raise Exception('Delta is truncated')
+    magic, version, family, layout_rev, sha1, count = \
+        _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise Exception('Not a settings delta')
+    if version != VERSION:
+        raise Exception('Unsupported delta version %d' % version)
+    if family >= len(_FAMILIES):
+        raise Exception('Not a settings delta (unknown family %d)' % family)
+    if len(data) != _HEADER.size + count * _CHANGE.size:
+        raise Exception('Delta is truncated')
+    changes = tuple(_CHANGE.unpack_from(data, _HEADER.size + i*_CHANGE.size)
+                    for i in xrange(count))
+    return Delta(_FAMILIES[family], layout_rev, binascii.hexlify(sha1),
+                 changes)
+
+def check_base(base, delta, base_sha1=None):
+    """make sure delta was made against base, pass base_sha1 if the hash of
+    base is already known"""
+    if base.family != delta.family or \
+            base.settings_buf[blhelihex.LAYOUT_REV_POS] != delta.layout_rev:
+        raise Exception('Delta is for a different family or layout')
+    if (base_sha1 or base.content_hash()) != delta.base_sha1:
+        raise Exception('Delta was made against a different base image')
+    for pos, value in delta.changes:
+        if pos >= len(base.settings_buf):
+            raise Exception('Delta offset %d is outside the settings' % pos)
+
+def apply_delta(base, delta):
+    """apply delta to base (a read BLHeliHex) in memory, write() or patch()
+    it afterwards to save the result"""
+    check_base(base, delta)
+    for pos, value in delta.changes:
+        base.store_raw(pos, value)
+
+def write_deltas(base, deltas):
+    """write a file for each (filename, delta) pair in deltas, all made
+    against base.  base is hashed once and shared between files (see
+    blhelivariants.VariantWriter), so this is cheap enough to run per unit
+    at flash time.  yields each filename once it has been written"""
+    base_sha1 = base.content_hash()
+    writer = blhelivariants.VariantWriter(base)
+    for filename, delta in deltas:
+        check_base(base, delta, base_sha1)
+        writer.write_changes(filename, delta.changes)
+        yield filename
+
+def _read(path):
+    blh = blhelihex.BLHeliHex()
+    blh.read(path, blhelibatch.is_atmel(path))
+    return blh
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='create and apply BLHeli settings deltas')
+    sub = parser.add_subparsers(dest='command')
+    p = sub.add_parser('diff', help='write the delta from BASE to VARIANT')
+    p.add_argument('base')
+    p.add_argument('variant')
+    p.add_argument('delta')
+    p = sub.add_parser('apply', help='write BASE with DELTA applied')
+    p.add_argument('base')
+    p.add_argument('delta')
+    p.add_argument('output')
+    args = parser.parse_args(argv)
+
+    if args.command == 'diff':
+        delta = make_delta(_read(args.variant), _read(args.base))
+        with open(args.delta, 'wb') as f:
+            f.write(dumps(delta))
+        print('%d changes' % len(delta.changes))
+    else:
+        with open(args.delta, 'rb') as f:
+            delta = loads(f.read())
+        base = _read(args.base)
+        apply_delta(base, delta)
+        base.write(args.output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,224 @@
+#!/usr/bin/python
+"""stream the settings of a file tree out as JSON Lines, CSV or Parquet
+
+usage: python blheliexport.py [-f jsonl|csv|parquet] [-o OUTPUT] [-j PROCESSES]
+            [-b BATCH] <file|directory|glob> ...
+
+every file gets one row with its path, family, layout revision and every
+setting, both human readable (from the layout's fmt tables) and raw (under
+'<setting>.raw').  files that can't be read get a row with 'error' set.
+
+paths are found, decoded and written as a pipeline: the tree is walked
+lazily, files are decoded by a process pool one batch at a time (the next
+batch decodes while the current one is written) and rows are written as
+they come, so memory use depends on the batch size and not on the number of
+files.  Parquet output requires pyarrow and writes one row group per batch."""
+import argparse
+import csv
+import itertools
+import json
+import sys
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+import blhelibatch
+import blhelihex
+
+FORMATS = ('jsonl', 'csv', 'parquet')
+DEFAULT_BATCH = 4096
+
+def decode_file(path):
+    """returns the export row of one file as a dict.  pool worker, never
+    raises"""
+    blh = blhelihex.BLHeliHex()
+    try:
+        blh.read(path, blhelibatch.is_atmel(path), settings_only=True)
+    except Exception as e:
+        return {'path': path, 'error': blhelibatch.error_message(e)}
+    settings = {}
+    raw = {}
+    for name, value in blh.iteritems():
+        raw[name] = value
+        settings[name] = blhelibatch.format_setting(blh, name)
+    return {'path': path, 'family': blh.family,
+            'layout_rev': blh.settings_buf[blhelihex.LAYOUT_REV_POS],
+            'settings': settings, 'raw': raw}
+
+def _batches(iterable, size):
+    it = iter(iterable)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+def decode(paths, processes=None, batch_size=DEFAULT_BATCH):
+    """yields the export rows (see decode_file) of paths, an iterable of file
+    names, in order.  batches of batch_size files are decoded by a pool of
+    processes, at most two batches are in memory at a time"""
+    batches = _batches(paths, batch_size)
+    if processes == 1:
+        for batch in batches:
+            for path in batch:
+                yield decode_file(path)
+        return
+
+    chunksize = blhelibatch.chunksize(batch_size, processes)
+    with blhelibatch.worker_pool(processes) as pool:
+        pending = None
+        for batch in batches:
+            #start on this batch before handing out the previous one, so
+            #the workers are busy while the rows are written
+            result = pool.map_async(decode_file, batch, chunksize)
+            if pending is not None:
+                for row in pending.get():
+                    yield row
+            pending = result
+        if pending is not None:
+            for row in pending.get():
+                yield row
+
+def _columns(schema):
+    """the flat column names for a layout"""
+    columns = ['path', 'family', 'layout_rev', 'error']
+    columns.extend(schema.names)
+    columns.extend('%s.raw' % name for name in schema.names)
+    return columns
+
+def _flatten(row):
+    flat = {'path': row['path'], 'family': row.get('family'),
+            'layout_rev': row.get('layout_rev'), 'error': row.get('error')}
+    for name, value in row.get('settings', {}).iteritems():
+        flat[name] = value
+    for name, value in row.get('raw', {}).iteritems():
+        flat['%s.raw' % name] = value
+    return flat
+
+class JsonLinesWriter(object):
+    """one JSON object per row"""
+    def __init__(self, f, schema):
+        self.f = f
+
+    def write(self, row):
+        self.f.write(json.dumps(row, sort_keys=True) + '\n')
+
+    def close(self):
+        pass
+
+class CsvWriter(object):
+    """one line per row, columns from the layout schema.  settings of other
+    layouts that aren't in it are left out"""
+    def __init__(self, f, schema):
+        self.writer = csv.DictWriter(f, _columns(schema),
+                                     extrasaction='ignore')
+        self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow(_flatten(row))
+
+    def close(self):
+        pass
+
+class ParquetWriter(object):
+    """Parquet file, one row group per batch of rows.  human readable values
+    are stored as strings, raw values as uint8"""
+    def __init__(self, f, schema, batch_size=DEFAULT_BATCH):
+        if pyarrow is None:
+            raise Exception('pyarrow is required for Parquet output')
+        fields = [pyarrow.field('path', pyarrow.string()),
+                  pyarrow.field('family', pyarrow.string()),
+                  pyarrow.field('layout_rev', pyarrow.uint8()),
+                  pyarrow.field('error', pyarrow.string())]
+        fields.extend(pyarrow.field(name, pyarrow.string())
+                      for name in schema.names)
+        fields.extend(pyarrow.field('%s.raw' % name, pyarrow.uint8())
+                      for name in schema.names)
+        self.schema = pyarrow.schema(fields)
+        self.writer = pyarrow.parquet.ParquetWriter(f, self.schema)
+        self.batch_size = batch_size
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append(_flatten(row))
+        if len(self.rows) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if not self.rows:
+            return
+        arrays = []
+        for field in self.schema:
+            values = [r.get(field.name) for r in self.rows]
+            if field.type == pyarrow.string():
+                values = [None if v is None else str(v) for v in values]
+            arrays.append(pyarrow.array(values, type=field.type))
+        self.writer.write_table(
+            pyarrow.Table.from_arrays(arrays, schema=self.schema))
+        self.rows = []
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+WRITERS = {'jsonl': JsonLinesWriter, 'csv': CsvWriter,
+           'parquet': ParquetWriter}
+
+def export(paths, f, fmt='jsonl', processes=None, batch_size=DEFAULT_BATCH,
+           schema=None):
+    """decode paths and write their rows to the file object f in format
+    fmt.  schema gives the CSV/Parquet columns, the default layout by
+    default.  returns (rows, errors) counts"""
+    if fmt not in WRITERS:
+        raise Exception('Unknown export format %s' % fmt)
+    schema = schema or blhelihex.BLHeliHex.SCHEMA
+    if fmt == 'parquet':
+        writer = ParquetWriter(f, schema, batch_size)
+    else:
+        writer = WRITERS[fmt](f, schema)
+    rows = errors = 0
+    try:
+        for row in decode(paths, processes, batch_size):
+            writer.write(row)
+            rows += 1
+            if 'error' in row:
+                errors += 1
+    finally:
+        writer.close()
+    return rows, errors
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='export the settings of many BLHeli HEX/EEP files')
+    parser.add_argument('-f', '--format', choices=FORMATS, default='jsonl',
+        help='output format (default: jsonl)')
+    parser.add_argument('-o', '--output', default='-',
+        help='output file, - for stdout (default, not for parquet)')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+        help='number of worker processes (default: number of cores)')
+    parser.add_argument('-b', '--batch', type=int, default=DEFAULT_BATCH,
+        help='files decoded per batch (default: %d)' % DEFAULT_BATCH)
+    parser.add_argument('paths', nargs='+',
+        help='HEX/EEP files, directories or glob patterns')
+    args = parser.parse_args(argv)
+
+    if args.format == 'parquet' and pyarrow is None:
+        parser.error('pyarrow is required for parquet output')
+    paths = (path for path, rel in blhelibatch.iter_paths(args.paths))
+    if args.output == '-':
+        if args.format == 'parquet':
+            parser.error('parquet output needs a file, use -o')
+        rows, errors = export(paths, sys.stdout, args.format,
+                              args.processes, args.batch)
+    else:
+        with open(args.output, 'wb') as f:
+            rows, errors = export(paths, f, args.format, args.processes,
+                                  args.batch)
+    sys.stderr.write('%d files exported, %d unreadable\n' % (rows, errors))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,73 @@
-import binascii
+import array
+import hashlib
+import itertools
+import mmap
+import os
+import shutil
+import stat
+import struct
+import tempfile
+import timeit
+
+import ihex
+
+#MCU families, each has its own set of eeprom layouts
+SILABS = 'silabs'
+ATMEL = 'atmel'
+
+#absolute address of the settings block for each family
+SETTINGS_ADDR = {SILABS: 0x1A00, ATMEL: 0x0000}
+
+#every layout starts with fw-rev, fw-subrev and fw-eeprom-layout-rev
+HEADER_SIZE = 3
+LAYOUT_REV_POS = 2
+
+#permissions write() gives a file it creates, like open() would.  the umask
+#can only be read by setting it, so that's done once here rather than while
+#other threads may be creating files
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+_NEW_FILE_MODE = 0666 & ~_UMASK
+
+#instrumentation hook, see set_stats().  None when disabled, so the hot paths
+#pay for a global lookup and an 'is not None' test and nothing else
+_stats = None
+_timer = timeit.default_timer
+
+def set_stats(stats):
+    """install stats, an object with an add(phase, nbytes, seconds) method
+    such as blhelistats.Stats, to be told how much time and how many bytes
+    each phase of read(), write(), patch(), __setitem__, apply() and
+    printable() takes.  None turns instrumentation off.  returns the
+    previous stats"""
+    global _stats
+    old = _stats
+    _stats = stats
+    return old
+
+def _lap(stats, phase, nbytes, start):
+    """report phase as running from start until now, returns now so the
+    next phase can start from there"""
+    now = _timer()
+    stats.add(phase, nbytes, now - start)
+    return now
+
+def _copy_bytes(src, dst, count, chunk_size=1 << 16):
+    """copy count bytes from file object src to file object dst"""
+    while count > 0:
+        chunk = src.read(min(chunk_size, count))
+        if not chunk:
+            raise Exception('Unexpected end of file')
+        dst.write(chunk)
+        count -= len(chunk)
+
+def file_digest(filename, chunk_size=1 << 16):
+    """returns the sha1 hex digest of a file's contents"""
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            h.update(chunk)
+    return h.hexdigest()
 
 class ConstraintException(Exception):
     """this is exception is thrown when attempting to change a setting to an
@@ -15,115 +84,315 @@ class ConstraintException(Exception):
     def __str__(self):
         return self.msg
 
+class LayoutSchema(object):
+    """a layout (see BLHeliHex.LAYOUT) compiled into flat tuples indexed by
+    setting number, plus a struct which decodes every setting out of the
+    settings buffer in a single call.  schemas are built once and shared,
+    they never hold values"""
+    def __init__(self, layout):
+        #settings are numbered in eeprom order
+        self.names = tuple(sorted(layout, key=lambda k: layout[k]['pos']))
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+        self.pos = tuple(layout[k]['pos'] for k in self.names)
+        self.fmt = tuple(layout[k]['fmt'] for k in self.names)
+        self.input_fn = tuple(layout[k].get('input_fn') for k in self.names)
+        self.read_only = tuple(layout[k].get('read-only', False)
+                               for k in self.names)
+        self.formatters = tuple(_formatter(k, layout[k]['fmt'])
+                                for k in self.names)
+        #values accepted by settings with a dict 'fmt', None where any byte
+        #goes, so validate() tests membership instead of scanning fmt.keys()
+        self.allowed = tuple(frozenset(f) if type(f) is dict else None
+                             for f in self.fmt)
+        #setting number of each position that holds a setting
+        self.setting_at = dict((pos, i) for i, pos in enumerate(self.pos))
+        #number of bytes the settings buffer must hold
+        self.size = self.pos[-1] + 1
+
+        #one unsigned byte per setting, padding over unused positions
+        struct_fmt = ''
+        last = -1
+        for pos in self.pos:
+            if pos == last:
+                raise ValueError('Two settings at position %d' % pos)
+            if pos - last > 1:
+                struct_fmt += '%dx' % (pos - last - 1)
+            struct_fmt += 'B'
+            last = pos
+        self.struct = struct.Struct(struct_fmt)
+
+    def unpack(self, buf):
+        """decode every setting from buf, returns a tuple of values in
+        setting number order"""
+        if len(buf) < self.size:
+            raise Exception('Settings block too short (%d bytes, expected %d)'
+                            % (len(buf), self.size))
+        return self.struct.unpack_from(buf)
+
+    def format(self, i, val):
+        """returns val, the raw value of setting number i, in human
+        readable format"""
+        return self.formatters[i](val)
+
+    def validate(self, i, value):
+        """check value against the constraints of setting number i and
+        returns the byte BLHeli stores for it"""
+        name = self.names[i]
+        #make sure its not read only
+        if self.read_only[i] is True:
+            raise Exception('cannot change read only setting "%s"' % name)
+
+        #make sure value is valid by checking against the dictionary
+        #only useful in settings where 'fmt' key maps to a dict
+        #see BLHeliHex.LAYOUT for more information
+        allowed = self.allowed[i]
+        if allowed is not None and value not in allowed:
+            raise ConstraintException(name, value, self.fmt[i])
+
+        #check to see if we need to reformat user input
+        #this is done specifically for PPM values where
+        #a value such as 1044 has to be transformed to BLHeli's
+        #interpretationg by (1044-1000)/4
+        #that transformation is the 'input_fn' function
+        input_fn = self.input_fn[i]
+        if input_fn is not None:
+            value = input_fn(value)
+        if not 0 <= value <= 0xFF:
+            raise Exception('%s is out of range for "%s"' % (value, name))
+        return value
+
+class Profile(object):
+    """settings to apply together to any number of images, see
+    BLHeliHex.apply().  values are as for BLHeliHex.__setitem__, or as
+    resolve(schema, i, value) turns them into that when given.  a profile is
+    checked against a layout the first time it meets it and the resulting
+    (position, byte) pairs are kept, so applying it to thousands of images
+    of a few layouts validates every value only a few times"""
+    def __init__(self, values, resolve=None):
+        if isinstance(values, dict):
+            values = values.items()
+        self.values = tuple(values)
+        self.resolve = resolve
+        #schema => ((pos, byte), ...)
+        self._compiled = {}
+
+    def __getstate__(self):
+        #schemas hold lambdas and don't pickle, workers compile their own
+        state = self.__dict__.copy()
+        state['_compiled'] = {}
+        return state
+
+    def compile(self, schema):
+        """returns the ((pos, byte), ...) stores for schema, raising if any
+        value doesn't fit it"""
+        stores = self._compiled.get(schema)
+        if stores is None:
+            stores = []
+            for name, value in self.values:
+                if name not in schema.index:
+                    raise Exception('unrecognized setting "%s"' % name)
+                i = schema.index[name]
+                if self.resolve is not None:
+                    value = self.resolve(schema, i, value)
+                stores.append((schema.pos[i], schema.validate(i, value)))
+            stores = self._compiled[schema] = tuple(stores)
+        return stores
+
+def _formatter(name, fmt):
+    """returns a function turning a raw value into the human readable value
+    described by fmt (see BLHeliHex.LAYOUT), so the type of fmt is only
+    looked at once per setting"""
+    if type(fmt) is dict:
+        return fmt.__getitem__
+    elif type(fmt) is type(int):
+        return lambda val: val
+    elif callable(fmt):
+        return fmt
+    else:
+        raise Exception('Unknown format type for %s (%s)' %
+                        (name, type(fmt),))
+
+#layouts registered with register_layout(), keyed by (family, layout
+#revision).  None in either position acts as a wildcard
+_LAYOUTS = {}
+#the compiled schema of every registered layout as (layout, schema) keyed
+#by id(layout), the layout is kept so its id can't be reused.  schemas are
+#never dropped, images read at any time share one schema object per layout,
+#so comparing schemas with 'is' is safe
+_SCHEMAS = {}
+
+def register_layout(layout, family=None, revision=None):
+    """register a layout dict (see BLHeliHex.LAYOUT) for the given MCU family
+    (SILABS or ATMEL) and eeprom layout revision.  leaving family or revision
+    as None registers the layout as the fallback for any family/revision
+    without a more specific entry"""
+    _LAYOUTS[(family, revision)] = layout
+
+def _compiled(layout, schema=None):
+    """the schema of layout, compiled (or given as schema) on first use"""
+    entry = _SCHEMAS.get(id(layout))
+    if entry is None:
+        entry = (layout, schema or LayoutSchema(layout))
+        _SCHEMAS[id(layout)] = entry
+    return entry[1]
+
+def schema_for(family, revision):
+    """returns the compiled LayoutSchema for an MCU family and eeprom layout
+    revision.  each layout is only compiled once and every family/revision
+    that resolves to the same layout shares a schema"""
+    #most specific match first
+    for key in ((family, revision), (None, revision), (family, None),
+                (None, None)):
+        if key in _LAYOUTS:
+            break
+    else:
+        raise Exception('No layout registered for %s layout revision %s'
+                        % (family, revision))
+    return _compiled(_LAYOUTS[key])
+
 class BLHeliHex(object):
     """The main class for reading BLHeli hex files"""
-    def __init__(self):
-
-        #self.LAYOUT maps each setting to its various dependents
-        #'pos' is the byte position in th eeprom
-        #'fmt' is how to translate the value to a human readable format
-        #'val' (added after reading) is the integer value read from the hex
-        #'input_fn' is only for settings where BLHeli transforms the raw data
-        #   ex: ppm-min-throttle where the byte value is transformed to
-        #   the actual ppm value by x*4+1000.  The input function is the
-        #   inverse, so you can say hex['ppm-min-throttle'] = 1138 and the code
-        #   will put the correct byte value (1138-1000)/4 into the hex
-        #'read-only' is present and set to true for read only fields such as
-        #   the signature, firmware revision, etc
-
-        self.LAYOUT = {
-            #firmware revision
-            'fw-rev': {'pos': 0, 'fmt' : int, 'read-only' : True },
-            #firmware subrevision
-            'fw-subrev': {'pos': 1, 'fmt': int, 'read-only' : True},
-            #eeprom layout revision
-            'fw-eeprom-layout-rev': {'pos': 2, 'fmt': int, 'read-only' : True},
-            #eeprom signature high byte
-            'signature-hi' : {'pos':13, 'fmt': hex,
-                'read-only' : True}, #should be 0x55
-            #eeprom signature low byte
-            'signature-lo' : {'pos':14, 'fmt': hex,
-                'read-only' : True}, #should be 0xaa
-            #temperature protection
-            'temp-protection' : {'pos': 35,
-                'fmt': {1: 'Enabled', 0: 'Disabled'}},
-            #motor direction
-            'motor-direction': {'pos': 11,
-                'fmt' : {1: 'Normal', 2: 'Reversed', 3: 'Bidirectional'}},
-            #demag compensation
-            'demag-comp': {'pos': 31,
-                'fmt': {1: 'Disabled', 2: 'Low', 3: 'High'}},
-            #pwm frequency
-            'pwm-freq': {'pos': 10,
-                'fmt': {1: 'High', 2: 'Low', 3: 'DampedLight' }},
-            #motor timing
-            'motor-timing': {'pos': 21,
-                'fmt': {1: 'Low', 2: 'MediumLow', 3: 'Medium',
-                4: 'MediumHigh', 5: 'High'}},
-            #input polarity
-            'input-polarity': {'pos': 12,
-                'fmt': {1: 'Positive', 2: 'Negative'}},
-            #beep strength
-            'beep-strength': {'pos': 27, 'fmt': int},
-            #beacon strength
-            'beacon-strength': {'pos': 28, 'fmt': int},
-            #beacon delay
-            'beacon-delay': {'pos': 29,
-                'fmt': {1:'1 minute', 2: '2 minutes', 3: '5 minutes',
-                4: '10 minutes', 5: 'infinite'}},
-            #ppm min for throttle
-            'ppm-min-throttle': {'pos': 25,
-                'fmt': lambda x: x*4+1000, 'input_fn': lambda x: (x-1000)/4 },
-            #ppm max for throttle
-            'ppm-max-throttle': {'pos': 26,
-                'fmt': lambda x: x*4+1000, 'input_fn': lambda x: (x-1000)/4 },
-            #low voltage limiter
-            'low-volt-limiter': {'pos': 6, 'fmt': {1: 'Off', 2: '3.0V/c',
-                3: '3.1V/c', 4: '3.2V/c', 5: '3.3V/c', 6: '3.4V/c'}},
-            #closed loop ('governor') mode
-            'closed-loop': {'pos': 5,
-                'fmt': {1: 'HiRange', 2: 'MidRange', 3: 'LoRange', 4: 'Off'}},
-            #motor gain
-            'motor-gain': {'pos': 7,
-                'fmt' : {1:0.75, 2: 0.88, 3: 1.00, 4:1.12, 5: 1.25}}
-            }
-
-        #upon reading the settings, this is set to the index of the first line
-        #in the hex which describes the settings
-        self.settings_first_line_idx = -1
-        #and the last line
-        self.settings_last_line_idx = -1
+
+    #LAYOUT maps each setting to its various dependents
+    #'pos' is the byte position in th eeprom
+    #'fmt' is how to translate the value to a human readable format
+    #'input_fn' is only for settings where BLHeli transforms the raw data
+    #   ex: ppm-min-throttle where the byte value is transformed to
+    #   the actual ppm value by x*4+1000.  The input function is the
+    #   inverse, so you can say hex['ppm-min-throttle'] = 1138 and the code
+    #   will put the correct byte value (1138-1000)/4 into the hex
+    #'read-only' is present and set to true for read only fields such as
+    #   the signature, firmware revision, etc
+
+    LAYOUT = {
+        #firmware revision
+        'fw-rev': {'pos': 0, 'fmt' : int, 'read-only' : True },
+        #firmware subrevision
+        'fw-subrev': {'pos': 1, 'fmt': int, 'read-only' : True},
+        #eeprom layout revision
+        'fw-eeprom-layout-rev': {'pos': 2, 'fmt': int, 'read-only' : True},
+        #eeprom signature high byte
+        'signature-hi' : {'pos':13, 'fmt': hex,
+            'read-only' : True}, #should be 0x55
+        #eeprom signature low byte
+        'signature-lo' : {'pos':14, 'fmt': hex,
+            'read-only' : True}, #should be 0xaa
+        #temperature protection
+        'temp-protection' : {'pos': 35,
+            'fmt': {1: 'Enabled', 0: 'Disabled'}},
+        #motor direction
+        'motor-direction': {'pos': 11,
+            'fmt' : {1: 'Normal', 2: 'Reversed', 3: 'Bidirectional'}},
+        #demag compensation
+        'demag-comp': {'pos': 31,
+            'fmt': {1: 'Disabled', 2: 'Low', 3: 'High'}},
+        #pwm frequency
+        'pwm-freq': {'pos': 10,
+            'fmt': {1: 'High', 2: 'Low', 3: 'DampedLight' }},
+        #motor timing
+        'motor-timing': {'pos': 21,
+            'fmt': {1: 'Low', 2: 'MediumLow', 3: 'Medium',
+            4: 'MediumHigh', 5: 'High'}},
+        #input polarity
+        'input-polarity': {'pos': 12,
+            'fmt': {1: 'Positive', 2: 'Negative'}},
+        #beep strength
+        'beep-strength': {'pos': 27, 'fmt': int},
+        #beacon strength
+        'beacon-strength': {'pos': 28, 'fmt': int},
+        #beacon delay
+        'beacon-delay': {'pos': 29,
+            'fmt': {1:'1 minute', 2: '2 minutes', 3: '5 minutes',
+            4: '10 minutes', 5: 'infinite'}},
+        #ppm min for throttle
+        'ppm-min-throttle': {'pos': 25,
+            'fmt': lambda x: x*4+1000, 'input_fn': lambda x: (x-1000)/4 },
+        #ppm max for throttle
+        'ppm-max-throttle': {'pos': 26,
+            'fmt': lambda x: x*4+1000, 'input_fn': lambda x: (x-1000)/4 },
+        #low voltage limiter
+        'low-volt-limiter': {'pos': 6, 'fmt': {1: 'Off', 2: '3.0V/c',
+            3: '3.1V/c', 4: '3.2V/c', 5: '3.3V/c', 6: '3.4V/c'}},
+        #closed loop ('governor') mode
+        'closed-loop': {'pos': 5,
+            'fmt': {1: 'HiRange', 2: 'MidRange', 3: 'LoRange', 4: 'Off'}},
+        #motor gain
+        'motor-gain': {'pos': 7,
+            'fmt' : {1:0.75, 2: 0.88, 3: 1.00, 4:1.12, 5: 1.25}}
+    }
+
+    #compiled form of LAYOUT, shared by all instances
+    SCHEMA = LayoutSchema(LAYOUT)
+
+    def __init__(self, schema=None):
+        #the layout schema in use.  unless one is forced here, read() picks
+        #it from the layout registry (see schema_for) using the header bytes
+        self.fixed_schema = schema
+        self.schema = schema or self.SCHEMA
+        #MCU family of the file, SILABS or ATMEL, set by read()
+        self.family = None
+        #the value of each setting, see the vals property
+        self._vals = None
+        #printable() results by setting name, dropped when a setting changes
+        self._printable = {}
+
+        #upon reading the settings, this is set to the list of hex records
+        #which describe the settings, as (offset, end, rtype, address,
+        #abs_address, length) tuples (see ihex.iter_records)
+        self.settings_records = None
+        #absolute address of the settings block
+        self.settings_addr = None
         #the actual byte buffer of the settings
         self.settings_buf = None
-
-        #upon reading, this is set to the hex file data as a list of lines
+        #bytes of the first settings record that come before the settings
+        #address, when the block starts in the middle of a record
+        self.settings_lead = ''
+
+        #upon reading, this is set to the hex file data as a single string,
+        #the only copy of the file we hold on to.  it stays None after a
+        #settings only read, in which case write() copies the rest of the
+        #file from the source
         self.data = None
+        #the parsed memory image, see the image property
+        self._image = None
+        #the file we read from, along with its size and mtime at that time
+        self.filename = None
+        self.file_stat = None
+        #settings_records index of each byte in settings_buf, and the set of
+        #records changed since the file was read or last saved in place
+        self.record_of = None
+        self.dirty = set()
+        #settings_buf as it is in the file on disk, see blhelidelta
+        self.base_buf = None
+        #undo journal told about every change, see blhelijournal
+        self.journal = None
 
     def printable(self, setting_name):
         """returns the current value for a given setting
         in human readable format"""
-        if self.data is None:
+        if self.settings_buf is None:
             raise Exception('Must read file first')
 
-        v = self.LAYOUT[setting_name]
-        fmt = v['fmt']
-        if type(fmt) is dict:
-            return fmt[v['val']]
-        elif type(fmt) is type(int):
-            return v['val']
-        elif callable(fmt):
-            return fmt(v['val'])
-        else:
-            raise Exception('Unknown format type for %s (%s)' %
-                            (setting_name, type(fmt),))
+        try:
+            return self._printable[setting_name]
+        except KeyError:
+            pass
+        stats = _stats
+        if stats is not None:
+            start = _timer()
+        i = self.schema.index[setting_name]
+        text = self.schema.formatters[i](self.vals[i])
+        self._printable[setting_name] = text
+        if stats is not None:
+            _lap(stats, 'format', 1, start)
+        return text
 
 
     def constraints(self, setting_name):
         """if the given setting name has a dictionary list of possible values,
         return the dictionary (k,v maps blheli value => human readable value)
         otherwise return None"""
-        v = self.LAYOUT[setting_name]
-        fmt = v['fmt']
+        fmt = self.schema.fmt[self.schema.index[setting_name]]
         if type(fmt) is dict:
             return dict(fmt)
         else:
@@ -131,79 +400,250 @@ class BLHeliHex(object):
 
     def read_only(self, setting_name):
         """returns True if a setting is read only, False otherwise"""
-        v = self.LAYOUT[setting_name]
-        return v.get('read-only', False)
-
-    def read(self, filename, atmel):
-        """read the settings from a hex file"""
+        return self.schema.read_only[self.schema.index[setting_name]]
+
+    @property
+    def vals(self):
+        """the value of each setting, indexed by setting number (see
+        LayoutSchema).  decoded from settings_buf on first use"""
+        if self._vals is None and self.settings_buf is not None:
+            self._vals = array.array('B',
+                                     self.schema.unpack(self.settings_buf))
+        return self._vals
+
+    @property
+    def image(self):
+        """the parsed memory image of the file (see ihex.HexImage), parsed
+        when first used.  None after a settings only read"""
+        if self._image is None and self.data is not None:
+            self._image = ihex.HexImage()
+            self._image.load(self.data)
+            self._image.write(self.settings_addr, self.settings_buf)
+        return self._image
+
+    def read(self, filename, atmel, settings_only=False, cache=None):
+        """read the settings from a hex file.  with settings_only the file is
+        memory mapped and only the settings lines are decoded, the rest of the
+        file is never copied into memory, so large images cost about the same
+        as small ones to open.  cache is an optional blhelicache.ParseCache,
+        when the file is in it no hex parsing is done at all"""
 
         self.atmel = atmel
+        if self.atmel:
+            self.family = ATMEL
+        else:
+            self.family = SILABS
         #make sure if we're editin atmel processor data, its an eep file
         if self.atmel and filename.split('.')[-1].upper() != 'EEP':
             raise Exception('ATMEL processor uses EEP files')
         if not self.atmel and filename.split('.')[-1].upper() != 'HEX':
             raise Exception('SiLabs processor uses HEX files')
-        with open(filename, 'r') as f:
-            self.data = f.read().split('\n')
 
-        hex_buf = ''
-        in_settings = False  #set to True when we hit the settings block
-        num_lines = 0
-        if self.atmel:
-            line_start = ':100000'
-        else:
-            line_start = ':101A00'
-        #find all the settings lines and concatenate them into one hex buffer
-        for idx, line in enumerate(self.data):
-            #check to see if we're in the settings
-            #if so, keep reading until we hit the end which is demarcated by
-            #a line with <16 bytes
-            if in_settings is True:
-                #we count lines strictly as a sanity check, if this gets
-                #above 10 (arbitrarily) we've done something wrong
-                num_lines += 1
-                if num_lines > 10:
-                    raise Exception('Somethings fucky.  Should not have \
-                                    ten lines of settings')
-                #append this line
-                hex_buf += line[9:-2]
-                #check the length to see if we're done
-                line_len = int(line[1:3],16)
-                if line_len < 16:
-                    #this is the last line
-                    self.settings_last_line_idx = idx
-                    break
-            #settings for SiLabs start at 1A00, so we look for ':101A00'
-            #determine if we've found the settings block
-            if line.find(line_start) == 0:
-                in_settings = True
-                hex_buf = line[9:-2]
-                self.settings_first_line_idx = idx
-                num_lines = 1
-
-        #decode the hex into a byte string
-        self.settings_buf = bytearray(hex_buf.decode('hex'))
-        #read the actual settings
-        for v in self.LAYOUT.values():
-            idx = v['pos']
-            v['val'] = self.settings_buf[idx]
+        self.settings_addr = SETTINGS_ADDR[self.family]
+
+        stats = _stats
+        if stats is not None:
+            start = lap = _timer()
+        with open(filename, 'rb') as f:
+            st = os.fstat(f.fileno())
+            state = None
+            if cache is not None:
+                key = cache.key(filename, st, f)
+                state = cache.get(key)
+                if state is not None and (len(state) != 4 or
+                                          state[0] != self.settings_addr):
+                    state = None
+                f.seek(0)
+                if stats is not None:
+                    lap = _lap(stats, 'read.cache', 0, lap)
+
+            #either way only the settings records are decoded, the image
+            #property parses the rest of the file if it's ever needed
+            self._image = None
+            if settings_only and st.st_size > 0:
+                self.data = None
+                if state is None:
+                    buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    try:
+                        self._read_settings(buf)
+                    finally:
+                        buf.close()
+            else:
+                self.data = f.read()
+                if stats is not None:
+                    lap = _lap(stats, 'read.io', len(self.data), lap)
+                if state is None:
+                    self._read_settings(self.data)
+            if state is None and stats is not None:
+                lap = _lap(stats, 'read.decode',
+                           self.settings_records[-1][1] -
+                           self.settings_records[0][0], lap)
+
+            if state is not None:
+                self.settings_records = list(state[1])
+                self.settings_buf = bytearray(state[2])
+                self.settings_lead = state[3]
+            elif cache is not None:
+                cache.put(key, (self.settings_addr,
+                                tuple(self.settings_records),
+                                str(self.settings_buf), self.settings_lead))
+        self.filename = filename
+        self.file_stat = (st.st_size, st.st_mtime)
+        self.record_of = array.array('B', [0] * len(self.settings_buf))
+        for idx, rec in enumerate(self.settings_records):
+            i = rec[4] - self.settings_addr
+            for pos in xrange(max(i, 0), i + rec[5]):
+                self.record_of[pos] = idx
+        self.dirty = set()
+        self.base_buf = str(self.settings_buf)
+        self._use_settings()
+        if stats is not None:
+            _lap(stats, 'read', st.st_size, start)
+
+    def load_settings(self, buf, atmel):
+        """use buf, a settings block that didn't come from a file (from an
+        ESC, see blhelilink), as the settings.  the layout is picked from
+        its header like read() does.  there's no file to write() or
+        patch(), dirty holds 0 once anything has been changed"""
+        self.atmel = atmel
+        self.family = ATMEL if atmel else SILABS
+        self.settings_addr = SETTINGS_ADDR[self.family]
+        self.settings_buf = bytearray(buf)
+        self.settings_records = None
+        self.settings_lead = ''
+        self.data = None
+        self._image = None
+        self.filename = None
+        self.file_stat = None
+        #the whole block counts as one record
+        self.record_of = array.array('B', [0] * len(self.settings_buf))
+        self.dirty = set()
+        self.base_buf = str(self.settings_buf)
+        self._use_settings()
+
+    def _use_settings(self):
+        """settings_buf was just loaded, pick the layout for it"""
+        #earlier changes were made to different settings
+        if self.journal is not None:
+            self.journal.clear()
+        #pick the layout from the header and read the actual settings
+        if len(self.settings_buf) < HEADER_SIZE:
+            raise Exception('Settings block too short')
+        self.schema = self._layout(self.settings_buf)
+        if len(self.settings_buf) < self.schema.size:
+            raise Exception('Settings block too short (%d bytes, expected %d)'
+                            % (len(self.settings_buf), self.schema.size))
+        #settings are decoded when first used
+        self._vals = None
+        self._printable = {}
+
+    def _find_settings(self, buf):
+        """returns (offset, base) of the data record starting at the
+        settings address in buf, base being the extended address in effect
+        there, or None.  only record headers at the start of a line are
+        looked at, nothing is decoded"""
+        #settings for SiLabs start at 1A00, so we look for ':ll1A0000'
+        #records of any length ll
+        addr = self.settings_addr & 0xFFFF
+        for field in sorted(set(['%04X00' % addr, '%04x00' % addr])):
+            found = buf.find(field)
+            while found != -1:
+                pos = found - 3
+                if pos >= 0 and buf[pos] == ':' and \
+                        (pos == 0 or buf[pos-1] in '\r\n'):
+                    #the same 16 bit address can show up in other segments
+                    #of a multi segment image, make sure we're in the right
+                    #one
+                    base = ihex.base_at(buf, pos)
+                    if base + addr == self.settings_addr:
+                        return pos, base
+                found = buf.find(field, found + 1)
+        return None
+
+    def _read_settings(self, buf):
+        """locate the settings records in buf (the file text, or an mmap of
+        it) and decode them.  the common case, a record starting at the
+        settings address followed by the rest of the block, is decoded
+        without parsing the rest of the file.  anything else goes through
+        the address index of the whole file (see _index_settings)"""
+        self.settings_lead = ''
+        found = self._find_settings(buf)
+        if found is None:
+            return self._index_settings(buf)
+        pos, base = found
+        records = []
+        settings_buf = bytearray()
+        need = HEADER_SIZE
+        for offset, end, rtype, address, abs_address, data in \
+                ihex.iter_records(buf, pos, base):
+            #the block ends at a gap in the addresses or a record that isn't
+            #data, the rest may still be elsewhere in the file
+            if rtype != ihex.DATA or \
+                    abs_address != self.settings_addr + len(settings_buf):
+                break
+            records.append((offset, end, rtype, address, abs_address,
+                            len(data)))
+            settings_buf.extend(data)
+            if need == HEADER_SIZE and len(settings_buf) >= HEADER_SIZE:
+                need = self._layout(settings_buf).size
+            if len(settings_buf) >= need:
+                break
+        if len(settings_buf) < need:
+            return self._index_settings(buf)
+        self.settings_records = records
+        self.settings_buf = settings_buf
+
+    def _index_settings(self, buf):
+        """resolve the settings through the address index of the whole file
+        (see ihex.HexImage): the block can start in the middle of a record,
+        its records can be in any order and lines needn't be separated"""
+        image = ihex.HexImage()
+        image.load(buf)
+        addr = self.settings_addr
+        try:
+            settings_buf = image.read_upto(addr, HEADER_SIZE)
+        except KeyError:
+            raise Exception('Unable to find settings in file')
+        if len(settings_buf) >= HEADER_SIZE:
+            settings_buf = image.read_upto(addr,
+                                           self._layout(settings_buf).size)
+        records = [image.records[idx] for idx in
+                   image.records_in(addr, addr + len(settings_buf))]
+        #whole records are kept, so the block runs to the end of the last
+        #one and the bytes of the first one before the settings are kept
+        #aside
+        first = min(rec[4] for rec in records)
+        last = max(rec[4] + rec[5] for rec in records)
+        self.settings_records = records
+        self.settings_buf = image.read(addr, last - addr)
+        self.settings_lead = str(image.read(first, addr - first))
+
+    def _layout(self, settings_buf):
+        """the schema for a settings block, forced or picked from its
+        header"""
+        if self.fixed_schema is not None:
+            return self.fixed_schema
+        return schema_for(self.family, settings_buf[LAYOUT_REV_POS])
+
+    def verify(self):
+        """check every record of the file we read from (length, checksum,
+        addresses, end of file), see ihex.verify.  returns a list of error
+        dicts, empty if the file is valid"""
+        if self.filename is None:
+            raise Exception('Must read a hex file first')
+        if self.data is not None:
+            return ihex.verify(self.data)
+        with open(self.filename, 'rb') as f:
+            return ihex.verify(f.read())
 
     def _checksum(self, bytearr):
         """intel HEX file - line checksum function"""
-        chk = 0
-        for b in bytearr:
-            chk += b
-        return self._twos_comp(chk & 0xFF)
-
-    def _twos_comp(self, val):
-        """returns the two's complement of an 8 bit
-        number, used for checksums"""
-        return (~val & 0xFF)+1
+        return ihex.checksum(bytearr)
 
     def print_settings(self):
         """prints all the settings and their values
         in a two column format for easy viewing"""
-        keys = self.LAYOUT.keys()
+        keys = self.keys()
         #display settings in two columns
         s1 = ''
         s2 = ''
@@ -216,128 +656,261 @@ class BLHeliHex(object):
             print '%-32s %s' % (s1, s2)
 
     def write(self, filename):
-        """writes the updated hex data to 'filename'"""
-        if self.settings_first_line_idx == -1 or self.data is None:
+        """writes the updated hex data to 'filename'.  the data goes to a
+        temporary file in the same directory, which is synced to disk and
+        then renamed over 'filename', so a crash never leaves a half written
+        file behind.  an existing 'filename' keeps its permissions"""
+        if self.settings_records is None:
             raise Exception('Must read a hex file first')
+        stats = _stats
+        if stats is not None:
+            start = _timer()
 
-        #start address
-        if self.atmel:
-            base_addr = 0x0000
+        if self._image is not None:
+            self._image.write(self.settings_addr, self.settings_buf)
+
+        if self.data is None:
+            #settings only read, the rest of the file is copied from the
+            #source
+            self._check_source()
+        same = os.path.exists(filename) and \
+            os.path.samefile(filename, self.filename)
+        target = os.path.abspath(filename)
+        try:
+            mode = stat.S_IMODE(os.stat(target).st_mode)
+        except OSError:
+            mode = _NEW_FILE_MODE
+        #mkstemp picks a name no other thread or process is using
+        fd, tmp = tempfile.mkstemp(prefix='.%s.' % os.path.basename(target),
+                                   suffix='.tmp', dir=os.path.dirname(target))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if self.data is None:
+                    with open(self.filename, 'rb') as src:
+                        size = self._write_spliced(f, src, stats)
+                else:
+                    size = self._write_spliced(f, None, stats)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp, mode)
+            os.rename(tmp, target)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+        #we just rewrote the source, it now matches settings_buf
+        if same:
+            self._saved()
+        if stats is not None:
+            _lap(stats, 'write', size, start)
+
+    def patch(self):
+        """writes only the changed settings records straight into the file
+        we read from.  records keep their length, so each one is overwritten
+        in place at its known offset and the cost doesn't depend on the size
+        of the file.  unlike write() this is not crash safe"""
+        if self.settings_records is None:
+            raise Exception('Must read a hex file first')
+        self._check_source()
+        stats = _stats
+        if stats is not None:
+            start = _timer()
+
+        if self._image is not None:
+            self._image.write(self.settings_addr, self.settings_buf)
+
+        size = 0
+        with open(self.filename, 'r+b') as f:
+            for idx in sorted(self.dirty):
+                f.seek(self.settings_records[idx][0])
+                rec = self._encode_record(idx)
+                f.write(rec)
+                size += len(rec)
+            os.fsync(f.fileno())
+        self._saved()
+        if stats is not None:
+            _lap(stats, 'patch', size, start)
+
+    def _saved(self):
+        """the source file was just rewritten with settings_buf"""
+        #the file on disk is now the reference, self.data is out of date.
+        #from here on writes copy from the file like after a settings only
+        #read
+        self.data = None
+        st = os.stat(self.filename)
+        self.file_stat = (st.st_size, st.st_mtime)
+        self.dirty.clear()
+        self.base_buf = str(self.settings_buf)
+
+    def content_hash(self):
+        """returns the sha1 hex digest of the file we read from, as it is
+        on disk now"""
+        if self.filename is None:
+            raise Exception('Must read a hex file first')
+        self._check_source()
+        return file_digest(self.filename)
+
+    def _check_source(self):
+        """make sure the file we read from hasn't changed, the record
+        offsets would be wrong if it did"""
+        st = os.stat(self.filename)
+        if (st.st_size, st.st_mtime) != self.file_stat:
+            raise Exception('%s changed since it was read' % self.filename)
+
+    def record_data(self, idx, settings_buf=None):
+        """the data bytes of settings record idx taken from settings_buf,
+        or from a settings buffer of the same layout"""
+        if settings_buf is None:
+            settings_buf = self.settings_buf
+        abs_address, length = self.settings_records[idx][4:6]
+        i = abs_address - self.settings_addr
+        if i < 0:
+            return self.settings_lead[i:] + str(settings_buf[:i+length])
+        return settings_buf[i:i+length]
+
+    def _encode_record(self, idx):
+        """regenerate the text of settings record idx from settings_buf"""
+        offset, end, rtype, address = self.settings_records[idx][0:4]
+        return ihex.encode_record(address, rtype, self.record_data(idx))
+
+    def _write_spliced(self, f, src, stats=None):
+        """write the file to f with the settings records regenerated from
+        settings_buf.  everything else is copied from self.data, or from
+        the open source file src after a settings only read.  each record
+        keeps its address and length so the file layout doesn't change.
+        returns the number of bytes written"""
+        if stats is not None:
+            lap = _timer()
+        records = [self._encode_record(idx)
+                   for idx in xrange(len(self.settings_records))]
+        if stats is not None:
+            lap = _lap(stats, 'write.encode', sum(map(len, records)), lap)
+        pos = 0
+        for rec, text in zip(self.settings_records, records):
+            offset, end = rec[0:2]
+            if src is None:
+                f.write(self.data[pos:offset])
+            else:
+                src.seek(pos)
+                _copy_bytes(src, f, offset - pos)
+            f.write(text)
+            pos = end
+        if src is None:
+            f.write(self.data[pos:])
         else:
-            base_addr = 0x1A00
-        #length of settings buf
-        s_len = len(self.settings_buf)
-        i = 0
-
-        lines = []
-        #write it into intel hex format lines
-        while i < s_len:
-            #line length
-            l_len = 16
-            #make sure we don't overrun
-            if s_len - i < 16:
-                l_len = s_len - i
-
-            #format is  :llaaaarr[nn..]cc
-            #ll = line length (# of bytes, length of n)
-            #aaaa = address
-            #rr = record type (0x00 = data)
-            #nn.. = data
-            #cc = checksum, twos complement of (sum(nn..) & 0xFF)
-
-            addr = base_addr + i
-
-            line = bytearray()
-            #line length + address
-            line += bytearray([l_len, (addr & 0xFF00) >> 8, addr & 0xFF])
-            #record type
-            line.append(0x00)
-            #data
-            line += self.settings_buf[i:i+l_len]
-            chksum = self._checksum(line)
-            #checksum
-            line.append(chksum)
-
-            lines.append(':'+binascii.hexlify(line).upper())
-
-            i += 16
-
-        #chop out the old settings and insert the new
-        file_data = self.data[0:self.settings_first_line_idx] +\
-            lines + self.data[self.settings_last_line_idx+1:]
-
-        with open(filename,'w') as f:
-            f.write('\n'.join(file_data))
+            src.seek(pos)
+            shutil.copyfileobj(src, f)
+        size = f.tell()
+        if stats is not None:
+            _lap(stats, 'write.io', size, lap)
+        return size
 
 
     def __getitem__(self, name):
         """allows one to do blheliobj['setting-name'] to retrieve a value"""
-        if name in self.LAYOUT:
-            return self.LAYOUT[name]['val']
+        if name in self.schema.index:
+            return self.vals[self.schema.index[name]]
         else:
             raise Exception('unrecognized setting "%s"' % name)
 
+    def validate(self, name, value):
+        """check value against the constraints for setting 'name' and
+        returns the byte BLHeli stores for it, without changing anything"""
+        if name not in self.schema.index:
+            raise Exception('unrecognized setting "%s"' % name)
+        return self.schema.validate(self.schema.index[name], value)
+
     def __setitem__(self, name, value):
         """allows one to do blheliobj['setting-name'] = val to set a value"""
         #make sure we're updating a valid setting
-        if hasattr(self, 'LAYOUT') and name in self.LAYOUT:
-            v = self.LAYOUT[name]
-
-            #make sure its not read only
-            if v.get('read-only', False) is True:
-                raise Exception('cannot change read only setting "%s"' % name)
-
-            #make sure value is valid by checking against the dictionary
-            #only useful in settings where 'fmt' key maps to a dict
-            #see BLHeliHex.LAYOUT for more information
-            fmt = v['fmt']
-            if type(fmt) is dict:
-                constraints = fmt.keys()
-                if value not in constraints:
-                    raise ConstraintException(name, value, fmt)
-
-            #check to see if we need to reformat user input
-            #this is done specifically for PPM values where
-            #a value such as 1044 has to be transformed to BLHeli's
-            #interpretationg by (1044-1000)/4
-            #that transformation is the 'input_fn' function
-            if 'input_fn' in v:
-                v['val'] = v['input_fn'](value)
-            else:
-                v['val'] = value
-            #update the setting in the actual byte buffer as well
-            idx = v['pos']
-            self.settings_buf[idx] = v['val']
+        if name in self.schema.index:
+            stats = _stats
+            if stats is not None:
+                start = _timer()
+            value = self.validate(name, value)
+            self.store_raw(self.schema.pos[self.schema.index[name]],
+                           value)
+            if stats is not None:
+                _lap(stats, 'set', 1, start)
         else:
             super(BLHeliHex, self).__setattr__(name, value)
 
+    def apply(self, profile):
+        """set several settings at once.  profile is a Profile, or a dict or
+        list of (setting, value) pairs as for __setitem__.  every value is
+        validated before any is stored, so either all of them change or none
+        do.  with a journal attached the whole profile is one edit"""
+        if self.settings_buf is None:
+            raise Exception('Must read file first')
+        stats = _stats
+        if stats is not None:
+            start = _timer()
+        if not isinstance(profile, Profile):
+            profile = Profile(profile)
+        stores = profile.compile(self.schema)
+        if self.journal is not None:
+            with self.journal.group('apply'):
+                for pos, value in stores:
+                    self.store_raw(pos, value)
+        else:
+            for pos, value in stores:
+                self.store_raw(pos, value)
+        if stats is not None:
+            _lap(stats, 'apply', len(stores), start)
+
+    def store_raw(self, pos, value):
+        """put value at pos in settings_buf, keeping the decoded values,
+        printable() results, dirty records and the journal in step"""
+        if self.journal is not None:
+            self.journal.record(pos, self.settings_buf[pos], value)
+        self.settings_buf[pos] = value
+        self.dirty.add(self.record_of[pos])
+        i = self.schema.setting_at.get(pos)
+        if i is not None:
+            if self._vals is not None:
+                self._vals[i] = value
+            self._printable.pop(self.schema.names[i], None)
+
     #keys, values, and items, iteritems represent dict like functions for
     #traversing settings
     def keys(self):
-        return self.LAYOUT.keys()
+        return list(self.schema.names)
 
     def values(self):
-        if self.data is None:
+        if self.settings_buf is None:
             raise Exception('Must read file first')
-        for k in self.LAYOUT.keys():
-            yield self.LAYOUT[k]['val']
+        return iter(self.vals)
 
     def iteritems(self):
-        if self.data is None:
+        if self.settings_buf is None:
             raise Exception('Must read file first')
-        for k in self.LAYOUT.keys():
-            yield (k, self.LAYOUT[k]['val'])
+        return itertools.izip(self.schema.names, self.vals)
 
     def items(self):
         return list(self.iteritems())
 
 
+#the layout above is the only one documented so far, use it for every
+#family and revision until more specific layouts are registered
+#images of the default layout use the class schema
+_compiled(BLHeliHex.LAYOUT, BLHeliHex.SCHEMA)
+register_layout(BLHeliHex.LAYOUT)
+
+
 ##EXAMPLE USAGE
-def example():
+def example(filename=None, out_filename='out2.hex'):
+    #without a file, make up one (see blhelicorpus.py)
+    if filename is None:
+        import blhelicorpus
+        import tempfile
+        fd, filename = tempfile.mkstemp(suffix='.hex')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(blhelicorpus.silabs_image())
+
     #initialize the blheli hex reader
-    blh = BLHeliHex(atmel=False)
-    #read a hex file
-    blh.read('test2.hex')
+    blh = BLHeliHex()
+    #read a hex file, atmel=True for Atmel EEP files
+    blh.read(filename, atmel=False)
 
     #once the hex has been, a BLHeliHex functions much like a dict object
     #it implements keys() - returns all setting names
@@ -360,11 +933,11 @@ def example():
         print('%s => %s' % (k,v))
 
     #for the settings, you must provide the value as BLHeli expects it
-    #check self.LAYOUT in BLHeliHex.__init__ for what these values mean
+    #check BLHeliHex.LAYOUT for what these values mean
 
     blh['motor-gain'] = 1 #motor gain = x0.75
     blh['closed-loop'] = 2 #closed loop = MidRange
-    blh['temp-protection'] = 2 #temp protection = Disabled
+    blh['temp-protection'] = 0 #temp protection = Disabled
 
     #uncommenting the following line will raise an exception upon execution
     #you cannot change read-only settings
@@ -375,4 +948,4 @@ def example():
 
     #blh.print_settings()
 
-    blh.write('out2.hex')
+    blh.write(out_filename)
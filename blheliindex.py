@@ -0,0 +1,194 @@
+#!/usr/bin/python
+"""persistent SQLite index of the settings in a firmware collection
+
+usage: python blheliindex.py [-d DB] update <file|directory|glob> ...
+       python blheliindex.py [-d DB] query 'closed-loop=Off, beep-strength=40'
+
+update only decodes files whose size/mtime changed and whose content hash
+differs from what's indexed.  query answers from the database alone, no hex
+file is opened."""
+import argparse
+import os
+import sqlite3
+import sys
+
+import blhelibatch
+import blhelihex
+
+DEFAULT_DB = 'blheli-index.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    sha1 TEXT,
+    family TEXT,
+    layout_rev INTEGER,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS settings (
+    path TEXT,
+    name TEXT,
+    raw INTEGER,
+    value TEXT COLLATE NOCASE,
+    PRIMARY KEY (path, name)
+);
+CREATE INDEX IF NOT EXISTS settings_value ON settings (name, value);
+CREATE INDEX IF NOT EXISTS settings_raw ON settings (name, raw);
+"""
+
+class SettingsIndex(object):
+    """settings of many hex files stored in a SQLite database.  each file
+    has a row in 'files' and one row per setting in 'settings' holding the
+    raw and the human readable value"""
+    def __init__(self, db_path=DEFAULT_DB):
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def update(self, paths):
+        """index every file in paths that is new or changed since it was
+        last indexed.  a file that can't be opened (ex: deleted since paths
+        was listed) counts as failed and is dropped from the index.
+        returns (indexed, unchanged, failed) counts"""
+        indexed = unchanged = failed = 0
+        with self.db:
+            for path in paths:
+                path = os.path.abspath(path)
+                try:
+                    st = os.stat(path)
+                    row = self.db.execute(
+                        'SELECT size, mtime, sha1 FROM files WHERE path = ?',
+                        (path,)).fetchone()
+                    if row is not None and \
+                            row[0:2] == (st.st_size, st.st_mtime):
+                        unchanged += 1
+                        continue
+                    sha1 = blhelihex.file_digest(path)
+                except (OSError, IOError):
+                    self.db.execute('DELETE FROM settings WHERE path = ?',
+                                    (path,))
+                    self.db.execute('DELETE FROM files WHERE path = ?',
+                                    (path,))
+                    failed += 1
+                    continue
+                if row is not None and row[2] == sha1:
+                    #touched but not changed
+                    self.db.execute(
+                        'UPDATE files SET size = ?, mtime = ? WHERE path = ?',
+                        (st.st_size, st.st_mtime, path))
+                    unchanged += 1
+                    continue
+                if self._index_file(path, st, sha1):
+                    indexed += 1
+                else:
+                    failed += 1
+        return indexed, unchanged, failed
+
+    def _index_file(self, path, st, sha1):
+        """decode path and replace its rows, returns False if the file
+        couldn't be read (the error is indexed instead of its settings)"""
+        self.db.execute('DELETE FROM settings WHERE path = ?', (path,))
+        blh = blhelihex.BLHeliHex()
+        try:
+            blh.read(path, blhelibatch.is_atmel(path), settings_only=True)
+        except Exception as e:
+            self.db.execute('INSERT OR REPLACE INTO files VALUES '
+                            '(?, ?, ?, ?, NULL, NULL, ?)',
+                            (path, st.st_size, st.st_mtime, sha1,
+                             blhelibatch.error_message(e)))
+            return False
+        self.db.execute('INSERT OR REPLACE INTO files VALUES '
+                        '(?, ?, ?, ?, ?, ?, NULL)',
+                        (path, st.st_size, st.st_mtime, sha1, blh.family,
+                         blh.settings_buf[blhelihex.LAYOUT_REV_POS]))
+        rows = []
+        for name, raw in blh.iteritems():
+            value = blhelibatch.format_setting(blh, name)
+            if value is not None:
+                value = str(value)
+            rows.append((path, name, raw, value))
+        self.db.executemany('INSERT INTO settings VALUES (?, ?, ?, ?)', rows)
+        return True
+
+    def remove_missing(self):
+        """drop files that no longer exist from the index, returns how many
+        were dropped"""
+        gone = [(p,) for (p,) in self.db.execute('SELECT path FROM files')
+                if not os.path.exists(p)]
+        with self.db:
+            self.db.executemany('DELETE FROM settings WHERE path = ?', gone)
+            self.db.executemany('DELETE FROM files WHERE path = ?', gone)
+        return len(gone)
+
+    def query(self, criteria):
+        """returns the sorted paths of indexed files matching every
+        (setting, value) pair in criteria.  a value matches either the human
+        readable value (case insensitive) or, if it's a number, the raw
+        value"""
+        criteria = list(criteria)
+        if not criteria:
+            return [p for (p,) in
+                    self.db.execute('SELECT path FROM files '
+                                    'WHERE error IS NULL ORDER BY path')]
+        #one query per criterion, a file must be in all of them.  several
+        #criteria can be about the same setting
+        queries = []
+        params = []
+        for name, value in sorted(set(criteria)):
+            try:
+                raw = int(value)
+            except ValueError:
+                raw = None
+            queries.append('SELECT path FROM settings '
+                           'WHERE name = ? AND (value = ? OR raw = ?)')
+            params.extend([name, str(value), raw])
+        sql = '%s ORDER BY path' % ' INTERSECT '.join(queries)
+        return [p for (p,) in self.db.execute(sql, params)]
+
+    def errors(self):
+        """returns [(path, error), ...] for files that failed to index"""
+        return self.db.execute('SELECT path, error FROM files '
+                               'WHERE error IS NOT NULL ORDER BY path'
+                               ).fetchall()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='index and query the settings of BLHeli HEX/EEP files')
+    parser.add_argument('-d', '--db', default=DEFAULT_DB,
+        help='index database (default: %s)' % DEFAULT_DB)
+    sub = parser.add_subparsers(dest='command')
+    p = sub.add_parser('update', help='index new and changed files')
+    p.add_argument('paths', nargs='+',
+        help='HEX/EEP files, directories or glob patterns')
+    p = sub.add_parser('query', help='list files matching settings')
+    p.add_argument('criteria', nargs='?', default='',
+        help='ex: "closed-loop=Off, low-volt-limiter=3.3V/c"')
+    args = parser.parse_args(argv)
+
+    index = SettingsIndex(args.db)
+    try:
+        if args.command == 'update':
+            paths = [p for p, rel in blhelibatch.expand_paths(args.paths)]
+            indexed, unchanged, failed = index.update(paths)
+            removed = index.remove_missing()
+            for path, err in index.errors():
+                print('FAIL %s: %s' % (path, err))
+            print('%d indexed, %d unchanged, %d failed, %d removed' %
+                  (indexed, unchanged, failed, removed))
+        else:
+            try:
+                criteria = blhelibatch.parse_profile(args.criteria)
+            except ValueError as e:
+                parser.error(str(e))
+            for path in index.query(criteria):
+                print(path)
+    finally:
+        index.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
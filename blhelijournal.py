@@ -0,0 +1,184 @@
+"""undo/redo for edits to a BLHeliHex
+
+a journal attached to an image is told about every byte stored in its
+settings buffer (see BLHeliHex.store_raw) and keeps just the changed bytes, as
+(offset, old value, new value) triples.  undo puts the old values back, redo
+the new ones.  a snapshot is a position in the journal tagged with the edit
+just before it, so taking one costs nothing, restoring one only touches the
+bytes changed since, and a snapshot whose edits were undone and replaced by
+new ones is refused rather than restored to the wrong state.
+
+    journal = Journal(blh)
+    blh['motor-timing'] = 5
+    with journal.group('profile'):
+        apply_profile(blh, profile)
+    journal.undo()              #the whole profile
+    journal.undo()              #motor-timing
+    journal.redo()
+
+the edits a journal holds can be replayed onto other images of the same
+layout, to repeat a session's edits over a batch of files."""
+import contextlib
+
+class Journal(object):
+    """undo history of one BLHeliHex.  entries is the list of (label,
+    changes) edits, changes being a tuple of (offset, old, new) triples.
+    entries before position are applied, the rest can be redone"""
+    def __init__(self, blh):
+        self.blh = blh
+        self.entries = []
+        self.position = 0
+        #a serial number for every entry, and the one of the empty journal,
+        #so snapshots can tell the history they were taken in (see
+        #snapshot()).  numbers are never reused
+        self._serials = []
+        self._serial = 0
+        self._origin = 0
+        #changes of the group being recorded, see group()
+        self._group = None
+        self._label = None
+        blh.journal = self
+
+    def detach(self):
+        """stop recording changes to the image"""
+        if self.blh.journal is self:
+            self.blh.journal = None
+
+    def clear(self):
+        """forget all history, the image was reloaded"""
+        del self.entries[:]
+        del self._serials[:]
+        self.position = 0
+        self._serial += 1
+        self._origin = self._serial
+
+    def record(self, pos, old, new):
+        """called by BLHeliHex.store_raw before a byte changes"""
+        if old == new:
+            return
+        if self._group is not None:
+            self._group.append((pos, old, new))
+        else:
+            self._append(None, ((pos, old, new),))
+
+    def _append(self, label, changes):
+        #a new edit makes whatever was undone unreachable
+        del self.entries[self.position:]
+        del self._serials[self.position:]
+        self._serial += 1
+        self.entries.append((label, changes))
+        self._serials.append(self._serial)
+        self.position += 1
+
+    @contextlib.contextmanager
+    def group(self, label=None):
+        """record every change made in the with block as one entry"""
+        if self._group is not None:
+            #nested, the outer group gets everything
+            yield
+            return
+        self._group = []
+        try:
+            yield
+        finally:
+            changes, self._group = tuple(self._group), None
+            if changes:
+                self._append(label, changes)
+
+    def can_undo(self):
+        return self.position > 0
+
+    def can_redo(self):
+        return self.position < len(self.entries)
+
+    def _apply(self, changes, column):
+        """store the old (column 1) or new (column 2) values of changes
+        without recording them"""
+        self.blh.journal = None
+        try:
+            if column == 1:
+                changes = reversed(changes)
+            for change in changes:
+                self.blh.store_raw(change[0], change[column])
+        finally:
+            self.blh.journal = self
+
+    def undo(self):
+        """undo the last edit, returns its (label, changes) or None if there
+        is nothing to undo"""
+        if not self.can_undo():
+            return None
+        self.position -= 1
+        entry = self.entries[self.position]
+        self._apply(entry[1], 1)
+        return entry
+
+    def redo(self):
+        """redo the last undone edit, returns its (label, changes) or None
+        if there is nothing to redo"""
+        if not self.can_redo():
+            return None
+        entry = self.entries[self.position]
+        self._apply(entry[1], 2)
+        self.position += 1
+        return entry
+
+    def _tag(self, position):
+        """serial number of the entry before position"""
+        return self._serials[position-1] if position else self._origin
+
+    def snapshot(self):
+        """returns a marker for the current state, see restore().  two
+        snapshots compare equal when they mark the same state"""
+        return (self.position, self._tag(self.position))
+
+    def _position_of(self, snapshot):
+        """the position of snapshot, which must still be in the journal"""
+        position, tag = snapshot
+        if not 0 <= position <= len(self.entries) or \
+                self._tag(position) != tag:
+            raise Exception('Snapshot is no longer in the journal')
+        return position
+
+    def restore(self, snapshot):
+        """undo or redo until the image is as it was at snapshot"""
+        position = self._position_of(snapshot)
+        while self.position > position:
+            self.undo()
+        while self.position < position:
+            self.redo()
+
+    def changes(self, since=None):
+        """returns the net (offset, value) changes made between snapshot
+        since (the start of the journal by default) and now, one per changed
+        byte, in offset order"""
+        start = 0 if since is None else self._position_of(since)
+        if start > self.position:
+            raise Exception('Snapshot is ahead of the journal')
+        net = {}
+        for label, changes in self.entries[start:self.position]:
+            for pos, old, new in changes:
+                net[pos] = new
+        return sorted(net.iteritems())
+
+    def replay(self, blh, since=None):
+        """apply the edits made since snapshot since to another image with
+        the same layout.  values are copied as they are, they were validated
+        when first set"""
+        if blh.schema is not self.blh.schema or \
+                blh.family != self.blh.family:
+            raise Exception('Cannot replay onto an image with a different '
+                            'layout')
+        changes = self.changes(since)
+        size = len(blh.settings_buf)
+        for pos, value in changes:
+            if pos >= size:
+                raise Exception('Change at %d is outside the settings' % pos)
+        journal = blh.journal
+        if journal is not None:
+            with journal.group('replay'):
+                for pos, value in changes:
+                    blh.store_raw(pos, value)
+        else:
+            for pos, value in changes:
+                blh.store_raw(pos, value)
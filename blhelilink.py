@@ -0,0 +1,434 @@
+#!/usr/bin/python
+"""read and write ESC settings over a serial link, many ESCs at once
+
+the ESC side speaks the BLHeli bootloader protocol.  every command is sent
+with a CRC16 (poly 0xA001, low byte first) and answered with an ack byte:
+    0xFF 00 hi lo       set address
+    0xFE 00 00 len      set buffer, followed by len bytes (0 = 256) + crc
+    0x01 01             program the buffer into flash at the address
+    0x02 01             erase the 512 byte flash page at the address
+    0x03 len            read len bytes of flash, answered by data + crc
+    0x04 len            read len bytes of eeprom, answered by data + crc
+    0x05 01             program the buffer into eeprom at the address
+SiLabs ESCs keep the settings in flash at 0x1A00, Atmel ESCs in eeprom at 0.
+settings read from an ESC come back as a BLHeliHex (see load_settings), so
+they're edited exactly like a file.
+
+links block on I/O in their own thread, so configuring a rack of ESCs takes
+about as long as the slowest one:
+
+    links = [ESCLink(open_serial(port)) for port in ports]
+    for blh, error in configure(links, parse_profile('motor-timing=High')):
+        ...
+
+SimulatedESC serves a hex image over a socketpair so all of this can be
+tried without hardware.
+
+usage: python blhelilink.py -p PROFILE PORT ...
+       python blhelilink.py -p PROFILE --simulate N IMAGE"""
+import argparse
+import array
+import multiprocessing.pool
+import socket
+import sys
+import threading
+import time
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+import blhelibatch
+import blhelihex
+import ihex
+
+#bootloader commands
+CMD_RUN = 0x00
+CMD_PROG_FLASH = 0x01
+CMD_ERASE_FLASH = 0x02
+CMD_READ_FLASH = 0x03
+CMD_READ_EEPROM = 0x04
+CMD_PROG_EEPROM = 0x05
+CMD_KEEP_ALIVE = 0xFD
+CMD_SET_BUFFER = 0xFE
+CMD_SET_ADDRESS = 0xFF
+
+#ack bytes
+ACK_SUCCESS = 0x30
+ACK_ERROR_VERIFY = 0xC0
+ACK_ERROR_COMMAND = 0xC1
+ACK_ERROR_CRC = 0xC2
+
+#bytes of flash erased by one erase command
+PAGE_SIZE = 512
+#bytes read from the ESC by read_settings(), the size of the BLHeli
+#eeprom block
+SETTINGS_SIZE = 0x70
+
+def _crc_table():
+    table = array.array('H')
+    for i in xrange(256):
+        crc = i
+        for bit in xrange(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+_CRC_TABLE = _crc_table()
+
+def crc16(data, crc=0):
+    """CRC16 as used by the BLHeli bootloader"""
+    table = _CRC_TABLE
+    for b in bytearray(data):
+        crc = (crc >> 8) ^ table[(crc ^ b) & 0xFF]
+    return crc
+
+def _framed(data):
+    """data followed by its crc, low byte first"""
+    data = bytearray(data)
+    crc = crc16(data)
+    data.append(crc & 0xFF)
+    data.append(crc >> 8)
+    return data
+
+class LinkError(Exception):
+    """the ESC didn't answer, or answered with an error"""
+    pass
+
+class SocketStream(object):
+    """file like read(n)/write(data) over a socket.  read() returns what
+    arrived before the timeout, which may be short like a serial port"""
+    def __init__(self, sock, timeout=1.0):
+        self.sock = sock
+        self.sock.settimeout(timeout)
+
+    def read(self, size):
+        chunks = []
+        while size > 0:
+            try:
+                chunk = self.sock.recv(size)
+            except socket.timeout:
+                break
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size -= len(chunk)
+        return ''.join(chunks)
+
+    def write(self, data):
+        self.sock.sendall(str(data))
+
+    def close(self):
+        self.sock.close()
+
+def open_serial(port, baudrate=19200, timeout=1.0):
+    """open a serial port for an ESCLink (requires pyserial)"""
+    if serial is None:
+        raise Exception('pyserial is required for serial ports')
+    return serial.Serial(port, baudrate, timeout=timeout)
+
+class ESCLink(object):
+    """one ESC on the end of stream, an object with read(n) and write(data)
+    (a serial port, SocketStream...).  atmel selects where the settings
+    live.  a link isn't thread safe, use one thread per link"""
+    def __init__(self, stream, atmel=False, name=None):
+        self.stream = stream
+        self.atmel = atmel
+        self.family = blhelihex.ATMEL if atmel else blhelihex.SILABS
+        self.settings_addr = blhelihex.SETTINGS_ADDR[self.family]
+        self.name = name
+
+    def __repr__(self):
+        return 'ESCLink(%s)' % (self.name or self.stream)
+
+    def close(self):
+        self.stream.close()
+
+    def _read_exact(self, size):
+        data = self.stream.read(size)
+        if len(data) != size:
+            raise LinkError('%s: no answer (%d of %d bytes)' %
+                            (self, len(data), size))
+        return bytearray(data)
+
+    def _ack(self, what):
+        ack = self._read_exact(1)[0]
+        if ack != ACK_SUCCESS:
+            raise LinkError('%s: ESC answered 0x%02X to %s' %
+                            (self, ack, what))
+
+    def _command(self, data, what, ack=True):
+        self.stream.write(_framed(data))
+        if ack:
+            self._ack(what)
+
+    def set_address(self, address):
+        self._command([CMD_SET_ADDRESS, 0, address >> 8, address & 0xFF],
+                      'set address')
+
+    def _set_buffer(self, data):
+        self._command([CMD_SET_BUFFER, 0, 0, len(data) & 0xFF],
+                      'set buffer', ack=False)
+        self._command(data, 'buffer')
+
+    def read_memory(self, address, length):
+        """read length bytes of flash (or eeprom on Atmel) from address"""
+        cmd = CMD_READ_EEPROM if self.atmel else CMD_READ_FLASH
+        out = bytearray()
+        while length > 0:
+            n = min(length, 256)
+            self.set_address(address)
+            self._command([cmd, n & 0xFF], 'read', ack=False)
+            data = self._read_exact(n + 2)
+            if crc16(data[:n]) != data[n] | data[n+1] << 8:
+                raise LinkError('%s: bad crc reading 0x%04X' %
+                                (self, address))
+            self._ack('read')
+            out += data[:n]
+            address += n
+            length -= n
+        return out
+
+    def write_memory(self, address, data):
+        """program data at address, flash pages must have been erased"""
+        cmd = CMD_PROG_EEPROM if self.atmel else CMD_PROG_FLASH
+        for i in xrange(0, len(data), 256):
+            self.set_address(address + i)
+            self._set_buffer(data[i:i+256])
+            self._command([cmd, 1], 'program')
+
+    def erase_page(self, address):
+        self.set_address(address)
+        self._command([CMD_ERASE_FLASH, 1], 'erase')
+
+    def read_settings(self, size=SETTINGS_SIZE):
+        """returns a BLHeliHex holding the ESC's settings"""
+        blh = blhelihex.BLHeliHex()
+        blh.load_settings(self.read_memory(self.settings_addr, size),
+                          self.atmel)
+        return blh
+
+    def write_settings(self, blh):
+        """write the settings of blh (read from a file or from an ESC) to
+        the ESC and read them back to verify.  on SiLabs the rest of the
+        settings page is preserved"""
+        buf = blh.settings_buf
+        if blh.family != self.family:
+            raise Exception('%s settings can\'t go to a %s ESC' %
+                            (blh.family, self.family))
+        if self.atmel:
+            self.write_memory(self.settings_addr, buf)
+        else:
+            page_addr = self.settings_addr - self.settings_addr % PAGE_SIZE
+            page = self.read_memory(page_addr, PAGE_SIZE)
+            offset = self.settings_addr - page_addr
+            page[offset:offset+len(buf)] = buf
+            self.erase_page(page_addr)
+            self.write_memory(page_addr, page)
+        if self.read_memory(self.settings_addr, len(buf)) != buf:
+            raise LinkError('%s: settings did not verify' % self)
+
+def run_links(links, fn, threads=None):
+    """call fn(link) for every link, each in its own thread (at most
+    threads at a time).  returns [(result, error), ...] in link order,
+    error being None or the error message"""
+    def call(link):
+        try:
+            return fn(link), None
+        except Exception as e:
+            return None, blhelibatch.error_message(e)
+    if not links:
+        return []
+    pool = multiprocessing.pool.ThreadPool(threads or len(links))
+    try:
+        return pool.map(call, links, 1)
+    finally:
+        pool.close()
+        pool.join()
+
+def configure(links, profile, threads=None):
+    """apply a profile (see blhelibatch.parse_profile) to every ESC: read
+    its settings, apply, write back and verify.  returns [(blh, error),
+    ...] in link order"""
+    profile = blhelibatch.compile_profile(profile)
+    def configure_one(link):
+        blh = link.read_settings()
+        blhelibatch.apply_profile(blh, profile)
+        link.write_settings(blh)
+        return blh
+    return run_links(links, configure_one, threads)
+
+class SimulatedESC(object):
+    """an ESC with the memory of a hex image, answering the bootloader
+    protocol on a socket from a background thread.  baudrate, if given,
+    slows answers down like a serial line would"""
+    def __init__(self, data, atmel=False, baudrate=None):
+        self.atmel = atmel
+        self.baudrate = baudrate
+        #flash on SiLabs, eeprom on Atmel
+        self.memory = bytearray('\xff' * (0x400 if atmel else 0x10000))
+        image = ihex.HexImage()
+        image.load(data)
+        for start, seg in image.segments():
+            if start + len(seg) > len(self.memory):
+                raise Exception('Image does not fit the simulated memory')
+            self.memory[start:start+len(seg)] = seg
+        self.address = 0
+        self.buffer = bytearray()
+        #(thread, ESC side socket) of every connection
+        self._threads = []
+
+    @classmethod
+    def from_file(cls, filename, baudrate=None):
+        atmel = blhelibatch.is_atmel(filename)
+        with open(filename, 'rb') as f:
+            return cls(f.read(), atmel, baudrate)
+
+    def connect(self, timeout=1.0):
+        """start serving on a new socketpair, returns an ESCLink talking
+        to this ESC"""
+        host, esc = socket.socketpair()
+        thread = threading.Thread(target=self._serve, args=(esc,))
+        thread.daemon = True
+        thread.start()
+        self._threads.append((thread, esc))
+        return ESCLink(SocketStream(host, timeout), self.atmel,
+                       'simulated %x' % id(self))
+
+    def close(self):
+        """hang up every connection and wait for the serving threads to
+        end"""
+        for thread, sock in self._threads:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                #the thread already closed it
+                pass
+        for thread, sock in self._threads:
+            thread.join()
+        del self._threads[:]
+
+    def _recv(self, sock, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise EOFError()
+            data += chunk
+        return data
+
+    def _send(self, sock, data, received):
+        if self.baudrate:
+            #10 bits per byte on the wire, both directions share the line
+            time.sleep((received + len(data)) * 10.0 / self.baudrate)
+        sock.sendall(str(bytearray(data)))
+
+    def _serve(self, sock):
+        try:
+            while True:
+                cmd = self._recv(sock, 1)
+                if cmd[0] in (CMD_SET_ADDRESS, CMD_SET_BUFFER):
+                    cmd += self._recv(sock, 5)
+                else:
+                    cmd += self._recv(sock, 3)
+                if crc16(cmd[:-2]) != cmd[-2] | cmd[-1] << 8:
+                    self._send(sock, [ACK_ERROR_CRC], len(cmd))
+                    continue
+                reply = self._handle(sock, cmd[:-2])
+                if reply is not None:
+                    self._send(sock, reply, len(cmd))
+        except (EOFError, socket.error):
+            pass
+        finally:
+            sock.close()
+
+    def _handle(self, sock, cmd):
+        """carry out one command, returns the reply or None"""
+        op = cmd[0]
+        if op == CMD_SET_ADDRESS:
+            self.address = cmd[2] << 8 | cmd[3]
+        elif op == CMD_SET_BUFFER:
+            size = cmd[3] or 256
+            data = self._recv(sock, size + 2)
+            if crc16(data[:size]) != data[size] | data[size+1] << 8:
+                return [ACK_ERROR_CRC]
+            self.buffer = data[:size]
+        elif op in (CMD_READ_FLASH, CMD_READ_EEPROM):
+            if (op == CMD_READ_EEPROM) != self.atmel:
+                return [ACK_ERROR_COMMAND]
+            size = cmd[1] or 256
+            return _framed(self.memory[self.address:self.address+size]) + \
+                bytearray([ACK_SUCCESS])
+        elif op in (CMD_PROG_FLASH, CMD_PROG_EEPROM):
+            if (op == CMD_PROG_EEPROM) != self.atmel:
+                return [ACK_ERROR_COMMAND]
+            end = self.address + len(self.buffer)
+            if op == CMD_PROG_FLASH and \
+                    any(b != 0xFF for b in self.memory[self.address:end]):
+                #flash bits only go from 1 to 0, the page wasn't erased
+                return [ACK_ERROR_VERIFY]
+            self.memory[self.address:end] = self.buffer
+        elif op == CMD_ERASE_FLASH:
+            if self.atmel:
+                return [ACK_ERROR_COMMAND]
+            start = self.address - self.address % PAGE_SIZE
+            self.memory[start:start+PAGE_SIZE] = '\xff' * PAGE_SIZE
+        elif op not in (CMD_RUN, CMD_KEEP_ALIVE):
+            return [ACK_ERROR_COMMAND]
+        return [ACK_SUCCESS]
+
+    def settings(self, size=SETTINGS_SIZE):
+        """the settings block as it is in the simulated memory"""
+        addr = 0 if self.atmel else blhelihex.SETTINGS_ADDR[blhelihex.SILABS]
+        return self.memory[addr:addr+size]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='configure many BLHeli ESCs over serial links at once')
+    parser.add_argument('-p', '--profile', required=True,
+        help='settings to apply, ex: "motor-timing=High, closed-loop=Off"')
+    parser.add_argument('--atmel', action='store_true',
+        help='the ESCs are Atmel based (default: SiLabs)')
+    parser.add_argument('-b', '--baudrate', type=int, default=19200,
+        help='serial speed (default: 19200)')
+    parser.add_argument('--simulate', type=int, metavar='N',
+        help='instead of serial ports, simulate N ESCs loaded with IMAGE')
+    parser.add_argument('ports', nargs='+',
+        help='serial ports, or the image to simulate')
+    args = parser.parse_args(argv)
+
+    try:
+        profile = blhelibatch.parse_profile(args.profile)
+    except ValueError as e:
+        parser.error(str(e))
+
+    escs = []
+    if args.simulate:
+        escs = [SimulatedESC.from_file(args.ports[0], args.baudrate)
+                for i in xrange(args.simulate)]
+        links = [esc.connect() for esc in escs]
+    else:
+        links = [ESCLink(open_serial(port, args.baudrate), args.atmel, port)
+                 for port in args.ports]
+    start = time.time()
+    failed = 0
+    try:
+        results = configure(links, profile)
+    finally:
+        for link in links:
+            link.close()
+        for esc in escs:
+            esc.close()
+    for link, (blh, err) in zip(links, results):
+        if err is None:
+            print('OK   %s' % link.name)
+        else:
+            failed += 1
+            print('FAIL %s: %s' % (link.name, err))
+    print('%d ESCs, %d failed, %.2fs' %
+          (len(links), failed, time.time() - start))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
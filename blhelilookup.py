@@ -0,0 +1,156 @@
+"""find settings by name, abbreviation or value, and complete their names
+
+a SettingIndex is built once per set of layouts (see index_for) and answers
+every lookup from sorted tables with bisect, so nothing scans the layout:
+
+    index = index_for([blh.schema])
+    index.find('ppm-min')           #'ppm-min-throttle'
+    index.lookup('pwm')             #every match, best first
+    index.complete('motor-')        #names for tab completion
+    index.by_value('bidirectional') #[('motor-direction', 3, 'Bidirectional')]
+
+a query matches a setting name, best first, when it is:
+    NAME        the whole name
+    PREFIX      the start of the name                   (ex: motor-dir)
+    ABBREV      the start of each dash separated word,  (ex: m-dir,
+                in order, words may be skipped           temp-prot)
+    VALUE       a human readable value of the setting   (ex: bidirectional)
+    VALUE_PREFIX the start of such a value               (ex: bidir)
+case is ignored throughout."""
+import bisect
+import collections
+
+#match ranks, lower is better
+NAME = 0
+PREFIX = 1
+ABBREV = 2
+VALUE = 3
+VALUE_PREFIX = 4
+
+RANK_NAMES = {NAME: 'name', PREFIX: 'prefix', ABBREV: 'abbreviation',
+              VALUE: 'value', VALUE_PREFIX: 'value prefix'}
+
+#built indexes, most recently used last
+_INDEX_CACHE = collections.OrderedDict()
+_INDEX_CACHE_SIZE = 8
+
+def _prefixed(keys, prefix):
+    """the range of indexes of the sorted list keys that start with prefix"""
+    lo = bisect.bisect_left(keys, prefix)
+    hi = bisect.bisect_left(keys, prefix + '\xff', lo)
+    return xrange(lo, hi)
+
+def _abbreviates(words, name_words):
+    """True if every word of words starts a word of name_words, in order"""
+    j = 0
+    for word in words:
+        while j < len(name_words) and not name_words[j].startswith(word):
+            j += 1
+        if j == len(name_words):
+            return False
+        j += 1
+    return True
+
+class SettingIndex(object):
+    """setting names and human readable values of one or more layouts (see
+    blhelihex.LayoutSchema), indexed for lookup and completion.  indexes
+    never hold setting values, they can be shared by any number of images"""
+    def __init__(self, schemas):
+        names = set()
+        values = set()
+        for schema in schemas:
+            names.update(schema.names)
+            for name, fmt in zip(schema.names, schema.fmt):
+                if type(fmt) is dict:
+                    for raw, text in fmt.iteritems():
+                        values.add((str(text).lower(), name, raw, text))
+        #every name, sorted, for exact and prefix lookups
+        self.names = sorted(names)
+        self._name_set = frozenset(names)
+        #(word, name) for every dash separated word of every name, sorted,
+        #to find the names an abbreviation's first word can start
+        self._words = sorted((word, name) for name in names
+                             for word in name.split('-'))
+        self._word_keys = [w for w, name in self._words]
+        self._name_words = dict((name, name.split('-')) for name in names)
+        #(lower case value, name, raw, value) sorted, for value lookups
+        self._values = sorted(values)
+        self._value_keys = [v[0] for v in self._values]
+
+    def lookup(self, query):
+        """returns [(name, rank), ...] for every setting query matches, best
+        match first (see the module docstring for the ranks)"""
+        query = query.strip().lower()
+        if not query:
+            return []
+        best = {}
+        def found(name, rank):
+            if rank < best.get(name, VALUE_PREFIX + 1):
+                best[name] = rank
+
+        if query in self._name_set:
+            found(query, NAME)
+        for i in _prefixed(self.names, query):
+            found(self.names[i], PREFIX)
+
+        words = query.split('-')
+        for i in _prefixed(self._word_keys, words[0]):
+            name = self._words[i][1]
+            if name not in best and \
+                    _abbreviates(words, self._name_words[name]):
+                found(name, ABBREV)
+
+        for i in _prefixed(self._value_keys, query):
+            key, name = self._values[i][:2]
+            found(name, VALUE if key == query else VALUE_PREFIX)
+
+        return sorted(best.iteritems(),
+                      key=lambda item: (item[1], len(item[0]), item[0]))
+
+    def find(self, query):
+        """returns the one setting query stands for, or None if it matches
+        nothing or more than one setting equally well"""
+        matches = self.lookup(query)
+        if not matches:
+            return None
+        if len(matches) > 1 and matches[1][1] == matches[0][1]:
+            return None
+        return matches[0][0]
+
+    def complete(self, text):
+        """returns the setting names starting with text, for tab
+        completion"""
+        text = text.lower()
+        return [self.names[i] for i in _prefixed(self.names, text)]
+
+    def by_value(self, text):
+        """returns [(name, raw, value), ...] for every setting that has a
+        human readable value starting with text"""
+        text = text.strip().lower()
+        if not text:
+            return []
+        return [self._values[i][1:] for i in _prefixed(self._value_keys,
+                                                       text)]
+
+def common_prefix(names):
+    """the longest string every one of names starts with"""
+    if not names:
+        return ''
+    first = min(names)
+    last = max(names)
+    i = 0
+    while i < len(first) and first[i] == last[i]:
+        i += 1
+    return first[:i]
+
+def index_for(schemas):
+    """returns the SettingIndex of a list of schemas.  indexes are cached,
+    so a set of layouts is only indexed once"""
+    key = tuple(schemas)
+    index = _INDEX_CACHE.pop(key, None)
+    if index is None:
+        index = SettingIndex(schemas)
+        if len(_INDEX_CACHE) >= _INDEX_CACHE_SIZE:
+            _INDEX_CACHE.popitem(last=False)
+    _INDEX_CACHE[key] = index
+    return index
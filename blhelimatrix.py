@@ -0,0 +1,185 @@
+#!/usr/bin/python
+"""fleet audits on a files x settings matrix (requires numpy)
+
+the settings buffers of many files are decoded into one numpy array, one row
+per file, so comparing a whole fleet against a reference image or counting
+the values of a setting are single vectorized operations.
+
+usage: python blhelimatrix.py [-r REFERENCE] [-c] <file|directory|glob> ..."""
+import argparse
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import blhelibatch
+import blhelihex
+
+def _load_one(path):
+    """pool worker, returns (path, family, layout revision, settings) where
+    settings is the raw settings buffer as a string, or (path, None, None,
+    error message) if the file couldn't be read"""
+    try:
+        blh = blhelihex.BLHeliHex()
+        blh.read(path, blhelibatch.is_atmel(path), settings_only=True)
+        return (path, blh.family,
+                blh.settings_buf[blhelihex.LAYOUT_REV_POS],
+                str(blh.settings_buf))
+    except Exception as e:
+        return (path, None, None, blhelibatch.error_message(e))
+
+class SettingsMatrix(object):
+    """the settings of many files sharing one layout.  raw holds the settings
+    buffers (files x bytes), values holds just the setting bytes (files x
+    settings, columns in schema order)"""
+    def __init__(self, paths, raw, schema):
+        self.paths = paths
+        self.raw = raw
+        self.schema = schema
+        self.values = raw[:, list(schema.pos)]
+
+    @classmethod
+    def load(cls, paths, schema=None, processes=None):
+        """decode the settings of every file in paths.  all files must share
+        one layout, by default the layout of the first readable file.
+        returns (matrix, errors), errors being a list of (path, message) for
+        the files that couldn't be used"""
+        if numpy is None:
+            raise Exception('numpy is required for settings matrices')
+        paths = list(paths)
+        good = []
+        bufs = []
+        errors = []
+
+        if processes != 1 and len(paths) > 1:
+            results = blhelibatch.pool_imap(_load_one, paths, processes,
+                                            ordered=True)
+        else:
+            results = (_load_one(p) for p in paths)
+        try:
+            for path, family, revision, buf in results:
+                if family is None:
+                    errors.append((path, buf))
+                    continue
+                file_schema = blhelihex.schema_for(family, revision)
+                if schema is None:
+                    schema = file_schema
+                elif file_schema is not schema:
+                    errors.append((path, 'layout differs from %s' %
+                                   (good[0] if good else 'the reference')))
+                    continue
+                if len(buf) < schema.size:
+                    errors.append((path, 'settings block too short'))
+                    continue
+                good.append(path)
+                bufs.append(buf[:schema.size])
+        finally:
+            #stops the workers if we bail out early
+            results.close()
+
+        if schema is None:
+            #nothing readable, the matrix is empty
+            schema = blhelihex.BLHeliHex.SCHEMA
+        raw = numpy.frombuffer(''.join(bufs), dtype=numpy.uint8)
+        return cls(good, raw.reshape(len(good), schema.size), schema), errors
+
+    def __len__(self):
+        return len(self.paths)
+
+    def row(self, reference):
+        """returns the settings values of reference, which is either a row
+        number, a path in the matrix or a read BLHeliHex"""
+        if isinstance(reference, blhelihex.BLHeliHex):
+            if reference.schema is not self.schema:
+                raise Exception('reference uses a different layout')
+            return numpy.array(reference.vals, dtype=numpy.uint8)
+        if not isinstance(reference, (int, long)):
+            reference = self.paths.index(reference)
+        return self.values[reference]
+
+    def column(self, name):
+        """returns the raw values of setting name for every file"""
+        return self.values[:, self.schema.index[name]]
+
+    def diff(self, reference):
+        """returns a files x settings boolean array, True where a file's
+        setting differs from reference (see row())"""
+        return self.values != self.row(reference)
+
+    def differences(self, reference):
+        """yields (path, [(setting, value, reference value), ...]) for every
+        file that differs from reference, values in human readable form"""
+        ref = self.row(reference)
+        mask = self.diff(reference)
+        for r in numpy.flatnonzero(mask.any(axis=1)):
+            cols = numpy.flatnonzero(mask[r])
+            yield (self.paths[r],
+                   [(self.schema.names[c], self._format(c, self.values[r, c]),
+                     self._format(c, ref[c])) for c in cols])
+
+    def group_by(self, name):
+        """returns {raw value: array of row numbers} for setting name"""
+        col = self.column(name)
+        order = numpy.argsort(col, kind='mergesort')
+        uniq, starts = numpy.unique(col[order], return_index=True)
+        groups = numpy.split(order, starts[1:])
+        return dict(zip(uniq.tolist(), groups))
+
+    def value_counts(self, name):
+        """returns [(human readable value, count), ...] for setting name,
+        most common first"""
+        i = self.schema.index[name]
+        counts = numpy.bincount(self.values[:, i], minlength=256)
+        nz = numpy.flatnonzero(counts)
+        nz = nz[numpy.argsort(-counts[nz], kind='mergesort')]
+        return [(self._format(i, v), int(counts[v])) for v in nz]
+
+    def _format(self, i, val):
+        """format a raw value, falling back to the number when it isn't in
+        the setting's table"""
+        try:
+            return self.schema.format(i, int(val))
+        except KeyError:
+            return 'unknown (%d)' % val
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='compare the settings of many BLHeli HEX/EEP files')
+    parser.add_argument('-r', '--reference',
+        help='report files whose settings differ from this file')
+    parser.add_argument('-c', '--counts', action='store_true',
+        help='count the values of each setting across all files')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+        help='number of worker processes (default: number of cores)')
+    parser.add_argument('paths', nargs='+',
+        help='HEX/EEP files, directories or glob patterns')
+    args = parser.parse_args(argv)
+
+    paths = [p for p, rel in blhelibatch.expand_paths(args.paths)]
+    schema = None
+    ref = None
+    if args.reference:
+        ref = blhelihex.BLHeliHex()
+        ref.read(args.reference, blhelibatch.is_atmel(args.reference),
+                 settings_only=True)
+        schema = ref.schema
+    matrix, errors = SettingsMatrix.load(paths, schema, args.processes)
+    for path, err in errors:
+        print('FAIL %s: %s' % (path, err))
+
+    if ref is not None:
+        for path, diffs in matrix.differences(ref):
+            print(path)
+            for name, val, ref_val in diffs:
+                print('    %-24s %s (reference: %s)' % (name, val, ref_val))
+    if args.counts:
+        for name in matrix.schema.names:
+            counts = ', '.join('%s: %d' % c for c in matrix.value_counts(name))
+            print('%-24s %s' % (name, counts))
+    print('%d files, %d unreadable' % (len(matrix), len(errors)))
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""curses screen for pyblheli that only redraws what changed
+
+the screen is split into windows: the title, the body showing the output of
+the last command, a status line and the prompt.  the title is drawn once.
+the body keeps the lines it shows and only rewrites the rows whose text
+changed, and only the visible page of the output is ever drawn, so a long
+'ls' costs one page however many settings there are.  every update goes out
+with one noutrefresh per window and a single doupdate, which keeps the
+traffic to slow terminals (ssh) down and avoids flicker.
+
+    screen = Screen(stdscr, draw_title)
+    screen.show(output_text)
+    line = screen.read(complete)
+
+PgUp/PgDn (also Home/End) page through the output while typing."""
+import curses
+
+TITLE_LINES = 4
+
+#keys
+ENTER = (10, 13, curses.KEY_ENTER)
+BACKSPACE = (8, 127, curses.KEY_BACKSPACE)
+TAB = 9
+
+class Screen(object):
+    """windows and screen model on top of the curses screen scr.
+    draw_title(win) draws the title into a window of TITLE_LINES lines"""
+    def __init__(self, scr, draw_title):
+        self.scr = scr
+        self.draw_title = draw_title
+        #the output being shown and the first line on screen
+        self.lines = []
+        self.top = 0
+        self.status = ''
+        self._layout()
+
+    def _layout(self):
+        """(re)build the windows for the current terminal size and draw
+        everything"""
+        maxy, maxx = self.scr.getmaxyx()
+        self.width = maxx
+        self.height = max(1, maxy - TITLE_LINES - 2)
+        self.scr.erase()
+        self.scr.noutrefresh()
+        self.title = curses.newwin(TITLE_LINES, maxx, 0, 0)
+        self.body = curses.newwin(self.height, maxx, TITLE_LINES, 0)
+        self.status_win = curses.newwin(1, maxx, maxy - 2, 0)
+        self.prompt = curses.newwin(1, maxx, maxy - 1, 0)
+        self.prompt.keypad(1)
+        try:
+            self.draw_title(self.title)
+        except curses.error:
+            #terminal too narrow for the title
+            pass
+        self.title.noutrefresh()
+        #what each body row holds, None forces a redraw
+        self._shown = [None] * self.height
+        self._status_shown = None
+        self.top = min(self.top, self._last_top())
+
+    def _last_top(self):
+        return max(0, len(self.lines) - self.height)
+
+    def show(self, text, at_end=False):
+        """show text in the body, from its first line, or its last page if
+        at_end"""
+        self.lines = text.expandtabs(8).split('\n')
+        if self.lines and self.lines[-1] == '':
+            self.lines.pop()
+        self.top = self._last_top() if at_end else 0
+        self.status = ''
+        self.render()
+
+    def scroll(self, lines):
+        """move the body down (or up, lines < 0) and redraw"""
+        self.top = max(0, min(self.top + lines, self._last_top()))
+        self.status = ''
+        self.render()
+
+    def _page_status(self):
+        if len(self.lines) <= self.height:
+            return ''
+        return '-- lines %d-%d of %d, PgUp/PgDn to scroll --' % (
+            self.top + 1, min(self.top + self.height, len(self.lines)),
+            len(self.lines))
+
+    def render(self):
+        """bring the body and status line up to date, rewriting only the
+        rows that changed"""
+        width = self.width - 1
+        for row in xrange(self.height):
+            i = self.top + row
+            line = self.lines[i][:width] if i < len(self.lines) else ''
+            if self._shown[row] != line:
+                self.body.move(row, 0)
+                self.body.clrtoeol()
+                self.body.addstr(row, 0, line)
+                self._shown[row] = line
+        status = self.status or self._page_status()
+        if status != self._status_shown:
+            self.status_win.erase()
+            self.status_win.addstr(0, 0, status[:width])
+            self._status_shown = status
+        self.body.noutrefresh()
+        self.status_win.noutrefresh()
+        self.prompt.noutrefresh()
+        curses.doupdate()
+
+    def _draw_input(self, text):
+        #keep the end of long input visible
+        visible = text[-(self.width - 2):] if self.width > 2 else ''
+        self.prompt.erase()
+        self.prompt.addstr(0, 0, ':' + visible)
+        self.prompt.noutrefresh()
+        curses.doupdate()
+
+    def read(self, complete=None):
+        """read a line at the prompt.  tab calls complete(text), which
+        returns (new text, candidates): the text is replaced, and candidates
+        are shown on the status line when there is more than one"""
+        text = ''
+        self._draw_input(text)
+        while True:
+            c = self.prompt.getch()
+            if c in ENTER:
+                self.prompt.erase()
+                self.prompt.noutrefresh()
+                return text
+            elif c in BACKSPACE:
+                text = text[:-1]
+            elif c == TAB and complete is not None:
+                text, candidates = complete(text)
+                if len(candidates) > 1:
+                    self.status = ' '.join(candidates)
+                    self.render()
+            elif c == curses.KEY_NPAGE:
+                self.scroll(self.height - 1)
+            elif c == curses.KEY_PPAGE:
+                self.scroll(1 - self.height)
+            elif c == curses.KEY_HOME:
+                self.scroll(-len(self.lines))
+            elif c == curses.KEY_END:
+                self.scroll(len(self.lines))
+            elif c == curses.KEY_RESIZE:
+                self._layout()
+                self.render()
+            elif 32 <= c < 127:
+                text += chr(c)
+            else:
+                continue
+            self._draw_input(text)
@@ -0,0 +1,216 @@
+"""edit several images as one, for boards carrying more than one ESC
+
+a 4-in-1 board needs four images with matching settings.  a session opens
+them together, reads settings from all of them and applies every change to
+all of them, then saves them all at once:
+
+    session = BLHeliSession()
+    session.open(['ESC1.HEX', 'ESC2.HEX', 'ESC3.HEX', 'ESC4.HEX'])
+    session['motor-timing'] = 5
+    for path, error in session.save():
+        ...
+
+a value is checked once for each layout in the session, not once per image,
+and if any image would reject it none of them are changed.  undo() and
+redo() step through the edits of every image together."""
+import multiprocessing.pool
+import os
+
+import blhelibatch
+import blhelihex
+import blhelijournal
+import blhelilookup
+
+class BLHeliSession(object):
+    """a set of BLHeliHex images edited together"""
+    def __init__(self):
+        #the images and the files they were read from, in the same order
+        self.images = []
+        self.paths = []
+        #a journal snapshot of every image after each edit, see undo()
+        self._marks = [()]
+        self._mark = 0
+
+    def __len__(self):
+        return len(self.images)
+
+    def open(self, paths, settings_only=False):
+        """read every file in paths, replacing what the session held.
+        nothing is replaced if any file fails to read"""
+        images = []
+        for path in paths:
+            blh = blhelihex.BLHeliHex()
+            blh.read(path, blhelibatch.is_atmel(path), settings_only)
+            blhelijournal.Journal(blh)
+            images.append(blh)
+        self.images = images
+        self.paths = list(paths)
+        self._marks = [self._snapshots()]
+        self._mark = 0
+
+    def keys(self):
+        """setting names, in the order of the first image.  images with a
+        different layout may have settings the first one lacks"""
+        if not self.images:
+            return []
+        names = self.images[0].keys()
+        seen = set(names)
+        for blh in self.images[1:]:
+            for name in blh.keys():
+                if name not in seen:
+                    seen.add(name)
+                    names.append(name)
+        return names
+
+    def schemas(self):
+        """returns [(schema, [image index, ...]), ...] grouping the images
+        by layout, in order of first appearance"""
+        groups = []
+        for i, blh in enumerate(self.images):
+            for schema, members in groups:
+                if schema is blh.schema:
+                    members.append(i)
+                    break
+            else:
+                groups.append((blh.schema, [i]))
+        return groups
+
+    def index(self):
+        """the blhelilookup.SettingIndex of the session's layouts, the
+        default layout's when nothing is open"""
+        schemas = [schema for schema, members in self.schemas()]
+        return blhelilookup.index_for(schemas or [blhelihex.BLHeliHex.SCHEMA])
+
+    def find(self, query):
+        """the setting a name, abbreviation or value stands for, None if
+        it is unknown or ambiguous.  see blhelilookup"""
+        return self.index().find(query)
+
+    def __getitem__(self, name):
+        """returns the raw value of a setting in every image"""
+        return [blh[name] for blh in self.images]
+
+    def printable(self, name):
+        """returns the human readable value of a setting in every image"""
+        return [blh.printable(name) for blh in self.images]
+
+    def constraints(self, name):
+        """the constraints dict of the first image having setting name, see
+        BLHeliHex.constraints"""
+        for blh in self.images:
+            if name in blh.schema.index:
+                return blh.constraints(name)
+        raise Exception('unrecognized setting "%s"' % name)
+
+    def differing(self):
+        """returns the names of the settings whose value isn't the same in
+        every image"""
+        return [name for name in self.keys()
+                if len(set(self._values(name))) > 1]
+
+    def _values(self, name):
+        return [blh[name] if name in blh.schema.index else None
+                for blh in self.images]
+
+    def __setitem__(self, name, value):
+        """set a setting in every image.  the value is validated against each
+        layout in the session once, then the resulting byte is stored in all
+        the images sharing that layout"""
+        self.apply(((name, value),))
+
+    def apply(self, profile):
+        """set several settings in every image as one edit.  profile is a
+        blhelihex.Profile or (setting, value) pairs, see BLHeliHex.apply.
+        if any image would reject any value nothing is changed"""
+        if not self.images:
+            raise Exception('Must open a file first')
+        if not isinstance(profile, blhelihex.Profile):
+            profile = blhelihex.Profile(profile)
+        #validate everything before changing anything
+        for schema, members in self.schemas():
+            profile.compile(schema)
+        for blh in self.images:
+            blh.apply(profile)
+        snapshots = self._snapshots()
+        if snapshots == self._marks[self._mark]:
+            #nothing changed, there is nothing to undo
+            return
+        del self._marks[self._mark+1:]
+        self._marks.append(snapshots)
+        self._mark += 1
+
+    def _snapshots(self):
+        return tuple(blh.journal.snapshot() for blh in self.images)
+
+    def _restore(self, mark):
+        for blh, snapshot in zip(self.images, self._marks[mark]):
+            blh.journal.restore(snapshot)
+        self._mark = mark
+
+    def undo(self):
+        """undo the last change made through the session, in every image.
+        returns False if there was nothing to undo"""
+        if self._mark == 0:
+            return False
+        self._restore(self._mark - 1)
+        return True
+
+    def redo(self):
+        """redo the last undone change.  returns False if there was nothing
+        to redo"""
+        if self._mark + 1 >= len(self._marks):
+            return False
+        self._restore(self._mark + 1)
+        return True
+
+    def dirty(self):
+        """returns the paths of the images with unsaved changes"""
+        return [path for path, blh in zip(self.paths, self.images)
+                if blh.dirty]
+
+    def save(self, filenames=None, threads=None):
+        """write every image, to the file it was read from or to the
+        matching entry of filenames.  images are written concurrently, each
+        one atomically (see BLHeliHex.write).  images that would be written
+        to the same file fail without being written.  returns [(filename,
+        error), ...] in image order, error being None on success"""
+        if filenames is None:
+            filenames = self.paths
+        if len(filenames) != len(self.images):
+            raise Exception('Expected %d filenames, got %d' %
+                            (len(self.images), len(filenames)))
+        #output file => [index of each image written there, ...]
+        by_dest = {}
+        for i, filename in enumerate(filenames):
+            key = os.path.normcase(os.path.abspath(filename))
+            by_dest.setdefault(key, []).append(i)
+        clashes = {}
+        for claims in by_dest.itervalues():
+            if len(claims) > 1:
+                for i in claims:
+                    clashes[i] = '%s would also be written from %s' % (
+                        filenames[i], ', '.join(self.paths[j] for j in claims
+                                                if j != i))
+        def write_one(job):
+            i, blh, filename = job
+            if i in clashes:
+                return filename, clashes[i]
+            try:
+                blh.write(filename)
+                return filename, None
+            except Exception as e:
+                return filename, blhelibatch.error_message(e)
+        jobs = zip(xrange(len(filenames)), self.images, filenames)
+        if len(jobs) < 2:
+            return map(write_one, jobs)
+        pool = multiprocessing.pool.ThreadPool(threads or len(jobs))
+        try:
+            return pool.map(write_one, jobs, 1)
+        finally:
+            pool.close()
+            pool.join()
+
+    def save_to(self, directory, threads=None):
+        """write every image into directory, under its own file name"""
+        return self.save([os.path.join(directory, os.path.basename(p))
+                          for p in self.paths], threads)
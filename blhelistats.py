@@ -0,0 +1,79 @@
+"""call counts, bytes and wall time per phase of BLHeliHex operations
+
+    stats = Stats()
+    with collecting(stats):
+        blh.read('BS12A.HEX', atmel=False)
+        blh['motor-timing'] = 5
+        blh.write('out.hex')
+    print stats.summary()
+
+phases reported by blhelihex (see blhelihex.set_stats):
+    read            whole read() call, bytes = file size
+    read.cache      parse cache lookup
+    read.io         reading the file into memory
+    read.decode     hex parsing, bytes = text decoded
+    write           whole write() call, bytes = file size
+    write.encode    regenerating the settings records (checksums included)
+    write.io        writing the file
+    patch           whole patch() call, bytes = records written
+    set             validating and storing one setting
+    apply           validating (first time per layout) and storing a
+                    profile, bytes = settings stored
+    format          printable() formatting a value (memoized calls aren't
+                    counted)
+when no stats are installed nothing is timed at all."""
+import contextlib
+
+import blhelihex
+
+class Stats(object):
+    """totals per phase, phases maps a phase name to [calls, bytes,
+    seconds]"""
+    def __init__(self):
+        self.phases = {}
+
+    def add(self, phase, nbytes, seconds):
+        """record one call of phase"""
+        totals = self.phases.get(phase)
+        if totals is None:
+            self.phases[phase] = [1, nbytes, seconds]
+        else:
+            totals[0] += 1
+            totals[1] += nbytes
+            totals[2] += seconds
+
+    def merge(self, phases):
+        """add the totals of another Stats' phases dict, for collecting
+        stats from worker processes"""
+        for phase, (calls, nbytes, seconds) in phases.iteritems():
+            totals = self.phases.setdefault(phase, [0, 0, 0.0])
+            totals[0] += calls
+            totals[1] += nbytes
+            totals[2] += seconds
+
+    def reset(self):
+        self.phases.clear()
+
+    def summary(self):
+        """returns the totals as a table, one phase per line"""
+        lines = ['%-14s %10s %14s %12s %12s %10s' %
+                 ('phase', 'calls', 'bytes', 'total ms', 'us/call', 'MB/s')]
+        for phase in sorted(self.phases):
+            calls, nbytes, seconds = self.phases[phase]
+            rate = nbytes / seconds / 1e6 if seconds and nbytes else 0
+            lines.append('%-14s %10d %14d %12.3f %12.3f %10.1f' %
+                         (phase, calls, nbytes, seconds * 1e3,
+                          seconds / calls * 1e6, rate))
+        return '\n'.join(lines)
+
+@contextlib.contextmanager
+def collecting(stats=None):
+    """install stats (a new Stats by default) for the duration of the with
+    block, restoring whatever was installed before.  yields the stats"""
+    if stats is None:
+        stats = Stats()
+    old = blhelihex.set_stats(stats)
+    try:
+        yield stats
+    finally:
+        blhelihex.set_stats(old)
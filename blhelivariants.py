@@ -0,0 +1,117 @@
+"""generate many firmware files from one base image
+
+every variant shares the base file byte for byte except for the settings
+records, so the untouched parts of the base are sliced once into buffer
+objects and written as is.  only the settings records touched by a variant's
+overrides are regenerated.
+
+    base = blhelihex.BLHeliHex()
+    base.read('BS12A.HEX', atmel=False)
+    variants = (('out/BS12A_%d.HEX' % d, {'motor-direction': d})
+                for d in (1, 2, 3))
+    for filename in write_variants(base, variants):
+        print filename"""
+import os
+
+import ihex
+
+class VariantWriter(object):
+    """splits a base BLHeliHex into shared pieces once, then writes any
+    number of variants with different settings"""
+    def __init__(self, base):
+        if base.settings_records is None:
+            raise Exception('Must read a hex file first')
+        self.base = base
+        data = base.data
+        if data is None:
+            #settings only read, we need the rest of the file after all
+            base._check_source()
+            with open(base.filename, 'rb') as f:
+                data = f.read()
+        self.data = data
+        #the settings as they are in data.  base.dirty is cleared whenever
+        #the base is saved, so records are compared against this instead
+        self.file_buf = str(base.base_buf)
+
+        #the text between the settings records, shared by every variant.
+        #gaps[0] is everything before the first record, gaps[-1] everything
+        #after the last one
+        self.gaps = []
+        #the base text of each settings record, reused when a variant
+        #doesn't touch it
+        self.records = []
+        pos = 0
+        for offset, end in [rec[0:2] for rec in base.settings_records]:
+            self.gaps.append(buffer(data, pos, offset - pos))
+            self.records.append(buffer(data, offset, end - offset))
+            pos = end
+        self.gaps.append(buffer(data, pos))
+
+    def settings(self, overrides):
+        """returns (settings buffer, set of changed record indices) for the
+        base settings with overrides applied.  overrides maps setting names
+        to values as accepted by BLHeliHex.__setitem__"""
+        base = self.base
+        buf = bytearray(base.settings_buf)
+        for name, value in overrides.iteritems():
+            value = base.validate(name, value)
+            buf[base.schema.pos[base.schema.index[name]]] = value
+        return buf, self._changed(buf)
+
+    def _changed(self, buf):
+        """the indices of the records whose bytes in buf differ from the
+        base file"""
+        record_of = self.base.record_of
+        return set(record_of[i] for i, (a, b) in
+                   enumerate(zip(str(buf), self.file_buf)) if a != b)
+
+    def pieces(self, overrides):
+        """returns the list of strings/buffers making up the variant file"""
+        buf, changed = self.settings(overrides)
+        return self._pieces(buf, changed)
+
+    def _pieces(self, buf, changed):
+        """pieces for settings buffer buf, only the records in changed are
+        regenerated"""
+        base = self.base
+        pieces = [self.gaps[0]]
+        for idx, rec in enumerate(base.settings_records):
+            if idx in changed:
+                offset, end, rtype, address = rec[0:4]
+                pieces.append(ihex.encode_record(address, rtype,
+                                                 base.record_data(idx, buf)))
+            else:
+                pieces.append(self.records[idx])
+            pieces.append(self.gaps[idx+1])
+        return pieces
+
+    def write_changes(self, filename, changes):
+        """write a variant given raw (offset, byte) changes to the settings
+        buffer instead of setting names, nothing is validated"""
+        base = self.base
+        buf = bytearray(base.settings_buf)
+        for pos, value in changes:
+            buf[pos] = value
+        self._write(filename, self._pieces(buf, self._changed(buf)))
+
+    def write(self, filename, overrides):
+        """write one variant to filename"""
+        self._write(filename, self.pieces(overrides))
+
+    def _write(self, filename, pieces):
+        with open(filename, 'wb') as f:
+            for piece in pieces:
+                f.write(piece)
+
+def write_variants(base, variants):
+    """write a file for each (filename, overrides) pair in variants, where
+    overrides maps setting names to values as accepted by
+    BLHeliHex.__setitem__.  base is left untouched.  yields each filename
+    once it has been written"""
+    writer = VariantWriter(base)
+    for filename, overrides in variants:
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        writer.write(filename, overrides)
+        yield filename
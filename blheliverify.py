@@ -0,0 +1,66 @@
+#!/usr/bin/python
+"""verify the integrity of BLHeli HEX/EEP files before flashing
+
+usage: python blheliverify.py [-j PROCESSES] [-q] <file|directory|glob> ...
+
+every record's start code, length, checksum, type and address is checked
+(see ihex.verify) with files spread over a process pool.  one JSON object is
+printed per file:
+
+    {"path": "BS12A.HEX", "ok": false, "records": 1234, "errors": [
+        {"offset": 132, "line": 4, "kind": "checksum",
+         "message": "Bad checksum"}]}
+
+the exit status is 1 if any file failed."""
+import argparse
+import json
+import sys
+
+import blhelibatch
+import ihex
+
+def verify_file(path):
+    """returns the report dict for one file"""
+    try:
+        with open(path, 'rb') as f:
+            buf = f.read()
+        errors = ihex.verify(buf)
+    except (IOError, OSError) as e:
+        buf = ''
+        errors = [{'offset': None, 'line': None, 'kind': 'io',
+                   'message': str(e)}]
+    return {'path': path, 'ok': not errors, 'records': buf.count(':'),
+            'errors': errors}
+
+def verify_files(paths, processes=None):
+    """verify every file in paths in a pool of processes, yields report
+    dicts (see verify_file) in completion order"""
+    paths = list(paths)
+    if not paths:
+        return
+    for report in blhelibatch.pool_imap(verify_file, paths, processes):
+        yield report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='verify the records of BLHeli HEX/EEP files')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+        help='number of worker processes (default: number of cores)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+        help='only report files with errors')
+    parser.add_argument('paths', nargs='+',
+        help='HEX/EEP files, directories or glob patterns')
+    args = parser.parse_args(argv)
+
+    paths = [p for p, rel in blhelibatch.expand_paths(args.paths)]
+    failed = 0
+    for report in verify_files(paths, args.processes):
+        if not report['ok']:
+            failed += 1
+        elif args.quiet:
+            continue
+        sys.stdout.write(json.dumps(report, sort_keys=True) + '\n')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,331 @@
+#!/usr/bin/python
+"""keep the settings of watched directories decoded in memory and serve them
+
+usage: python blheliwatch.py -s SOCKET serve [-i SECONDS] <directory> ...
+       python blheliwatch.py -s SOCKET get <file> [<setting> ...]
+       python blheliwatch.py -s SOCKET set <file> 'motor-timing=High, ...'
+       python blheliwatch.py -s SOCKET export
+
+the server polls its directories: files are only decoded again when their
+size or mtime changed, and directories whose mtime didn't change aren't
+listed again.  requests are answered from memory over a unix socket, one
+JSON object per line each way:
+    {"op": "list"}
+    {"op": "get", "path": "/abs/ESC1.HEX", "settings": ["motor-timing"]}
+    {"op": "set", "path": "/abs/ESC1.HEX", "values": {"motor-timing": "High"}}
+    {"op": "export", "settings": ["motor-timing"]}
+    {"op": "status"}
+every answer has "ok", and "error" when ok is false."""
+import argparse
+import json
+import os
+import signal
+import socket
+import SocketServer
+import stat
+import sys
+import threading
+import time
+
+import blhelibatch
+import blhelihex
+
+DEFAULT_INTERVAL = 2.0
+
+class WatchedFile(object):
+    """a file as last seen by the poller, blh is None if it failed to
+    read, error then says why"""
+    __slots__ = ('size', 'mtime', 'blh', 'error')
+
+    def __init__(self, size, mtime, blh, error):
+        self.size = size
+        self.mtime = mtime
+        self.blh = blh
+        self.error = error
+
+class SettingsStore(object):
+    """the decoded settings of every HEX/EEP file under some directories.
+    scan() brings it up to date, the other methods are safe to call from
+    any thread"""
+    def __init__(self, directories):
+        self.directories = [os.path.abspath(d) for d in directories]
+        #absolute path => WatchedFile
+        self.files = {}
+        #directory => (mtime, [hex files], [subdirectories]) as last listed
+        self._listings = {}
+        self.lock = threading.Lock()
+        self.scans = 0
+        self.last_scan = None
+
+    def _list(self, directory, st):
+        """the hex files and subdirectories of directory, listed again only
+        if its mtime changed"""
+        listing = self._listings.get(directory)
+        if listing is not None and listing[0] == st.st_mtime:
+            return listing[1], listing[2]
+        files = []
+        dirs = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isdir(path):
+                dirs.append(path)
+            elif name.split('.')[-1].upper() in blhelibatch.EXTENSIONS:
+                files.append(path)
+        self._listings[directory] = (st.st_mtime, files, dirs)
+        return files, dirs
+
+    def _walk(self):
+        """yields (path, stat) for every hex file under the directories"""
+        seen = set()
+        pending = list(self.directories)
+        while pending:
+            directory = pending.pop()
+            try:
+                st = os.stat(directory)
+                files, dirs = self._list(directory, st)
+            except OSError:
+                continue
+            seen.add(directory)
+            pending.extend(dirs)
+            for path in files:
+                try:
+                    yield path, os.stat(path)
+                except OSError:
+                    pass
+        for directory in set(self._listings) - seen:
+            del self._listings[directory]
+
+    def scan(self):
+        """poll the directories once.  returns (added, changed, removed)
+        lists of paths"""
+        added = []
+        changed = []
+        present = set()
+        for path, st in self._walk():
+            present.add(path)
+            with self.lock:
+                entry = self.files.get(path)
+            if entry is not None and \
+                    (entry.size, entry.mtime) == (st.st_size, st.st_mtime):
+                continue
+            new_entry = self._decode(path, st)
+            with self.lock:
+                self.files[path] = new_entry
+            (added if entry is None else changed).append(path)
+        with self.lock:
+            removed = [p for p in self.files if p not in present]
+            for path in removed:
+                del self.files[path]
+            self.scans += 1
+            self.last_scan = time.time()
+        return added, changed, removed
+
+    def _decode(self, path, st):
+        blh = blhelihex.BLHeliHex()
+        try:
+            blh.read(path, blhelibatch.is_atmel(path), settings_only=True)
+        except Exception as e:
+            return WatchedFile(st.st_size, st.st_mtime, None,
+                               blhelibatch.error_message(e))
+        #the stat we decided to decode on, a change after it shows up on
+        #the next scan
+        return WatchedFile(st.st_size, st.st_mtime, blh, None)
+
+    def _get(self, path):
+        entry = self.files.get(path)
+        if entry is None:
+            raise Exception('%s is not watched' % path)
+        if entry.blh is None:
+            raise Exception('%s could not be read: %s' % (path, entry.error))
+        return entry
+
+    def settings(self, path, names=None):
+        """returns {setting: human readable value} for a file, all settings
+        or just names"""
+        with self.lock:
+            return _settings(self._get(path).blh, names)
+
+    def update(self, path, values):
+        """change settings of a file and write it.  values maps settings to
+        values as in a blhelibatch profile.  nothing is written if any value
+        is invalid.  returns the new settings"""
+        with self.lock:
+            entry = self._get(path)
+            blh = entry.blh
+            names = list(values)
+            blh.apply(blhelibatch.compile_profile(
+                [(name, str(values[name])) for name in names]))
+            try:
+                blh.write(path)
+            except Exception:
+                #memory no longer matches the file, decode it again
+                entry.size = entry.mtime = None
+                raise
+            entry.size, entry.mtime = blh.file_stat
+            return _settings(blh, names)
+
+    def export(self, names=None):
+        """returns ({path: settings}, {path: error}) for every file"""
+        with self.lock:
+            good = {}
+            bad = {}
+            for path, entry in self.files.iteritems():
+                if entry.blh is None:
+                    bad[path] = entry.error
+                else:
+                    good[path] = _settings(entry.blh, names)
+            return good, bad
+
+    def poll(self, interval, stop):
+        """scan every interval seconds until the stop event is set"""
+        while not stop.is_set():
+            self.scan()
+            stop.wait(interval)
+
+def _settings(blh, names):
+    names = blh.keys() if names is None else names
+    return dict((name, blhelibatch.format_setting(blh, name, blh[name]))
+                for name in names)
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    """one JSON request per line, one JSON answer per line"""
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            try:
+                answer = self.server.answer(json.loads(line))
+            except Exception as e:
+                answer = {'ok': False,
+                          'error': blhelibatch.error_message(e)}
+            self.wfile.write(json.dumps(answer) + '\n')
+            self.wfile.flush()
+
+def _remove_stale_socket(socket_path):
+    """remove the socket a server that died left at socket_path.  anything
+    else there, including the socket of a server that's still running, is
+    left alone and raises"""
+    try:
+        st = os.stat(socket_path)
+    except OSError:
+        return
+    if not stat.S_ISSOCK(st.st_mode):
+        raise Exception('%s exists and is not a socket' % socket_path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error:
+        #nobody is listening
+        os.unlink(socket_path)
+        return
+    finally:
+        sock.close()
+    raise Exception('a server is already listening on %s' % socket_path)
+
+class WatchServer(SocketServer.ThreadingUnixStreamServer):
+    """answers requests from a SettingsStore"""
+    daemon_threads = True
+
+    def __init__(self, socket_path, store):
+        self.store = store
+        _remove_stale_socket(socket_path)
+        SocketServer.ThreadingUnixStreamServer.__init__(self, socket_path,
+                                                        RequestHandler)
+
+    def answer(self, request):
+        op = request.get('op')
+        store = self.store
+        if op == 'get':
+            return {'ok': True, 'settings':
+                    store.settings(request['path'], request.get('settings'))}
+        elif op == 'set':
+            return {'ok': True, 'settings':
+                    store.update(request['path'], request['values'])}
+        elif op == 'export':
+            good, bad = store.export(request.get('settings'))
+            return {'ok': True, 'files': good, 'errors': bad}
+        elif op == 'list':
+            with store.lock:
+                return {'ok': True, 'paths': sorted(store.files)}
+        elif op == 'status':
+            with store.lock:
+                return {'ok': True, 'files': len(store.files),
+                        'scans': store.scans, 'last_scan': store.last_scan,
+                        'directories': store.directories}
+        raise Exception('unknown op %r' % op)
+
+def serve(socket_path, directories, interval=DEFAULT_INTERVAL):
+    """scan the directories, then answer requests on socket_path while
+    polling them in the background.  runs until interrupted"""
+    store = SettingsStore(directories)
+    store.scan()
+    server = WatchServer(socket_path, store)
+    stop = threading.Event()
+    poller = threading.Thread(target=store.poll, args=(interval, stop))
+    poller.daemon = True
+    poller.start()
+    try:
+        server.serve_forever()
+    finally:
+        stop.set()
+        poller.join()
+        server.server_close()
+        os.unlink(socket_path)
+
+def request(socket_path, req):
+    """send one request to a server, returns its answer"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        f = sock.makefile('r+b')
+        f.write(json.dumps(req) + '\n')
+        f.flush()
+        return json.loads(f.readline())
+    finally:
+        sock.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='serve the settings of watched BLHeli HEX/EEP files')
+    parser.add_argument('-s', '--socket', required=True,
+        help='unix socket the server listens on')
+    sub = parser.add_subparsers(dest='command')
+    p = sub.add_parser('serve', help='watch directories and answer requests')
+    p.add_argument('-i', '--interval', type=float, default=DEFAULT_INTERVAL,
+        help='seconds between polls (default: %s)' % DEFAULT_INTERVAL)
+    p.add_argument('directories', nargs='+')
+    p = sub.add_parser('get', help='print the settings of a file')
+    p.add_argument('path')
+    p.add_argument('settings', nargs='*')
+    p = sub.add_parser('set', help='change settings of a file')
+    p.add_argument('path')
+    p.add_argument('profile', help='ex: "motor-timing=High, closed-loop=Off"')
+    p = sub.add_parser('export', help='print the settings of every file')
+    p.add_argument('settings', nargs='*')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        #exit cleanly on kill too, so the socket gets removed
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            serve(args.socket, args.directories, args.interval)
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    if args.command == 'get':
+        req = {'op': 'get', 'path': os.path.abspath(args.path),
+               'settings': args.settings or None}
+    elif args.command == 'set':
+        try:
+            profile = blhelibatch.parse_profile(args.profile)
+        except ValueError as e:
+            parser.error(str(e))
+        req = {'op': 'set', 'path': os.path.abspath(args.path),
+               'values': dict(profile)}
+    else:
+        req = {'op': 'export', 'settings': args.settings or None}
+    answer = request(args.socket, req)
+    print(json.dumps(answer, indent=2, sort_keys=True))
+    return 0 if answer['ok'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,387 @@
+"""Intel HEX parsing and encoding
+
+records are parsed into a sparse memory image indexed by absolute address.
+all record types are understood:
+    00 data
+    01 end of file
+    02 extended segment address (base = value * 16)
+    03 start segment address
+    04 extended linear address (base = value << 16)
+    05 start linear address
+records are located by their start code and length field, so any line
+ending (\\n, \\r\\n, \\r or none at all) is accepted."""
+import array
+import binascii
+import bisect
+import itertools
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DATA = 0x00
+EOF = 0x01
+EXT_SEGMENT_ADDR = 0x02
+START_SEGMENT_ADDR = 0x03
+EXT_LINEAR_ADDR = 0x04
+START_LINEAR_ADDR = 0x05
+
+class HexError(Exception):
+    """raised for malformed hex data, offset is the byte offset of the
+    offending record in the file"""
+    def __init__(self, msg, offset=None):
+        if offset is not None:
+            msg = '%s (at byte %d)' % (msg, offset)
+        super(HexError, self).__init__(msg)
+        self.offset = offset
+
+def checksum(data):
+    """intel HEX record checksum, two's complement of the byte sum"""
+    return -sum(bytearray(data)) & 0xFF
+
+def encode_record(address, rtype, data):
+    """returns a record line (without line ending) for the given 16 bit
+    address field, record type and data"""
+    #format is  :llaaaarr[nn..]cc
+    #ll = line length (# of bytes, length of n)
+    #aaaa = address
+    #rr = record type
+    #nn.. = data
+    #cc = checksum, twos complement of (sum(ll..nn) & 0xFF)
+    rec = bytearray([len(data), (address & 0xFF00) >> 8, address & 0xFF,
+                     rtype])
+    rec += data
+    rec.append(checksum(rec))
+    return ':' + binascii.hexlify(rec).upper()
+
+def base_at(buf, pos):
+    """returns the extended segment/linear address base in effect at byte
+    offset pos of buf, found by searching backwards for the last extended
+    address record"""
+    linear = buf.rfind(':02000004', 0, pos)
+    segment = buf.rfind(':02000002', 0, pos)
+    if linear == -1 and segment == -1:
+        return 0
+    elif linear > segment:
+        return int(buf[linear+9:linear+13], 16) << 16
+    else:
+        return int(buf[segment+9:segment+13], 16) << 4
+
+def iter_records(buf, pos=0, base=0):
+    """yields (offset, end, rtype, address, abs_address, data) for every
+    record in buf starting at byte offset pos.  offset/end delimit the
+    record text (without line ending), address is the 16 bit address field,
+    abs_address has the extended segment/linear base applied (base is the
+    starting base, for when pos is in the middle of a file).  iteration
+    stops after the end of file record"""
+    buf_len = len(buf)
+    while True:
+        start = buf.find(':', pos)
+        if start == -1:
+            return
+        try:
+            length = int(buf[start+1:start+3], 16)
+            end = start + 11 + length * 2
+            if end > buf_len:
+                raise ValueError
+            raw = binascii.unhexlify(buf[start+1:end])
+        except (ValueError, TypeError):
+            raise HexError('Malformed record', start)
+        address = (ord(raw[1]) << 8) | ord(raw[2])
+        rtype = ord(raw[3])
+        data = raw[4:-1]
+        yield (start, end, rtype, address, base + address, data)
+        if rtype == EOF:
+            return
+        elif rtype == EXT_SEGMENT_ADDR:
+            base = ((ord(data[0]) << 8) | ord(data[1])) << 4
+        elif rtype == EXT_LINEAR_ADDR:
+            base = ((ord(data[0]) << 8) | ord(data[1])) << 16
+        pos = end
+
+#data length each non-data record type must have
+_RECORD_LENGTHS = {EOF: 0, EXT_SEGMENT_ADDR: 2, START_SEGMENT_ADDR: 4,
+                   EXT_LINEAR_ADDR: 2, START_LINEAR_ADDR: 4}
+
+def _error(offset, line, kind, msg):
+    """build a verify() error report"""
+    return {'offset': offset, 'line': line, 'kind': kind, 'message': msg}
+
+def verify(buf):
+    """check every record in buf (the whole file as a string): start code,
+    hex digits, length field, checksum, record type, overlapping data and
+    the end of file record.  returns a list of error dicts with 'offset'
+    (byte offset of the record), 'line', 'kind' and 'message' keys, empty if
+    the file is valid"""
+    errors = []
+    offsets = []
+    lines = []
+    hex_parts = []
+    #line numbers are counted as the records go by, not per error
+    line = 1
+    prev = 0
+    #a record runs from its start code to the next one or to white space
+    for m in re.finditer(r':[^\s:]*|[^\s:]+', buf):
+        tok = m.group()
+        line += buf.count('\n', prev, m.start())
+        prev = m.start()
+        if tok[0] != ':':
+            errors.append(_error(m.start(), line, 'start',
+                                 'Record does not start with ":"'))
+            continue
+        try:
+            length = int(tok[1:3], 16)
+        except ValueError:
+            length = -1
+        if len(tok) < 11 or len(tok) != 11 + length * 2:
+            errors.append(_error(m.start(), line, 'length',
+                'Record is %d characters long, expected %s' %
+                (len(tok), 11 + length * 2 if length >= 0 else 'more')))
+            continue
+        offsets.append(m.start())
+        lines.append(line)
+        hex_parts.append(tok[1:])
+
+    #decode everything in one go, only look record by record if that fails
+    try:
+        raw = bytearray(binascii.unhexlify(''.join(hex_parts)))
+    except TypeError:
+        good_offsets = []
+        good_lines = []
+        good_parts = []
+        for offset, part_line, part in zip(offsets, lines, hex_parts):
+            try:
+                binascii.unhexlify(part)
+            except TypeError:
+                errors.append(_error(offset, part_line, 'hex',
+                                     'Record contains non hex characters'))
+                continue
+            good_offsets.append(offset)
+            good_lines.append(part_line)
+            good_parts.append(part)
+        offsets = good_offsets
+        lines = good_lines
+        raw = bytearray(binascii.unhexlify(''.join(good_parts)))
+        hex_parts = good_parts
+
+    #start of each record in raw
+    starts = [0] * len(hex_parts)
+    pos = 0
+    for i, part in enumerate(hex_parts):
+        starts[i] = pos
+        pos += len(part) // 2
+
+    #a record's bytes, checksum included, sum to 0 mod 256
+    if numpy is not None and starts:
+        sums = numpy.add.reduceat(numpy.frombuffer(buffer(raw),
+                                  dtype=numpy.uint8).astype(numpy.uint32),
+                                  starts) & 0xFF
+        bad = numpy.flatnonzero(sums).tolist()
+    else:
+        ends = starts[1:] + [len(raw)]
+        bad = [i for i in xrange(len(starts))
+               if sum(raw[starts[i]:ends[i]]) & 0xFF]
+    for i in bad:
+        errors.append(_error(offsets[i], lines[i], 'checksum',
+                             'Bad checksum'))
+
+    #record types, and the (start, end, record) range of every data record
+    base = 0
+    ranges = []
+    eof = None
+    for i, start in enumerate(starts):
+        length = raw[start]
+        address = (raw[start+1] << 8) | raw[start+2]
+        rtype = raw[start+3]
+        if eof is not None:
+            errors.append(_error(offsets[i], lines[i], 'eof',
+                                 'Record after end of file record'))
+            break
+        if rtype == DATA:
+            if length:
+                ranges.append((base + address, base + address + length, i))
+            continue
+        if rtype not in _RECORD_LENGTHS:
+            errors.append(_error(offsets[i], lines[i], 'type',
+                                 'Unknown record type %02X' % rtype))
+            continue
+        if length != _RECORD_LENGTHS[rtype]:
+            errors.append(_error(offsets[i], lines[i], 'length',
+                'Record type %02X must have %d data bytes' %
+                (rtype, _RECORD_LENGTHS[rtype])))
+            continue
+        if rtype == EOF:
+            eof = i
+        elif rtype == EXT_SEGMENT_ADDR:
+            base = ((raw[start+4] << 8) | raw[start+5]) << 4
+        elif rtype == EXT_LINEAR_ADDR:
+            base = ((raw[start+4] << 8) | raw[start+5]) << 16
+    if eof is None:
+        errors.append(_error(len(buf), line + buf.count('\n', prev), 'eof',
+                             'Missing end of file record'))
+
+    #records may come in any order, only data written twice is an error
+    ranges.sort()
+    covered = None
+    for start, end, i in ranges:
+        if covered is not None and start < covered[0]:
+            errors.append(_error(offsets[i], lines[i], 'address',
+                'Data at 0x%X overlaps the record on line %d' %
+                (start, lines[covered[1]])))
+        if covered is None or end > covered[0]:
+            covered = (end, i)
+
+    errors.sort(key=lambda e: e['offset'])
+    return errors
+
+class RecordTable(object):
+    """the records of a file as parallel arrays instead of a list of tuples,
+    a few bytes per record rather than a hundred or so.  indexing and
+    iterating give (offset, end, rtype, address, abs_address, length)
+    tuples like iter_records"""
+    def __init__(self):
+        self.offsets = array.array('I')
+        self.ends = array.array('I')
+        self.rtypes = array.array('B')
+        self.addresses = array.array('H')
+        self.abs_addresses = array.array('I')
+        self.lengths = array.array('B')
+
+    def append(self, rec):
+        offset, end, rtype, address, abs_address, length = rec
+        self.offsets.append(offset)
+        self.ends.append(end)
+        self.rtypes.append(rtype)
+        self.addresses.append(address)
+        self.abs_addresses.append(abs_address)
+        self.lengths.append(length)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, idx):
+        return (self.offsets[idx], self.ends[idx], self.rtypes[idx],
+                self.addresses[idx], self.abs_addresses[idx],
+                self.lengths[idx])
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def iter_from(self, start):
+        """iterate over the records from index start on"""
+        return itertools.izip(self.offsets[start:], self.ends[start:],
+                              self.rtypes[start:], self.addresses[start:],
+                              self.abs_addresses[start:],
+                              self.lengths[start:])
+
+class HexImage(object):
+    """sparse memory image of an intel HEX file.  the memory is kept as a
+    sorted list of contiguous segments, so looking up a byte by absolute
+    address is a binary search"""
+    def __init__(self):
+        #every record, see RecordTable
+        self.records = RecordTable()
+        #start address from a type 03/05 record, if any
+        self.start_address = None
+        #contiguous memory segments, _seg_starts[i] is the absolute address
+        #of the first byte in _segs[i]
+        self._seg_starts = []
+        self._segs = []
+        #absolute address of every data record in ascending order, and the
+        #index of each in self.records, for record_at()
+        self._data_addrs = array.array('I')
+        self._data_index = array.array('I')
+
+    def load(self, buf):
+        """parse every record in buf (the whole file as a string)"""
+        chunks = []
+        for rec in iter_records(buf):
+            offset, end, rtype, address, abs_address, data = rec
+            if rtype == DATA:
+                chunks.append((abs_address, len(self.records), data))
+            elif rtype in (START_SEGMENT_ADDR, START_LINEAR_ADDR):
+                self.start_address = int(binascii.hexlify(data), 16)
+            self.records.append((offset, end, rtype, address, abs_address,
+                                 len(data)))
+
+        #merge the data into contiguous segments
+        chunks.sort(key=lambda c: c[0])
+        for abs_address, idx, data in chunks:
+            self._data_addrs.append(abs_address)
+            self._data_index.append(idx)
+            if not data:
+                continue
+            if self._segs:
+                seg_end = self._seg_starts[-1] + len(self._segs[-1])
+                if abs_address < seg_end:
+                    raise HexError('Overlapping data at 0x%X' % abs_address)
+                if abs_address == seg_end:
+                    self._segs[-1] += data
+                    continue
+            self._seg_starts.append(abs_address)
+            self._segs.append(bytearray(data))
+
+    def _segment(self, address):
+        """returns (segment index, offset in segment) for address"""
+        i = bisect.bisect_right(self._seg_starts, address) - 1
+        if i < 0 or address - self._seg_starts[i] >= len(self._segs[i]):
+            raise KeyError('No data at address 0x%X' % address)
+        return i, address - self._seg_starts[i]
+
+    def __getitem__(self, address):
+        i, off = self._segment(address)
+        return self._segs[i][off]
+
+    def read(self, address, length):
+        """returns length bytes starting at address as a bytearray"""
+        i, off = self._segment(address)
+        if off + length > len(self._segs[i]):
+            raise KeyError('No data at address 0x%X' %
+                           (self._seg_starts[i] + len(self._segs[i])))
+        return self._segs[i][off:off+length]
+
+    def read_upto(self, address, length):
+        """like read(), but returns fewer than length bytes if the data
+        stops earlier"""
+        i, off = self._segment(address)
+        return self._segs[i][off:off+length]
+
+    def write(self, address, data):
+        """overwrite bytes that already exist in the image"""
+        i, off = self._segment(address)
+        if off + len(data) > len(self._segs[i]):
+            raise KeyError('No data at address 0x%X' %
+                           (self._seg_starts[i] + len(self._segs[i])))
+        self._segs[i][off:off+len(data)] = data
+
+    def segments(self):
+        """returns [(absolute address, bytearray), ...] for each contiguous
+        run of data, in address order"""
+        return zip(self._seg_starts, self._segs)
+
+    def record_at(self, address):
+        """returns the index of the data record starting at the absolute
+        address, or None"""
+        i = bisect.bisect_left(self._data_addrs, address)
+        if i < len(self._data_addrs) and self._data_addrs[i] == address:
+            return self._data_index[i]
+        return None
+
+    def records_in(self, start, end):
+        """returns the indices of the data records holding any of the bytes
+        from absolute address start up to end, in file order"""
+        i = max(bisect.bisect_right(self._data_addrs, start) - 1, 0)
+        found = []
+        while i < len(self._data_addrs) and self._data_addrs[i] < end:
+            idx = self._data_index[i]
+            if self._data_addrs[i] + self.records.lengths[idx] > start:
+                found.append(idx)
+            i += 1
+        return sorted(found)
+
+    def encode(self, idx):
+        """regenerate the text for record idx from the current memory"""
+        offset, end, rtype, address, abs_address, length = self.records[idx]
+        return encode_record(address, rtype, self.read(abs_address, length))
@@ -1,7 +1,13 @@
 #!/usr/bin/python
+import argparse
 import blhelihex
+import blhelilookup
+import blheliscreen
+import blhelisession
+import blhelistats
 import curses
 import curses.wrapper
+import json
 import os.path
 import sys
 
@@ -11,21 +17,35 @@ def show_help(scr, command=None):
         text = """List of commands:
         help                 display this message
         help <command>       display additional help for a command
-        oh <filename>        open hex file for editing
+        oh <filename> ...    open hex file(s) for editing
         sh <filename>        save edited hex to new filename
         ls                   list settings & their current values
         es <setting>         edit setting value
         vs <setting>         view setting value
+        fs <text>            find settings by name, abbreviation or value
+        cs <prefix>          list the settings a name prefix completes to
+        undo                 undo the last es
+        redo                 redo the last undone es
         quit                 exit this program
+
+        Commands can also be run without the terminal interface:
+        python pyblheli.py -s script.txt [--json]
+
+        Press tab to complete commands and setting names, PgUp
+        and PgDn to page through long output.
         """
         scr.addstr(text)
     elif command == 'help':
         scr.addstr('You think you\'re funny, doncha?')
     elif command == 'oh':
-        text = """oh <filename>
+        text = """oh <filename> [<filename> ...]
         open a hex file for reading.
         note that for atmel ESC's, you should open the '.EEP' file
-        but for SiLab ESC's you should open the '.HEX' file"""
+        but for SiLab ESC's you should open the '.HEX' file.
+        open several files (ex: the four images of a 4-in-1 board)
+        to edit them together, every change applies to all of them
+
+        Example: oh ESC1.HEX ESC2.HEX ESC3.HEX ESC4.HEX"""
         scr.addstr(text)
     elif command == 'sh':
         text = """sh <filename>
@@ -33,11 +53,16 @@ def show_help(scr, command=None):
         files by default.  To overwrite a file, prepend the filename
         with a bang.
 
-        Example: sh !BS12A_MULTI.EEP"""
+        Example: sh !BS12A_MULTI.EEP
+
+        with several files open, sh ! saves them all in place and
+        sh <directory> saves copies into an existing directory
+        (sh !<directory> to overwrite files there)"""
         scr.addstr(text)
     elif command == 'ls':
         text ="""ls
-        list settings and their current values."""
+        list settings and their current values.  with several files
+        open, settings that differ show each file's value"""
         scr.addstr(text)
     elif command == 'es':
         text = """es <setting>
@@ -45,7 +70,8 @@ def show_help(scr, command=None):
         predefined values you will be shown a list of possible
         values.  You will then be prompted to enter the new value.
         For convenience, you can enter just the beginning of a
-        setting name as long as it is unambiguous.
+        setting name, the beginning of each of its words or one
+        of its values, as long as it is unambiguous (see fs).
 
         Example: es pwm"""
         scr.addstr(text)
@@ -54,201 +80,422 @@ def show_help(scr, command=None):
         view setting value.  displays the current value for an
         individual setting along with all possible values for
         that setting.  For convenience, you can enter just the
-        beginning of a setting name as long as it is unambiguous.
+        beginning of a setting name, the beginning of each of its
+        words or one of its values, as long as it is unambiguous.
 
         Example: vs beacon-s"""
         scr.addstr(text)
+    elif command == 'fs':
+        text = """fs <text>
+        find settings.  lists every setting whose name starts
+        with text, whose words start with the dash separated
+        parts of text, or that has a value starting with text,
+        best match first, with their current values.
+
+        Example: fs m-dir
+        Example: fs bidirectional"""
+        scr.addstr(text)
+    elif command == 'cs':
+        text = """cs <prefix>
+        complete a setting name.  lists the settings whose
+        name starts with prefix.
+
+        Example: cs ppm-"""
+        scr.addstr(text)
+    elif command == 'undo':
+        text = """undo
+        undo the last change made with es, in every open file.
+        can be repeated back to when the files were opened"""
+        scr.addstr(text)
+    elif command == 'redo':
+        text = """redo
+        redo the last change undone with undo"""
+        scr.addstr(text)
     elif command == 'quit':
         scr.addstr('quit\n\tquit without saving changes')
 
-def input_line(scr):
-    maxy, maxx = scr.getmaxyx()
-    y = maxy-1
-    x = 0
-    scr.addch(y,x, ":")
-    return scr.getstr(y,x+1)
-
 def show_title(scr):
     y,x = scr.getmaxyx()
     x /=2
     x -= 20
+    x = max(x, 0)
     y = 1
     scr.addstr(y, x, 'PyBLHeli - because real men use the terminal')
     scr.addstr(y+1, x, '   by akcom')
-    scr.move(y+3, 0)
 
 def print_err(scr, text):
     scr.addstr('ERROR: %s' % text)
 
-def find_setting(lst, prefix):
-    #given a prefix (ex: pwm) find a matching setting from the lst
-    #if there is more than one match, return none
-    result = None
-    prefix = prefix.lower()
-    for x in lst:
-        if x.startswith(prefix):
-            #more than one match
-            if result is not None:
-                return None
-            result = x
-    return result
+COMMANDS = ['help', 'quit', 'oh', 'sh', 'ls', 'es', 'vs', 'fs', 'cs', 'undo',
+            'redo']
+
+def complete_line(images, text):
+    """tab completion for the command line: the command, then the setting
+    name for commands taking one.  returns (text, candidates)"""
+    words = text.split(' ')
+    if len(words) == 1:
+        candidates = [c for c in COMMANDS if c.startswith(words[0])]
+    elif len(words) == 2 and words[0] in ('es', 'vs', 'cs', 'help'):
+        if words[0] == 'help':
+            candidates = [c for c in COMMANDS if c.startswith(words[1])]
+        else:
+            candidates = images.index().complete(words[1])
+    else:
+        return text, []
+    if not candidates:
+        return text, []
+    words[-1] = blhelilookup.common_prefix(candidates)
+    if len(candidates) == 1:
+        words[-1] += ' ' if len(words) == 1 else ''
+    return ' '.join(words), candidates
+
+class Session(object):
+    """editor state shared by the curses and headless front ends"""
+    def __init__(self):
+        #the open files, see blhelisession
+        self.images = blhelisession.BLHeliSession()
+        #set to true once we've opened a file and the other commands
+        #are available
+        self.file_opened = False
+        #set to true by the quit command
+        self.done = False
+
+class TextOutput(object):
+    """collects what commands write when there is no curses screen"""
+    def __init__(self):
+        self.parts = []
+
+    def addstr(self, text):
+        self.parts.append(text)
+
+    def refresh(self):
+        pass
+
+    def getvalue(self):
+        return ''.join(self.parts)
+
+def show_value(images, setting):
+    """returns (text, value) for a setting of the open files.  when the
+    files disagree, value is the list of each file's value"""
+    values = images.printable(setting)
+    if len(set(values)) == 1:
+        return str(values[0]), values[0]
+    return ' | '.join(str(v) for v in values), values
+
+def save_all(scr, images, target):
+    """sh with several files open"""
+    if target == '!':
+        results = images.save()
+    else:
+        overwrite = target[0] == '!'
+        if overwrite:
+            target = target[1:]
+        if not os.path.isdir(target):
+            print_err(scr, 'With several files open, save to ! or to a '
+                      'directory')
+            return False
+        if not overwrite:
+            for path in images.paths:
+                if os.path.isfile(os.path.join(target,
+                                               os.path.basename(path))):
+                    print_err(scr, 'File exists, prepend with bang to '
+                              'overwrite')
+                    return False
+        results = images.save_to(target)
+    ok = True
+    for filename, err in results:
+        if err is None:
+            scr.addstr('%s written\n' % filename)
+        else:
+            ok = False
+            print_err(scr, 'Unable to write %s: %s\n' % (filename, err))
+    return ok
+
+def run_command(scr, session, cmd, args, ask_value):
+    """execute one command, writing its output with scr.addstr.  ask_value
+    is called to get the new value for 'es'.  returns (ok, data), where ok
+    is False if the command failed and data holds the settings the command
+    displayed as a {setting: value} dict, the list of setting names found
+    for 'fs' and 'cs' (best first), or None"""
+    images = session.images
+
+    if cmd not in COMMANDS:
+        print_err(scr, 'Unrecognized command')
+        return False, None
+
+    if cmd == 'help':
+        #help
+        if len(args) == 1:
+            show_help(scr, args[0])
+        else:
+            show_help(scr)
+    elif cmd == 'quit':
+        #quit
+        session.done = True
+    elif cmd == 'oh':
+        #open hex file
+        if len(args) >= 1:
+            for filename in args:
+                extension = filename.split('.')[-1].upper()
+                #validate the extension, EEP = Atmel, HEX = SiLabs
+                if extension != 'EEP' and extension != 'HEX':
+                    print_err(scr,
+                        'Unknown file type (only HEX and EEP accepted)')
+                    return False, None
+            try:
+                images.open(args)
+                if len(args) == 1:
+                    scr.addstr('File read successfully')
+                else:
+                    scr.addstr('%d files read successfully' % len(args))
+                session.file_opened = True
+            except Exception as e:
+                print_err(scr, 'Unable to read file: %s' % e)
+                return False, None
+        else:
+            show_help(scr, 'oh')
+            return False, None
+    elif not session.file_opened:
+        #the rest of the commands can only be used once a file is opened
+        print_err(scr, 'Must open a file first')
+        return False, None
+    elif cmd == 'sh':
+        #save hex file
+        if len(args) == 1 and len(images) > 1:
+            if not save_all(scr, images, args[0]):
+                return False, None
+        elif len(args) == 1:
+            if os.path.isfile(args[0]):
+                print_err(scr,
+                          'File exists, prepend with bang to overwrite')
+                return False, None
+            if args[0][0] == '!':
+                args[0] = args[0][1:]
+            try:
+                images.images[0].write(args[0])
+                scr.addstr('File written')
+            except Exception as e:
+                print_err(scr, 'Unable to write file: %s' % e)
+                return False, None
+        else:
+            show_help(scr, 'sh')
+            return False, None
+    elif cmd == 'undo' or cmd == 'redo':
+        #step back or forward through the edit history
+        before = dict((k, show_value(images, k)[0]) for k in images.keys())
+        if cmd == 'undo':
+            done = images.undo()
+        else:
+            done = images.redo()
+        if not done:
+            print_err(scr, 'Nothing to %s' % cmd)
+            return False, None
+        data = {}
+        for k in images.keys():
+            text, value = show_value(images, k)
+            if text != before[k]:
+                data[k] = value
+                scr.addstr('%s => %s\n' % (k, text))
+        return True, data
+    elif cmd == 'ls':
+        #list settings
+        items = images.keys()
+        data = {}
+
+        #list in two columns, code is ugly sorry
+        for i in range(0, len(items), 2):
+            k = items[i]
+            #first column text
+            s1 = ''
+            s2 = ''
+            try:
+                text, data[k] = show_value(images, k)
+                s1 = '%s => %s' % (k, text)
+
+                #second column text
+                if i+1 < len(items):
+                    k = items[i+1]
+                    text, data[k] = show_value(images, k)
+                    s2 = '%s => %s' % (k, text)
+                else:
+                    s2 = ''
+            except Exception as e:
+                scr.addstr('Error reading value @ %s - %s' % (k,e))
+
+            #concatenate the columns
+            line = '%-32s %s\n' % (s1, s2)
+            scr.addstr(line)
+        return True, data
+    elif cmd == 'fs' or cmd == 'cs':
+        #search the settings of the open files
+        if len(args) != 1:
+            show_help(scr, cmd)
+            return False, None
+        index = images.index()
+        if cmd == 'fs':
+            matches = index.lookup(args[0])
+        else:
+            matches = [(name, blhelilookup.PREFIX)
+                       for name in index.complete(args[0])]
+        if not matches:
+            print_err(scr, 'No setting matches "%s"' % args[0])
+            return False, None
+        for name, rank in matches:
+            scr.addstr('%-24s %-14s %s\n' % (name,
+                       blhelilookup.RANK_NAMES[rank],
+                       show_value(images, name)[0]))
+        return True, [name for name, rank in matches]
+    elif cmd == 'es' or cmd == 'vs':
+        #code is essentially the same except ES has a prompt at the end
+        if len(args) != 1:
+            show_help(scr, cmd)
+            return False, None
+
+        #look up the setting in case the user passed us a partial
+        setting = images.find(args[0])
+        if setting is None:
+            matches = images.index().lookup(args[0])
+            if matches:
+                print_err(scr, 'Ambiguous setting "%s", could be: %s' %
+                          (args[0], ', '.join(m[0] for m in matches)))
+            else:
+                print_err(scr, 'Unknown setting "%s"' % args[0])
+            return False, None
+
+        #print the current value
+        scr.addstr('%s => %s\n\n' % (setting,
+                                        show_value(images, setting)[0]))
+
+        #check to make sure its not read only
+
+        #see if we can print constraints
+        constraints = images.constraints(setting)
+        if constraints is not None:
+            scr.addstr('Possible values:\n')
+            for kk,vv in constraints.items():
+                scr.addstr('\t%-4s (%s)\n' % (kk,vv))
+
+        if cmd == 'es':
+            scr.addstr('\nSelect a new value\n')
+            val = ask_value()
+            try:
+                int_val = int(val)
+                images[setting] = int_val
+                scr.addstr('%s updated' % setting)
+            except Exception as e:
+                print_err(scr, 'Unable to set %s to %s: %s' %\
+                          (setting, val, e))
+                return False, None
+        return True, {setting: show_value(images, setting)[1]}
+    return True, None
 
 def main(scr):
     curses.start_color()
-    curses.echo()
-
-    #set to True after the first run
-    init = False
-    blh = blhelihex.BLHeliHex()
-    scr.scrollok(True)
-
-    #set to true once we've opened a file and the other commands are available
-    file_opened = False
-
-    while True:
-        #initialize, if not done already
-        if init is False:
-            #write the title
-            show_title(scr)
-            #show the help message
-            show_help(scr)
-            init = True
+    #the screen draws what is typed itself
+    curses.noecho()
+
+    session = Session()
+    #commands write into out, the screen shows it when they're done
+    screen = blheliscreen.Screen(scr, show_title)
+    out = [TextOutput()]
 
-        #show the screen
-        scr.refresh()
+    def ask_value():
+        #show what the command printed so far above the prompt
+        screen.show(out[0].getvalue(), at_end=True)
+        return screen.read()
 
+    def complete(text):
+        return complete_line(session.images, text)
+
+    #show the help message
+    show_help(out[0])
+    screen.show(out[0].getvalue())
+
+    while not session.done:
         #get the input and parse
-        line = input_line(scr)
+        line = screen.read(complete)
         line = line.split(' ')
         cmd = line[0]
         args = line[1:]
 
-        #clear the screen
-        scr.erase()
-        #write the title
-        show_title(scr)
-
-        valid_commands = ['help', 'quit', 'oh', 'sh', 'ls', 'es', 'vs']
-        if cmd not in valid_commands:
-            print_err(scr, 'Unrecognized command')
+        out[0] = TextOutput()
+        run_command(out[0], session, cmd, args, ask_value)
+        screen.show(out[0].getvalue())
+
+def run_script(lines, out, as_json=False, keep_going=False):
+    """run commands without curses, one per line (blank lines and lines
+    starting with # are skipped).  'es' takes the new value as a second
+    argument: es <setting> <value>.  output goes to the file object out, as
+    plain text or as one JSON object per command.  stops at the first
+    failing command unless keep_going.  returns True if every command
+    succeeded"""
+    session = Session()
+    all_ok = True
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
             continue
-
-
-        if cmd == 'help':
-            #help
-            if len(args) == 1:
-                show_help(scr, args[0])
-            else:
-                show_help(scr)
-        elif cmd == 'quit':
-            #quit
+        words = line.split()
+        cmd = words[0]
+        args = words[1:]
+        value = []
+        if cmd == 'es' and len(args) == 2:
+            value = [args.pop()]
+        text = TextOutput()
+        ok, data = run_command(text, session, cmd, args,
+                               lambda: value[0] if value else '')
+        all_ok = all_ok and ok
+        if as_json:
+            result = {'command': line, 'ok': ok, 'output': text.getvalue()}
+            if data is not None:
+                result['settings'] = data
+            out.write(json.dumps(result, sort_keys=True) + '\n')
+        else:
+            output = text.getvalue()
+            out.write(output if output.endswith('\n') else output + '\n')
+        if session.done or not (ok or keep_going):
             break
-        elif cmd == 'oh':
-            #open hex file
-            if len(args) == 1:
-                extension = args[0].split('.')[-1].upper()
-                #validate the extension, EEP = Atmel, HEX = SiLabs
-                try:
-                    if extension == 'EEP' or extension == 'HEX':
-                        is_atmel = extension == 'EEP' or args[-2] == 'EEP'
-                        blh.read(args[0], atmel=is_atmel)
-                        scr.addstr('File read successfully')
-                        file_opened = True
-                    else:
-                        print_err(scr,
-                            'Unknown file type (only HEX and EEP accepted)')
-                except Exception as e:
-                    print_err(scr, 'Unable to read file: %s' % e)
-
-            else:
-                show_help(scr, 'oh')
-        elif not file_opened:
-            #the rest of the commands can only be used once a file is opened
-            print_err(scr, 'Must open a file first')
-        elif cmd == 'sh':
-            #save hex file
-            if len(args) == 1:
-                if os.path.isfile(args[0]):
-                    print_err(scr,
-                              'File exists, prepend with bang to overwrite')
-                    continue
-                if args[0][0] == '!':
-                    args[0] = args[0][1:]
-                try:
-                    blh.write(args[0])
-                    scr.addstr('File written')
-                except Exception as e:
-                    print_err(scr, 'Unable to write file: %s' % e)
-
-            else:
-                show_help(scr, 'sh')
-        elif cmd == 'ls':
-            #list settings
-            items = blh.keys()
-
-            #list in two columns, code is ugly sorry
-            for i in range(0, len(items), 2):
-                k = items[i]
-                #first column text
-                s1 = ''
-                s2 = ''
-                try:
-                    s1 = '%s => %s' % (k, blh.printable(k))
-
-                    #second column text
-                    if i+1 < len(items):
-                        k = items[i+1]
-                        s2 = '%s => %s' % (k, blh.printable(k))
-                    else:
-                        s2 = ''
-                except Exception as e:
-                    scr.addstr('Error reading value @ %s - %s' % (k,e))
-
-                #concatenate the columns
-                line = '%-32s %s\n' % (s1, s2)
-                scr.addstr(line)
-                scr.refresh()
-        elif cmd == 'es' or cmd == 'vs':
-            #code is essentially the same except ES has a prompt at the end
-            if len(args) != 1:
-                show_help(scr, cmd)
-                continue
-
-            #look up the setting in case the user passed us a partial
-            setting = find_setting(blh.keys(), args[0])
-            if setting is None:
-                print_err(scr, 'Ambiguous or unknown setting "%s"' % args[0])
-                continue
-
-            #print the current value
-            scr.addstr('%s => %s\n\n' % (setting, blh.printable(setting)))
-
-            #check to make sure its not read only
-
-            #see if we can print constraints
-            constraints = blh.constraints(setting)
-            if constraints is not None:
-                scr.addstr('Possible values:\n')
-                for kk,vv in constraints.items():
-                    scr.addstr('\t%-4s (%s)\n' % (kk,vv))
-
-            if cmd == 'es':
-                scr.addstr('\nSelect a new value\n')
-                y,x = scr.getyx()
-                val = input_line(scr)
-                scr.move(y,x)
-                try:
-                    int_val = int(val)
-                    blh[setting] = int_val
-                    scr.addstr('%s updated' % setting)
-                except Exception as e:
-                    print_err(scr, 'Unable to set %s to %s: %s' %\
-                              (setting, val, e))
-
-
+    return all_ok
 
 def wrap():
     curses.wrapper(main)
 
+def headless(argv=None):
+    """entry point for scripted use, see run_script"""
+    parser = argparse.ArgumentParser(
+        description='edit BLHeli hex files from command scripts')
+    parser.add_argument('-s', '--script', action='append', required=True,
+        help='file of commands to run, - for stdin.  repeat to run several '
+             'scripts, each in its own session')
+    parser.add_argument('--json', action='store_true',
+        help='print one JSON object per command')
+    parser.add_argument('-k', '--keep-going', action='store_true',
+        help='carry on after a command fails')
+    parser.add_argument('--profile', action='store_true',
+        help='print time spent reading, writing and setting values to stderr')
+    args = parser.parse_args(argv)
+
+    if args.profile:
+        stats = blhelistats.Stats()
+        blhelihex.set_stats(stats)
+    all_ok = True
+    for script in args.script:
+        if script == '-':
+            lines = sys.stdin
+        else:
+            lines = open(script, 'r')
+        try:
+            ok = run_script(lines, sys.stdout, args.json, args.keep_going)
+        finally:
+            if lines is not sys.stdin:
+                lines.close()
+        all_ok = all_ok and ok
+    if args.profile:
+        blhelihex.set_stats(None)
+        sys.stderr.write(stats.summary() + '\n')
+    return 0 if all_ok else 1
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(headless())
     wrap()
@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import blhelibatch
+import blhelicorpus
+import blhelihex
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for site in ('siteA', 'siteB'):
+            os.mkdir(os.path.join(self.dir, site))
+            blhelicorpus.write_corpus(os.path.join(self.dir, site), 2)
+        self.profile = blhelibatch.parse_profile(
+            'motor-timing=High, ppm-min-throttle=1140')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _read(self, path):
+        blh = blhelihex.BLHeliHex()
+        blh.read(path, False)
+        return blh
+
+    def test_in_place(self):
+        paths = blhelibatch.expand_paths([os.path.join(self.dir, 'siteA')])
+        results = list(blhelibatch.run_batch(paths, self.profile,
+                                             processes=2))
+        self.assertEqual([err for path, err in results], [None, None])
+        for path, rel in paths:
+            blh = self._read(path)
+            self.assertEqual(blh.printable('motor-timing'), 'High')
+            self.assertEqual(blh.printable('ppm-min-throttle'), 1140)
+
+    def test_duplicate_outputs_fail(self):
+        out = os.path.join(self.dir, 'out')
+        paths = blhelibatch.expand_paths([os.path.join(self.dir, 'siteA'),
+                                          os.path.join(self.dir, 'siteB')])
+        results = dict(blhelibatch.run_batch(paths, self.profile, out, 2))
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(err is not None for err in results.values()))
+        self.assertFalse(os.path.exists(out) and os.listdir(out))
+
+    def test_bad_profile_changes_nothing(self):
+        paths = blhelibatch.expand_paths([os.path.join(self.dir, 'siteA')])
+        before = [open(path, 'rb').read() for path, rel in paths]
+        profile = blhelibatch.parse_profile('motor-timing=High, fw-rev=3')
+        results = list(blhelibatch.run_batch(paths, profile, processes=1))
+        self.assertTrue(all(err is not None for path, err in results))
+        self.assertEqual([open(path, 'rb').read() for path, rel in paths],
+                         before)
+
+    def test_profile_values(self):
+        schema = blhelihex.BLHeliHex.SCHEMA
+        index = schema.index
+        profile = blhelibatch.compile_profile(
+            [('closed-loop', 4), ('motor-timing', 'high'),
+             ('pwm-freq', '2'), ('ppm-min-throttle', 1140)])
+        self.assertEqual(sorted(profile.compile(schema)),
+                         sorted([(schema.pos[index['closed-loop']], 4),
+                                 (schema.pos[index['motor-timing']], 5),
+                                 (schema.pos[index['pwm-freq']], 2),
+                                 (schema.pos[index['ppm-min-throttle']],
+                                  35)]))
+        self.assertRaises(Exception, blhelibatch.compile_profile(
+            [('motor-timing', 'Fastest')]).compile, schema)
+
+    def test_pool_imap(self):
+        items = range(-50, 0)
+        self.assertEqual(list(blhelibatch.pool_imap(abs, items, 2,
+                                                    ordered=True)),
+                         map(abs, items))
+        self.assertEqual(sorted(blhelibatch.pool_imap(abs, items, 2)),
+                         sorted(map(abs, items)))
+        #closing the generator early stops the workers
+        results = blhelibatch.pool_imap(abs, items, 2)
+        next(results)
+        results.close()
+
+    def test_stop_early(self):
+        paths = blhelibatch.expand_paths([self.dir])
+        results = blhelibatch.run_batch(paths, self.profile, processes=2)
+        path, err = next(results)
+        self.assertEqual(err, None)
+        results.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import blhelicache
+import blhelicorpus
+import blhelihex
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'a.hex')
+        with open(self.path, 'wb') as f:
+            f.write(blhelicorpus.silabs_image())
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _read(self, cache, path=None, settings_only=False):
+        blh = blhelihex.BLHeliHex()
+        blh.read(path or self.path, False, settings_only, cache=cache)
+        return blh
+
+    def test_hit(self):
+        cache = blhelicache.ParseCache()
+        first = self._read(cache)
+        for settings_only in (False, True):
+            blh = self._read(cache, settings_only=settings_only)
+            self.assertEqual(str(blh.settings_buf), str(first.settings_buf))
+            self.assertEqual(blh.settings_records, first.settings_records)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        #a cached read can still be edited and written
+        blh['motor-timing'] = 5
+        blh.patch()
+        self.assertEqual(blh.verify(), [])
+        self.assertEqual(self._read(None)['motor-timing'], 5)
+
+    def test_mtime_change(self):
+        cache = blhelicache.ParseCache()
+        self._read(cache)
+        st = os.stat(self.path)
+        os.utime(self.path, (st.st_atime, st.st_mtime + 10))
+        self._read(cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+    def test_size_change(self):
+        cache = blhelicache.ParseCache()
+        self._read(cache)
+        st = os.stat(self.path)
+        with open(self.path, 'ab') as f:
+            f.write('\n')
+        os.utime(self.path, (st.st_atime, st.st_mtime))
+        self._read(cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+    def test_content_hash(self):
+        cache = blhelicache.ParseCache(content_hash=True)
+        self._read(cache)
+        copy = os.path.join(self.dir, 'copy.hex')
+        shutil.copy(self.path, copy)
+        self._read(cache, copy)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        #same size and mtime, different contents
+        st = os.stat(copy)
+        blh = self._read(None, copy)
+        blh['motor-timing'] = 5
+        blh.patch()
+        os.utime(copy, (st.st_atime, st.st_mtime))
+        self.assertEqual(self._read(cache, copy)['motor-timing'], 5)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_disk(self):
+        cache_dir = os.path.join(self.dir, 'cache')
+        cache = blhelicache.ParseCache(directory=cache_dir)
+        first = self._read(cache)
+        #a new process starts with an empty memory cache
+        cache = blhelicache.ParseCache(directory=cache_dir)
+        blh = self._read(cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        self.assertEqual(str(blh.settings_buf), str(first.settings_buf))
+
+    def test_disk_eviction(self):
+        cache_dir = os.path.join(self.dir, 'cache')
+        cache = blhelicache.ParseCache(max_entries=4, directory=cache_dir,
+                                       max_disk_entries=10)
+        for n in xrange(25):
+            cache.put(('key', n), n)
+            self.assertTrue(len(os.listdir(cache_dir)) <= 10)
+        self.assertEqual(len(cache._entries), 4)
+        #the last entry put is never the one evicted
+        cache = blhelicache.ParseCache(directory=cache_dir)
+        self.assertEqual(cache.get(('key', 24)), 24)
+        cache.clear()
+        self.assertEqual(os.listdir(cache_dir), [])
+
+if __name__ == '__main__':
+    unittest.main()
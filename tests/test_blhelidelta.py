@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import blhelicorpus
+import blhelidelta
+import blhelihex
+
+class DeltaTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.base_path = os.path.join(self.dir, 'base.hex')
+        with open(self.base_path, 'wb') as f:
+            f.write(blhelicorpus.silabs_image())
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _read(self, path=None):
+        blh = blhelihex.BLHeliHex()
+        blh.read(path or self.base_path, False)
+        return blh
+
+    def test_round_trip(self):
+        variant = self._read()
+        variant['motor-timing'] = 4
+        variant['pwm-freq'] = 2
+        delta = blhelidelta.loads(blhelidelta.dumps(
+            blhelidelta.make_delta(variant, self._read())))
+        self.assertEqual(len(delta.changes), 2)
+        base = self._read()
+        blhelidelta.apply_delta(base, delta)
+        self.assertEqual(str(base.settings_buf), str(variant.settings_buf))
+
+    def test_unsaved_base_changes(self):
+        base = self._read()
+        base['motor-timing'] = 4
+        variant = self._read()
+        variant['motor-timing'] = 4
+        variant['pwm-freq'] = 2
+        delta = blhelidelta.make_delta(variant, base)
+        fresh = self._read()
+        blhelidelta.apply_delta(fresh, delta)
+        self.assertEqual(fresh['motor-timing'], 4)
+        self.assertEqual(fresh['pwm-freq'], 2)
+
+    def test_without_base(self):
+        variant = self._read()
+        variant['motor-timing'] = 5
+        delta = blhelidelta.make_delta(variant)
+        self.assertEqual(len(delta.changes), 1)
+
+    def test_bad_data(self):
+        data = blhelidelta.dumps(blhelidelta.make_delta(self._read()))
+        self.assertRaises(Exception, blhelidelta.loads, 'XXXX' + data[4:])
+        self.assertRaises(Exception, blhelidelta.loads, data[:-1])
+        bad_family = data[:5] + chr(2) + data[6:]
+        try:
+            blhelidelta.loads(bad_family)
+        except IndexError:
+            self.fail('bare IndexError for an unknown family')
+        except Exception as e:
+            self.assertTrue('Not a settings delta' in str(e))
+        else:
+            self.fail('unknown family accepted')
+
+    def test_wrong_base(self):
+        delta = blhelidelta.make_delta(self._read())
+        other = os.path.join(self.dir, 'other.hex')
+        with open(other, 'wb') as f:
+            f.write(blhelicorpus.silabs_image(seed=1))
+        self.assertRaises(Exception, blhelidelta.apply_delta,
+                          self._read(other), delta)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import csv
+import json
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+import blhelicorpus
+import blheliexport
+import blhelihex
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.paths = blhelicorpus.write_corpus(self.dir, 5)
+        self.bad = os.path.join(self.dir, 'bad.hex')
+        with open(self.bad, 'wb') as f:
+            f.write(':00000001FF\n')
+        self.paths.insert(2, self.bad)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _export(self, fmt, processes=1, batch_size=2):
+        out = StringIO.StringIO()
+        counts = blheliexport.export(iter(self.paths), out, fmt, processes,
+                                     batch_size)
+        self.assertEqual(counts, (len(self.paths), 1))
+        return out.getvalue()
+
+    def test_jsonl(self):
+        for processes in (1, 2):
+            rows = [json.loads(line) for line in
+                    self._export('jsonl', processes).splitlines()]
+            #rows come out in path order whatever the batching
+            self.assertEqual([row['path'] for row in rows], self.paths)
+            self.assertTrue(rows[2]['error'])
+            blh = blhelihex.BLHeliHex()
+            blh.read(self.paths[0], False)
+            self.assertEqual(rows[0]['raw'], dict(blh.iteritems()))
+            self.assertEqual(rows[0]['settings']['motor-timing'],
+                             blh.printable('motor-timing'))
+            self.assertEqual(rows[0]['family'], blhelihex.SILABS)
+
+    def test_csv(self):
+        rows = list(csv.DictReader(StringIO.StringIO(self._export('csv'))))
+        self.assertEqual([row['path'] for row in rows], self.paths)
+        blh = blhelihex.BLHeliHex()
+        blh.read(self.paths[1], False)
+        self.assertEqual(rows[1]['motor-timing.raw'],
+                         str(blh['motor-timing']))
+        self.assertEqual(rows[1]['error'], '')
+        self.assertTrue(rows[2]['error'])
+
+    def test_unknown_format(self):
+        self.assertRaises(Exception, blheliexport.export, self.paths,
+                          StringIO.StringIO(), 'xml')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,310 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import blhelicorpus
+import blhelihex
+import ihex
+
+class ReadTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, text):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(text)
+        return path
+
+    def _read(self, path, settings_only=False):
+        blh = blhelihex.BLHeliHex()
+        blh.read(path, path.upper().endswith('.EEP'), settings_only)
+        return blh
+
+    def test_read(self):
+        path = self._write('a.hex', blhelicorpus.silabs_image())
+        for settings_only in (False, True):
+            blh = self._read(path, settings_only)
+            self.assertEqual(blh['fw-rev'], blhelicorpus.FW_REV)
+            self.assertEqual(blh.printable('motor-timing'), 'Low')
+            self.assertEqual(blh.settings_records[0][4], 0x1A00)
+
+    def test_record_sizes(self):
+        settings = blhelicorpus.make_settings(blhelihex.SILABS)
+        for size in (1, 8, 16, 32):
+            path = self._write('r%d.hex' % size, blhelicorpus.silabs_image(
+                settings=settings, record_size=size))
+            for settings_only in (False, True):
+                blh = self._read(path, settings_only)
+                self.assertTrue(len(blh.settings_buf) >= blh.schema.size)
+                self.assertEqual(blh.settings_buf[:blh.schema.size],
+                                 settings[:blh.schema.size])
+                blh['motor-timing'] = 5
+                out = os.path.join(self.dir, 'out.hex')
+                blh.write(out)
+                with open(out, 'rb') as f:
+                    self.assertEqual(ihex.verify(f.read()), [])
+                self.assertEqual(self._read(out)['motor-timing'], 5)
+
+    def test_segments_and_crlf(self):
+        path = self._write('big.hex', blhelicorpus.silabs_image(
+            0x20000, eol='\r\n'))
+        for settings_only in (False, True):
+            blh = self._read(path, settings_only)
+            self.assertEqual(blh.settings_records[0][4], 0x1A00)
+            self.assertEqual(blh['fw-rev'], blhelicorpus.FW_REV)
+
+    def _check_edit(self, path, settings_only):
+        blh = self._read(path, settings_only)
+        self.assertEqual(blh['fw-rev'], blhelicorpus.FW_REV)
+        blh['motor-timing'] = 5
+        out = os.path.join(self.dir, 'out.hex')
+        blh.write(out)
+        with open(path, 'rb') as a:
+            before = ihex.HexImage()
+            before.load(a.read())
+        with open(out, 'rb') as b:
+            text = b.read()
+        self.assertEqual(ihex.verify(text), [])
+        after = ihex.HexImage()
+        after.load(text)
+        pos = 0x1A00 + blh.schema.pos[blh.schema.index['motor-timing']]
+        self.assertEqual(after[pos], 5)
+        after.write(pos, bytearray([before[pos]]))
+        self.assertEqual(after.segments(), before.segments())
+        self.assertEqual(self._read(out, settings_only)['motor-timing'], 5)
+
+    def test_settings_mid_record(self):
+        settings = blhelicorpus.make_settings(blhelihex.SILABS)
+        lines = []
+        blhelicorpus._data_records(0x19F8, 'code0123' + settings, lines, 0)
+        lines.append(ihex.encode_record(0, ihex.EOF, ''))
+        path = self._write('mid.hex', '\n'.join(lines) + '\n')
+        for settings_only in (False, True):
+            blh = self._read(path, settings_only)
+            self.assertEqual(blh.settings_lead, 'code0123')
+            self.assertEqual(blh.settings_buf[:blh.schema.size],
+                             settings[:blh.schema.size])
+            self._check_edit(path, settings_only)
+
+    def test_no_line_endings(self):
+        path = self._write('one.hex', blhelicorpus.silabs_image(eol=''))
+        for settings_only in (False, True):
+            self._check_edit(path, settings_only)
+
+    def test_settings_out_of_order(self):
+        lines = blhelicorpus.silabs_image(0x1A00).splitlines()
+        first = [i for i, line in enumerate(lines) if line[3:7] == '1A00'][0]
+        lines[first], lines[first + 1] = lines[first + 1], lines[first]
+        path = self._write('swap.hex', '\n'.join(lines) + '\n')
+        for settings_only in (False, True):
+            self._check_edit(path, settings_only)
+
+    def test_atmel(self):
+        path = self._write('a.eep', blhelicorpus.atmel_image(record_size=8))
+        blh = self._read(path)
+        self.assertEqual(blh.family, blhelihex.ATMEL)
+        self.assertEqual(blh['fw-rev'], blhelicorpus.FW_REV)
+
+    def test_missing_settings(self):
+        path = self._write('x.hex', ihex.encode_record(0, ihex.DATA, 'abc') +
+                           '\n' + ihex.encode_record(0, ihex.EOF, '') + '\n')
+        for settings_only in (False, True):
+            self.assertRaises(Exception, self._read, path, settings_only)
+
+    def test_image_is_lazy(self):
+        path = self._write('a.hex', blhelicorpus.silabs_image())
+        blh = self._read(path)
+        self.assertTrue(blh._image is None)
+        blh['motor-timing'] = 5
+        self.assertEqual(blh.image[0x1A00 + blh.schema.pos[
+            blh.schema.index['motor-timing']]], 5)
+
+    def test_write_round_trip(self):
+        path = self._write('a.hex', blhelicorpus.silabs_image())
+        blh = self._read(path)
+        out = os.path.join(self.dir, 'same.hex')
+        blh.write(out)
+        with open(path, 'rb') as a:
+            with open(out, 'rb') as b:
+                self.assertEqual(a.read(), b.read())
+
+    def test_write_keeps_mode(self):
+        path = self._write('a.hex', blhelicorpus.silabs_image())
+        out = self._write('out.hex', '')
+        os.chmod(out, 0640)
+        for settings_only in (False, True):
+            blh = self._read(path, settings_only)
+            blh['motor-timing'] = 5
+            blh.write(out)
+            self.assertEqual(os.stat(out).st_mode & 0777, 0640)
+            self.assertEqual(self._read(out)['motor-timing'], 5)
+        self.assertEqual(sorted(os.listdir(self.dir)), ['a.hex', 'out.hex'])
+
+    def test_failed_write_leaves_no_file(self):
+        path = self._write('a.hex', blhelicorpus.silabs_image())
+        blh = self._read(path)
+        def fail(f, src, stats):
+            f.write('partial')
+            raise IOError('disk full')
+        blh._write_spliced = fail
+        self.assertRaises(IOError, blh.write, os.path.join(self.dir, 'b'))
+        self.assertEqual(os.listdir(self.dir), ['a.hex'])
+
+class LazyTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.hex')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(blhelicorpus.silabs_image())
+        self.blh = blhelihex.BLHeliHex()
+        self.blh.read(self.path, False)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_decoded_on_first_use(self):
+        self.assertTrue(self.blh._vals is None)
+        self.assertEqual(self.blh['fw-rev'], blhelicorpus.FW_REV)
+        self.assertTrue(self.blh._vals is not None)
+
+    def test_printable_memo(self):
+        self.assertEqual(self.blh.printable('motor-timing'), 'Low')
+        self.assertEqual(self.blh._printable, {'motor-timing': 'Low'})
+        self.blh['motor-timing'] = 5
+        self.assertEqual(self.blh._printable, {})
+        self.assertEqual(self.blh.printable('motor-timing'), 'High')
+        #a change to another setting keeps the memo
+        self.blh['pwm-freq'] = 2
+        self.assertEqual(self.blh._printable, {'motor-timing': 'High'})
+
+    def test_reread_drops_memo(self):
+        self.blh.printable('motor-timing')
+        settings = blhelicorpus.make_settings(blhelihex.SILABS)
+        schema = self.blh.schema
+        settings[schema.pos[schema.index['motor-timing']]] = 3
+        self.blh.load_settings(settings, False)
+        self.assertEqual(self.blh.printable('motor-timing'), 'Medium')
+
+class PatchTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'a.hex')
+        with open(self.path, 'wb') as f:
+            f.write(blhelicorpus.silabs_image(0x4000, record_size=8))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _read(self, settings_only=False):
+        blh = blhelihex.BLHeliHex()
+        blh.read(self.path, False, settings_only)
+        return blh
+
+    def test_patch(self):
+        with open(self.path, 'rb') as f:
+            before = f.read()
+        for settings_only in (False, True):
+            blh = self._read(settings_only)
+            blh['motor-timing'] = 5
+            blh['ppm-max-throttle'] = 1900
+            self.assertEqual(len(blh.dirty), 2)
+            blh.patch()
+            self.assertEqual(blh.dirty, set())
+            self.assertEqual(blh.verify(), [])
+            with open(self.path, 'rb') as f:
+                after = f.read()
+            #only the two records changed, in place
+            self.assertEqual(len(after), len(before))
+            changed = [line for line, old in zip(after.splitlines(),
+                                                 before.splitlines())
+                       if line != old]
+            self.assertEqual(len(changed), 2)
+            blh = self._read()
+            self.assertEqual(blh['motor-timing'], 5)
+            self.assertEqual(blh.printable('ppm-max-throttle'), 1900)
+
+    def test_patch_twice(self):
+        blh = self._read(True)
+        blh['motor-timing'] = 5
+        blh.patch()
+        blh['motor-timing'] = 4
+        blh.patch()
+        self.assertEqual(self._read()['motor-timing'], 4)
+        #nothing changed, nothing written
+        st = os.stat(self.path)
+        blh.patch()
+        self.assertEqual(os.stat(self.path).st_size, st.st_size)
+        self.assertEqual(blh.verify(), [])
+
+    def test_patch_changed_file(self):
+        blh = self._read(True)
+        with open(self.path, 'ab') as f:
+            f.write('\n')
+        blh['motor-timing'] = 5
+        self.assertRaises(Exception, blh.patch)
+
+class LayoutTest(unittest.TestCase):
+    def setUp(self):
+        self.registered = dict(blhelihex._LAYOUTS)
+
+    def tearDown(self):
+        blhelihex._LAYOUTS.clear()
+        blhelihex._LAYOUTS.update(self.registered)
+
+    def test_default_schema(self):
+        for family in (blhelihex.SILABS, blhelihex.ATMEL):
+            self.assertTrue(blhelihex.schema_for(family, 20) is
+                            blhelihex.BLHeliHex.SCHEMA)
+
+    def test_schemas_are_kept(self):
+        layout = dict(blhelihex.BLHeliHex.LAYOUT)
+        layout['motor-timing'] = dict(layout['motor-timing'], pos=22)
+        blhelihex.register_layout(layout, blhelihex.SILABS, 99)
+        schema = blhelihex.schema_for(blhelihex.SILABS, 99)
+        self.assertFalse(schema is blhelihex.BLHeliHex.SCHEMA)
+        self.assertEqual(schema.pos[schema.index['motor-timing']], 22)
+        #registering more layouts doesn't recompile the ones in use
+        for revision in xrange(100, 164):
+            blhelihex.register_layout(dict(layout), blhelihex.ATMEL,
+                                      revision)
+            blhelihex.schema_for(blhelihex.ATMEL, revision)
+        self.assertTrue(blhelihex.schema_for(blhelihex.SILABS, 99) is schema)
+        self.assertTrue(blhelihex.schema_for(blhelihex.SILABS, 20) is
+                        blhelihex.BLHeliHex.SCHEMA)
+
+class ApplyTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.hex')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(blhelicorpus.silabs_image())
+        self.blh = blhelihex.BLHeliHex()
+        self.blh.read(self.path, False)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_apply(self):
+        self.blh.apply({'motor-timing': 5, 'ppm-min-throttle': 1140})
+        self.assertEqual(self.blh['motor-timing'], 5)
+        self.assertEqual(self.blh['ppm-min-throttle'], 35)
+
+    def test_apply_is_atomic(self):
+        before = str(self.blh.settings_buf)
+        self.assertRaises(Exception, self.blh.apply,
+                          [('motor-timing', 5), ('motor-timing', 77)])
+        self.assertRaises(Exception, self.blh.apply,
+                          [('motor-timing', 5), ('fw-rev', 1)])
+        self.assertEqual(str(self.blh.settings_buf), before)
+
+    def test_profile_compiled_once(self):
+        profile = blhelihex.Profile({'motor-timing': 5})
+        stores = profile.compile(self.blh.schema)
+        self.blh.apply(profile)
+        self.assertTrue(profile.compile(self.blh.schema) is stores)
+
+if __name__ == '__main__':
+    unittest.main()
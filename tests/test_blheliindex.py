@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import blhelicorpus
+import blhelihex
+import blheliindex
+
+class IndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.paths = blhelicorpus.write_corpus(self.dir, 3)
+        self.index = blheliindex.SettingsIndex(
+            os.path.join(self.dir, 'index.db'))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.dir)
+
+    def test_update_and_query(self):
+        self.assertEqual(self.index.update(self.paths), (3, 0, 0))
+        self.assertEqual(self.index.update(self.paths), (0, 3, 0))
+        self.assertEqual(len(self.index.query([])), 3)
+        self.assertEqual(self.index.query([('fw-rev', '999')]), [])
+
+    def test_missing_file(self):
+        self.index.update(self.paths)
+        os.unlink(self.paths[0])
+        self.assertEqual(self.index.update(self.paths), (0, 2, 1))
+        self.assertEqual(self.index.query([]),
+                         sorted(os.path.abspath(p) for p in self.paths[1:]))
+
+    def test_unreadable_file(self):
+        bad = os.path.join(self.dir, 'bad.hex')
+        with open(bad, 'wb') as f:
+            f.write(':00000001FF\n')
+        self.assertEqual(self.index.update(self.paths[:2] + [bad]),
+                         (2, 0, 1))
+        self.assertEqual([path for path, err in self.index.errors()],
+                         [os.path.abspath(bad)])
+
+    def test_query(self):
+        self.index.update(self.paths)
+        blh = blhelihex.BLHeliHex()
+        blh.read(self.paths[0], False)
+        timing = blh.printable('motor-timing')
+        raw = str(blh['motor-timing'])
+        matches = self.index.query([('motor-timing', timing)])
+        self.assertTrue(os.path.abspath(self.paths[0]) in matches)
+        #the same setting twice, by name and by raw value
+        self.assertEqual(self.index.query([('motor-timing', timing),
+                                           ('motor-timing', raw)]), matches)
+        self.assertEqual(self.index.query([('motor-timing', timing),
+                                           ('motor-timing', timing)]),
+                         matches)
+        other = '1' if raw != '1' else '2'
+        self.assertEqual(self.index.query([('motor-timing', raw),
+                                           ('motor-timing', other)]), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+
+import blhelicorpus
+import blhelihex
+import blhelijournal
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.hex')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(blhelicorpus.silabs_image())
+        self.blh = self._read()
+        self.journal = blhelijournal.Journal(self.blh)
+        self.orig = str(self.blh.settings_buf)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def _read(self):
+        blh = blhelihex.BLHeliHex()
+        blh.read(self.path, False)
+        return blh
+
+    def test_undo_redo(self):
+        self.blh['motor-timing'] = 5
+        with self.journal.group('profile'):
+            self.blh['pwm-freq'] = 2
+            self.blh['beep-strength'] = 3
+        self.assertEqual(len(self.journal.entries), 2)
+        self.assertEqual(self.journal.undo()[0], 'profile')
+        self.assertEqual((self.blh['pwm-freq'], self.blh['motor-timing']),
+                         (1, 5))
+        self.journal.undo()
+        self.assertEqual(str(self.blh.settings_buf), self.orig)
+        self.assertEqual(self.journal.undo(), None)
+        self.journal.redo()
+        self.journal.redo()
+        self.assertEqual(self.blh['beep-strength'], 3)
+        self.assertEqual(self.journal.redo(), None)
+
+    def test_unchanged_value_not_recorded(self):
+        self.blh['motor-timing'] = self.blh['motor-timing']
+        self.assertEqual(self.journal.entries, [])
+
+    def test_snapshots(self):
+        start = self.journal.snapshot()
+        self.blh['motor-timing'] = 5
+        middle = self.journal.snapshot()
+        self.blh['pwm-freq'] = 2
+        self.journal.restore(start)
+        self.assertEqual(str(self.blh.settings_buf), self.orig)
+        self.journal.restore(middle)
+        self.assertEqual((self.blh['motor-timing'], self.blh['pwm-freq']),
+                         (5, 1))
+        self.assertEqual(self.journal.snapshot(), middle)
+
+    def test_stale_snapshot(self):
+        self.blh['motor-timing'] = 5
+        self.blh['pwm-freq'] = 2
+        after = self.journal.snapshot()
+        self.journal.undo()
+        #a new edit replaces the undone one, at the same position
+        self.blh['beep-strength'] = 3
+        self.assertNotEqual(self.journal.snapshot(), after)
+        self.assertRaises(Exception, self.journal.restore, after)
+        self.assertRaises(Exception, self.journal.changes, after)
+        self.assertEqual(self.blh['beep-strength'], 3)
+
+    def test_snapshot_before_reload(self):
+        before = self.journal.snapshot()
+        self.blh['motor-timing'] = 5
+        self.blh.read(self.path, False)
+        self.assertEqual(self.journal.entries, [])
+        self.assertRaises(Exception, self.journal.restore, before)
+
+    def test_replay(self):
+        self.blh['motor-timing'] = 5
+        since = self.journal.snapshot()
+        self.blh['pwm-freq'] = 2
+        self.blh['pwm-freq'] = 3
+        self.assertEqual(self.journal.changes(since),
+                         [(self.blh.schema.pos[
+                             self.blh.schema.index['pwm-freq']], 3)])
+        other = self._read()
+        journal = blhelijournal.Journal(other)
+        self.journal.replay(other)
+        self.assertEqual(str(other.settings_buf), str(self.blh.settings_buf))
+        self.assertEqual(len(journal.entries), 1)
+        journal.undo()
+        self.assertEqual(str(other.settings_buf), self.orig)
+
+if __name__ == '__main__':
+    unittest.main()
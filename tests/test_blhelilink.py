@@ -0,0 +1,34 @@
+import unittest
+
+import blhelibatch
+import blhelicorpus
+import blhelilink
+
+class SimulatedLinkTest(unittest.TestCase):
+    def setUp(self):
+        self.escs = [blhelilink.SimulatedESC(blhelicorpus.silabs_image())
+                     for i in xrange(3)]
+        self.links = [esc.connect() for esc in self.escs]
+
+    def tearDown(self):
+        for link in self.links:
+            link.close()
+        for esc in self.escs:
+            esc.close()
+
+    def test_configure(self):
+        profile = blhelibatch.parse_profile('motor-timing=High')
+        results = blhelilink.configure(self.links, profile)
+        self.assertEqual([err for blh, err in results], [None] * 3)
+        for link in self.links:
+            self.assertEqual(link.read_settings().printable('motor-timing'),
+                             'High')
+
+    def test_close_joins_threads(self):
+        threads = [t for esc in self.escs for t, sock in esc._threads]
+        for esc in self.escs:
+            esc.close()
+        self.assertFalse(any(t.is_alive() for t in threads))
+
+if __name__ == '__main__':
+    unittest.main()
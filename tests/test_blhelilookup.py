@@ -0,0 +1,58 @@
+import unittest
+
+import blhelihex
+import blhelilookup
+
+class LookupTest(unittest.TestCase):
+    def setUp(self):
+        self.index = blhelilookup.index_for([blhelihex.BLHeliHex.SCHEMA])
+
+    def test_ranks(self):
+        lookup = self.index.lookup
+        self.assertEqual(lookup('motor-timing'),
+                         [('motor-timing', blhelilookup.NAME)])
+        self.assertEqual(lookup('ppm-m'),
+                         [('ppm-max-throttle', blhelilookup.PREFIX),
+                          ('ppm-min-throttle', blhelilookup.PREFIX)])
+        self.assertEqual(lookup('t-prot'),
+                         [('temp-protection', blhelilookup.ABBREV)])
+        self.assertEqual(lookup('Bidirectional'),
+                         [('motor-direction', blhelilookup.VALUE)])
+        self.assertEqual(lookup('bidir'),
+                         [('motor-direction', blhelilookup.VALUE_PREFIX)])
+        self.assertEqual(lookup('  '), [])
+
+    def test_best_first(self):
+        #'beacon' starts two names, shorter names first within a rank
+        self.assertEqual([name for name, rank in self.index.lookup('beacon')],
+                         ['beacon-delay', 'beacon-strength'])
+        #a name match beats a value match
+        matches = self.index.lookup('low')
+        self.assertEqual(matches[0], ('low-volt-limiter',
+                                      blhelilookup.PREFIX))
+        self.assertTrue(('motor-timing', blhelilookup.VALUE) in matches)
+
+    def test_find(self):
+        find = self.index.find
+        self.assertEqual(find('ppm-min'), 'ppm-min-throttle')
+        self.assertEqual(find('m-dir'), 'motor-direction')
+        self.assertEqual(find('ppm'), None)
+        self.assertEqual(find('nothing-like-it'), None)
+
+    def test_complete(self):
+        self.assertEqual(self.index.complete('motor-'),
+                         ['motor-direction', 'motor-gain', 'motor-timing'])
+        self.assertEqual(self.index.complete('zz'), [])
+        self.assertEqual(blhelilookup.common_prefix(
+            self.index.complete('ppm')), 'ppm-m')
+
+    def test_by_value(self):
+        self.assertEqual(self.index.by_value('bidir'),
+                         [('motor-direction', 3, 'Bidirectional')])
+
+    def test_cached(self):
+        schemas = [blhelihex.BLHeliHex.SCHEMA]
+        self.assertTrue(blhelilookup.index_for(schemas) is self.index)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import blhelicorpus
+import blhelihex
+import blhelimatrix
+
+@unittest.skipIf(blhelimatrix.numpy is None, 'needs numpy')
+class MatrixTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.paths = blhelicorpus.write_corpus(self.dir, 6)
+        self.bad = os.path.join(self.dir, 'bad.hex')
+        with open(self.bad, 'wb') as f:
+            f.write(':00000001FF\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _read(self, path):
+        blh = blhelihex.BLHeliHex()
+        blh.read(path, False)
+        return blh
+
+    def test_load(self):
+        for processes in (1, 2):
+            matrix, errors = blhelimatrix.SettingsMatrix.load(
+                self.paths + [self.bad], processes=processes)
+            self.assertEqual(matrix.paths, self.paths)
+            self.assertEqual([path for path, err in errors], [self.bad])
+            for path, row in zip(self.paths, matrix.values):
+                self.assertEqual(row.tolist(), self._read(path).vals.tolist())
+
+    def test_differences(self):
+        matrix, errors = blhelimatrix.SettingsMatrix.load(self.paths,
+                                                          processes=1)
+        ref = self._read(self.paths[0])
+        diffs = dict(matrix.differences(ref))
+        self.assertFalse(self.paths[0] in diffs)
+        for path in self.paths[1:]:
+            blh = self._read(path)
+            expected = [(name, blh.printable(name), ref.printable(name))
+                        for name in matrix.schema.names
+                        if blh[name] != ref[name]]
+            self.assertEqual(diffs.get(path, []), expected)
+        self.assertEqual(dict(matrix.differences(0)), diffs)
+
+    def test_counts(self):
+        matrix, errors = blhelimatrix.SettingsMatrix.load(self.paths,
+                                                          processes=1)
+        timings = [self._read(path)['motor-timing'] for path in self.paths]
+        self.assertEqual(matrix.column('motor-timing').tolist(), timings)
+        groups = matrix.group_by('motor-timing')
+        self.assertEqual(sorted(groups), sorted(set(timings)))
+        for value, rows in groups.iteritems():
+            self.assertEqual([timings[r] for r in rows],
+                             [value] * len(rows))
+        counts = matrix.value_counts('motor-timing')
+        self.assertEqual(sum(n for text, n in counts), len(self.paths))
+        self.assertEqual(counts[0][1], max(timings.count(t) for t in timings))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import blhelicorpus
+import blhelisession
+
+class SessionTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.paths = blhelicorpus.write_corpus(self.dir, 4)
+        self.session = blhelisession.BLHeliSession()
+        self.session.open(self.paths)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_set_undo_redo(self):
+        before = self.session['motor-timing']
+        self.session['motor-timing'] = 5
+        self.assertEqual(self.session['motor-timing'], [5] * 4)
+        self.assertTrue(self.session.undo())
+        self.assertEqual(self.session['motor-timing'], before)
+        self.assertTrue(self.session.redo())
+        self.assertEqual(self.session['motor-timing'], [5] * 4)
+
+    def test_unchanged_value_is_not_an_edit(self):
+        self.session['motor-timing'] = 5
+        self.session['motor-timing'] = 5
+        self.assertTrue(self.session.undo())
+        self.assertFalse(self.session.undo())
+
+    def test_unchanged_value_keeps_redo(self):
+        self.session['motor-timing'] = 3
+        self.session['motor-timing'] = 5
+        self.session.undo()
+        self.session['motor-timing'] = 3
+        self.assertTrue(self.session.redo())
+        self.assertEqual(self.session['motor-timing'], [5] * 4)
+
+    def test_invalid_value_changes_nothing(self):
+        before = self.session['motor-timing']
+        self.assertRaises(Exception, self.session.apply,
+                          [('motor-timing', 5), ('motor-timing', 99)])
+        self.assertEqual(self.session['motor-timing'], before)
+        self.assertFalse(self.session.undo())
+
+    def test_find(self):
+        self.assertEqual(self.session.find('m-dir'), 'motor-direction')
+        self.assertEqual(self.session.find('bidirectional'),
+                         'motor-direction')
+        self.assertEqual(self.session.find('motor'), None)
+
+    def test_save_to(self):
+        out = os.path.join(self.dir, 'out')
+        os.mkdir(out)
+        self.session['motor-timing'] = 5
+        results = self.session.save_to(out)
+        self.assertEqual([err for path, err in results], [None] * 4)
+        copy = blhelisession.BLHeliSession()
+        copy.open([path for path, err in results])
+        self.assertEqual(copy['motor-timing'], [5] * 4)
+
+    def test_save_to_same_name(self):
+        names = []
+        for i, path in enumerate(self.paths[:2]):
+            sub = os.path.join(self.dir, 'd%d' % i)
+            os.mkdir(sub)
+            names.append(os.path.join(sub, 'esc.hex'))
+            os.rename(path, names[-1])
+        session = blhelisession.BLHeliSession()
+        session.open(names + self.paths[2:])
+        out = os.path.join(self.dir, 'out')
+        os.mkdir(out)
+        results = session.save_to(out)
+        self.assertEqual([err is None for path, err in results],
+                         [False, False, True, True])
+        self.assertFalse(os.path.exists(os.path.join(out, 'esc.hex')))
+
+if __name__ == '__main__':
+    unittest.main()
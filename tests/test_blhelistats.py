@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import blhelicorpus
+import blhelihex
+import blhelistats
+
+class StatsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'a.hex')
+        with open(self.path, 'wb') as f:
+            f.write(blhelicorpus.silabs_image())
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_collecting(self):
+        with blhelistats.collecting() as stats:
+            blh = blhelihex.BLHeliHex()
+            blh.read(self.path, False)
+            blh['motor-timing'] = 5
+            blh.printable('motor-timing')
+            blh.printable('motor-timing')
+            blh.write(os.path.join(self.dir, 'b.hex'))
+            blh.patch()
+        phases = stats.phases
+        for phase in ('read', 'read.io', 'read.decode', 'set', 'write',
+                      'write.encode', 'write.io', 'patch'):
+            self.assertEqual(phases[phase][0], 1, phase)
+        #the memoized call isn't counted
+        self.assertEqual(phases['format'][0], 1)
+        self.assertEqual(phases['read'][1], os.path.getsize(self.path))
+        self.assertTrue(all(seconds >= 0
+                            for calls, nbytes, seconds in phases.values()))
+        self.assertTrue('patch' in stats.summary())
+
+    def test_uninstalled(self):
+        with blhelistats.collecting() as stats:
+            pass
+        blh = blhelihex.BLHeliHex()
+        blh.read(self.path, False)
+        self.assertEqual(stats.phases, {})
+        self.assertTrue(blhelihex.set_stats(None) is None)
+
+    def test_merge_and_reset(self):
+        stats = blhelistats.Stats()
+        stats.add('read', 10, 0.5)
+        stats.merge({'read': [2, 20, 1.0], 'write': [1, 5, 0.25]})
+        self.assertEqual(stats.phases, {'read': [3, 30, 1.5],
+                                        'write': [1, 5, 0.25]})
+        stats.reset()
+        self.assertEqual(stats.phases, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import blhelicorpus
+import blhelihex
+import blhelivariants
+import ihex
+
+class VariantTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.base_path = os.path.join(self.dir, 'base.hex')
+        with open(self.base_path, 'wb') as f:
+            f.write(blhelicorpus.silabs_image(0x4000, record_size=8))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _read(self, path):
+        blh = blhelihex.BLHeliHex()
+        blh.read(path, False)
+        return blh
+
+    def _path(self, name):
+        return os.path.join(self.dir, name)
+
+    def test_variants(self):
+        base = self._read(self.base_path)
+        variants = [(self._path('v%d.hex' % d), {'motor-direction': d})
+                    for d in (1, 2, 3)]
+        written = list(blhelivariants.write_variants(base, variants))
+        self.assertEqual(written, [v[0] for v in variants])
+        with open(self.base_path, 'rb') as f:
+            base_text = f.read()
+        for filename, overrides in variants:
+            with open(filename, 'rb') as f:
+                text = f.read()
+            self.assertEqual(ihex.verify(text), [])
+            self.assertEqual(len(text), len(base_text))
+            blh = self._read(filename)
+            self.assertEqual(blh['motor-direction'],
+                             overrides['motor-direction'])
+            self.assertEqual(blh['motor-timing'], base['motor-timing'])
+        #the base itself is untouched
+        self.assertEqual(self._read(self.base_path)['motor-direction'],
+                         base['motor-direction'])
+
+    def test_unsaved_base_changes(self):
+        base = self._read(self.base_path)
+        base['motor-timing'] = 4
+        writer = blhelivariants.VariantWriter(base)
+        writer.write(self._path('v.hex'), {'pwm-freq': 2})
+        blh = self._read(self._path('v.hex'))
+        self.assertEqual((blh['motor-timing'], blh['pwm-freq']), (4, 2))
+
+    def test_base_saved_after_writer(self):
+        base = self._read(self.base_path)
+        writer = blhelivariants.VariantWriter(base)
+        base['motor-timing'] = 5
+        base.write(self._path('b.hex'))
+        writer.write(self._path('v.hex'), {'motor-direction': 2})
+        blh = self._read(self._path('v.hex'))
+        self.assertEqual((blh['motor-timing'], blh['motor-direction']),
+                         (5, 2))
+        base['pwm-freq'] = 2
+        base.patch()
+        pos = base.schema.pos[base.schema.index['beep-strength']]
+        writer.write_changes(self._path('c.hex'), [(pos, 99)])
+        blh = self._read(self._path('c.hex'))
+        self.assertEqual((blh['motor-timing'], blh['pwm-freq'],
+                          blh['beep-strength']), (5, 2, 99))
+
+    def test_invalid_override(self):
+        writer = blhelivariants.VariantWriter(self._read(self.base_path))
+        self.assertRaises(Exception, writer.write, self._path('v.hex'),
+                          {'motor-timing': 77})
+        self.assertRaises(Exception, writer.write, self._path('v.hex'),
+                          {'no-such-setting': 1})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+import blhelicorpus
+import blhelihex
+import blheliwatch
+
+class StoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.paths = blhelicorpus.write_corpus(os.path.join(self.dir, 'a'), 3)
+        self.store = blheliwatch.SettingsStore([self.dir])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_scan(self):
+        added, changed, removed = self.store.scan()
+        self.assertEqual(sorted(added), self.paths)
+        self.assertEqual((changed, removed), ([], []))
+        self.assertEqual(self.store.scan(), ([], [], []))
+
+        with open(self.paths[0], 'ab') as f:
+            f.write('\n')
+        os.unlink(self.paths[1])
+        bad = os.path.join(self.dir, 'bad.hex')
+        with open(bad, 'wb') as f:
+            f.write(':00000001FF\n')
+        added, changed, removed = self.store.scan()
+        self.assertEqual((added, changed, removed),
+                         ([bad], [self.paths[0]], [self.paths[1]]))
+        good, errors = self.store.export(['motor-timing'])
+        self.assertEqual(sorted(good), [self.paths[0], self.paths[2]])
+        self.assertEqual(list(errors), [bad])
+
+    def test_update(self):
+        self.store.scan()
+        path = self.paths[0]
+        self.assertEqual(self.store.update(path, {'motor-timing': 'High'}),
+                         {'motor-timing': 'High'})
+        blh = blhelihex.BLHeliHex()
+        blh.read(path, False)
+        self.assertEqual(blh['motor-timing'], 5)
+        #the write isn't mistaken for a change made by someone else
+        self.assertEqual(self.store.scan(), ([], [], []))
+        self.assertRaises(Exception, self.store.update, path,
+                          {'motor-timing': 'Highest'})
+        self.assertEqual(self.store.settings(path, ['motor-timing']),
+                         {'motor-timing': 'High'})
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.paths = blhelicorpus.write_corpus(os.path.join(self.dir, 'a'), 2)
+        self.socket_path = os.path.join(self.dir, 'watch.sock')
+        self.store = blheliwatch.SettingsStore([self.dir])
+        self.store.scan()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _serve(self):
+        server = blheliwatch.WatchServer(self.socket_path, self.store)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        def stop():
+            server.shutdown()
+            thread.join()
+            server.server_close()
+        self.addCleanup(stop)
+        return server
+
+    def test_requests(self):
+        self._serve()
+        request = lambda req: blheliwatch.request(self.socket_path, req)
+        self.assertEqual(request({'op': 'list'}),
+                         {'ok': True, 'paths': self.paths})
+        answer = request({'op': 'set', 'path': self.paths[1],
+                          'values': {'motor-timing': 4}})
+        self.assertEqual(answer['settings'], {'motor-timing': 'MediumHigh'})
+        answer = request({'op': 'get', 'path': self.paths[1],
+                          'settings': ['motor-timing']})
+        self.assertEqual(answer['settings'], {'motor-timing': 'MediumHigh'})
+        answer = request({'op': 'export'})
+        self.assertEqual(sorted(answer['files']), self.paths)
+        self.assertEqual(request({'op': 'status'})['files'], 2)
+        for req in ({'op': 'nope'}, {'op': 'get', 'path': '/nope.hex'}):
+            answer = request(req)
+            self.assertFalse(answer['ok'])
+            self.assertTrue(answer['error'])
+
+    def test_stale_socket_is_replaced(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.socket_path)
+        sock.close()
+        self._serve()
+        self.assertTrue(blheliwatch.request(self.socket_path,
+                                            {'op': 'list'})['ok'])
+
+    def test_live_socket_is_kept(self):
+        self._serve()
+        self.assertRaises(Exception, blheliwatch.WatchServer,
+                          self.socket_path, self.store)
+        self.assertTrue(blheliwatch.request(self.socket_path,
+                                            {'op': 'list'})['ok'])
+
+    def test_other_file_is_kept(self):
+        with open(self.socket_path, 'wb') as f:
+            f.write('data')
+        self.assertRaises(Exception, blheliwatch.WatchServer,
+                          self.socket_path, self.store)
+        with open(self.socket_path, 'rb') as f:
+            self.assertEqual(f.read(), 'data')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+import blhelicorpus
+import ihex
+
+def _hex(*records):
+    lines = [ihex.encode_record(address, rtype, bytearray(data))
+             for address, rtype, data in records]
+    return '\n'.join(lines) + '\n'
+
+EOF_RECORD = (0, ihex.EOF, '')
+
+class VerifyTest(unittest.TestCase):
+    def test_valid(self):
+        self.assertEqual(ihex.verify(blhelicorpus.silabs_image(0x20000)), [])
+
+    def test_out_of_order(self):
+        text = _hex((0x10, ihex.DATA, 'b' * 16), (0, ihex.DATA, 'a' * 16),
+                    EOF_RECORD)
+        self.assertEqual(ihex.verify(text), [])
+        image = ihex.HexImage()
+        image.load(text)
+        self.assertEqual(image.read(0, 2), bytearray('aa'))
+
+    def test_overlap(self):
+        text = _hex((0x10, ihex.DATA, 'b' * 16), (0, ihex.DATA, 'a' * 16),
+                    (0x18, ihex.DATA, 'c' * 4), EOF_RECORD)
+        errors = ihex.verify(text)
+        self.assertEqual([e['kind'] for e in errors], ['address'])
+        self.assertEqual(errors[0]['line'], 3)
+
+    def test_overlap_across_segments(self):
+        text = _hex((0, ihex.EXT_LINEAR_ADDR, [0, 1]),
+                    (0, ihex.DATA, 'a' * 16),
+                    (0, ihex.EXT_LINEAR_ADDR, [0, 0]),
+                    (0, ihex.DATA, 'b' * 16),
+                    (0, ihex.EXT_LINEAR_ADDR, [0, 1]),
+                    (8, ihex.DATA, 'c' * 16), EOF_RECORD)
+        self.assertEqual([e['line'] for e in ihex.verify(text)], [6])
+
+    def test_checksum_and_eof(self):
+        text = _hex((0, ihex.DATA, 'a' * 16))
+        text = text[:-3] + ('00' if text[-3:-1] != '00' else '01') + '\n'
+        kinds = sorted(e['kind'] for e in ihex.verify(text))
+        self.assertEqual(kinds, ['checksum', 'eof'])
+
+    def test_line_numbers(self):
+        text = '\r\n\r\n' + _hex((0, ihex.DATA, 'a' * 16)) + 'zz\n\n:0100\n'
+        errors = ihex.verify(text)
+        self.assertEqual([(e['kind'], e['line']) for e in errors],
+                         [('start', 4), ('length', 6), ('eof', 7)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import json
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+import blhelicorpus
+import blhelihex
+import pyblheli
+
+class ScriptTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'a.hex')
+        with open(self.path, 'wb') as f:
+            f.write(blhelicorpus.silabs_image())
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _run(self, lines, as_json=True, keep_going=False):
+        out = StringIO.StringIO()
+        ok = pyblheli.run_script(lines, out, as_json, keep_going)
+        return ok, out.getvalue()
+
+    def test_json(self):
+        out_path = os.path.join(self.dir, 'out.hex')
+        ok, text = self._run(['# set the timing', 'oh %s' % self.path, '',
+                              'es motor-timing 5', 'vs m-tim',
+                              'fs bidir', 'sh %s' % out_path])
+        self.assertTrue(ok)
+        results = [json.loads(line) for line in text.splitlines()]
+        self.assertEqual([r['command'] for r in results],
+                         ['oh %s' % self.path, 'es motor-timing 5',
+                          'vs m-tim', 'fs bidir', 'sh %s' % out_path])
+        self.assertTrue(all(r['ok'] for r in results))
+        self.assertEqual(results[1]['settings'], {'motor-timing': 'High'})
+        self.assertEqual(results[2]['settings'], {'motor-timing': 'High'})
+        self.assertEqual(results[3]['settings'], ['motor-direction'])
+        blh = blhelihex.BLHeliHex()
+        blh.read(out_path, False)
+        self.assertEqual(blh['motor-timing'], 5)
+
+    def test_stops_at_failure(self):
+        lines = ['oh %s' % self.path, 'bogus', 'vs motor-timing']
+        ok, text = self._run(lines)
+        self.assertFalse(ok)
+        results = [json.loads(line) for line in text.splitlines()]
+        self.assertEqual([r['ok'] for r in results], [True, False])
+        self.assertTrue(results[1]['output'].startswith('ERROR'))
+        ok, text = self._run(lines, keep_going=True)
+        self.assertFalse(ok)
+        self.assertEqual(len(text.splitlines()), 3)
+
+    def test_text(self):
+        ok, text = self._run(['oh %s' % self.path, 'vs motor-timing'],
+                             as_json=False)
+        self.assertTrue(ok)
+        self.assertTrue('motor-timing => Low\n' in text)
+
+if __name__ == '__main__':
+    unittest.main()